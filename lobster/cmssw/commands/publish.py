@@ -22,6 +22,7 @@ from WMCore.Storage.TrivialFileCatalog import readTFC
 from dbs.apis.dbsClient import DbsApi
 
 from lobster import fs, se, util
+from lobster.core.artifacts import ArtifactStore
 from lobster.core.command import Command
 from lobster.core.unit import UnitStore
 
@@ -245,10 +246,10 @@ class Publish(Command):
 
         return block
 
-    def prepare_file(self, dataset, block, user, taskdir, datasetdir, stageoutdir):
-        with open(os.path.join(taskdir, 'report.json')) as f:
+    def prepare_file(self, dataset, block, user, artifacts, task, datasetdir, stageoutdir):
+        with artifacts.open(task, 'report.json') as f:
             report = json.load(f)
-        with open(os.path.join(taskdir, 'parameters.json')) as f:
+        with artifacts.open(task, 'parameters.json') as f:
             parameters = json.load(f)
 
         local, remote = parameters['output files'][0]
@@ -289,7 +290,7 @@ class Publish(Command):
 
         return file_
 
-    def insert_block(self, dbs, primary_dataset, dataset, user, config, basedir, datasetdir, stageoutdir, chunk):
+    def insert_block(self, dbs, primary_dataset, dataset, user, config, artifacts, datasetdir, stageoutdir, chunk):
         block = self.prepare_block(dataset, user)
 
         files = []
@@ -300,9 +301,8 @@ class Publish(Command):
         logger.info('preparing DBS entry for {} task block: {}'.format(len(chunk), block['block_name']))
 
         for task, _ in chunk:
-            taskdir = os.path.join(basedir, util.id2dir(task))
             try:
-                files.append(self.prepare_file(dataset, block, user, taskdir, datasetdir, stageoutdir))
+                files.append(self.prepare_file(dataset, block, user, artifacts, task, datasetdir, stageoutdir))
                 cfg = config.copy()
                 cfg['lfn'] = files[-1]['logical_file_name']
                 configs.append(cfg)
@@ -402,14 +402,14 @@ class Publish(Command):
 
                 first_task = 0
                 inserted = []
-                basedir = os.path.join(args.config.workdir, label, 'successful')
+                artifacts = ArtifactStore(os.path.join(args.config.workdir, label), readonly=True)
                 datasetdir = os.path.join('/store/user', user, dset, publish_label + '_' + publish_hash)
 
                 config = self.__get_config(args, label, pset_hash)
 
                 while first_task < len(tasks):
                     chunk = tasks[first_task:first_task + args.block_size]
-                    processed, block = self.insert_block(dbs, primary_dataset, dataset, user, config, basedir, datasetdir, stageoutdir, chunk)
+                    processed, block = self.insert_block(dbs, primary_dataset, dataset, user, config, artifacts, datasetdir, stageoutdir, chunk)
                     inserted += processed
                     first_task += args.block_size
 
@@ -3,7 +3,9 @@ import logging
 import os
 import socket
 import subprocess
+import threading
 
+from collections import OrderedDict
 from hashlib import sha1
 
 from WMCore.Services.Dashboard.DashboardAPI import DashboardAPI, DASHBOARDURL
@@ -37,6 +39,10 @@ status_map = {
     wq.WORK_QUEUE_TASK_CANCELED: ABORTED
 }
 
+# Maximum number of messages waiting to be sent to the dashboard.  Further
+# messages are dropped.
+QUEUE_SIZE = 100000
+
 
 def patch_dash(dash):
     """Patch inconsistent WMCore
@@ -54,6 +60,129 @@ def patch_dash(dash):
     dash.__dict__['_getApMonInstance'] = new_apmon
 
 
+class Sender(object):
+
+    """
+    Send messages to the dashboard in the background.
+
+    Messages are queued by type and job id, and a pending message is
+    replaced by a newer one for the same type and job.  The queue is
+    emptied in batches, one per message type, sending task, job
+    registration, and status messages in this order.  When more than
+    `size` messages are pending, new ones are dropped, so that an
+    unreachable dashboard never blocks the caller.  Call :meth:`stop` to
+    send the remaining messages and end the background thread.
+
+    Parameters
+    ----------
+    size : int
+        The maximum number of messages pending.
+    """
+
+    kinds = ('TaskMeta', 'JobMeta', 'JobStatus')
+
+    def __init__(self, size=QUEUE_SIZE):
+        self.__size = size
+        self.__pending = OrderedDict()
+        self.__dropped = 0
+        self.__busy = False
+        self.__stopped = False
+        self.__dash = None
+        self.__cond = threading.Condition()
+        self.__thread = threading.Thread(target=self.__run, name='dashboard')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def put(self, kind, data):
+        with self.__cond:
+            for params in data:
+                key = (kind, params['jobId'])
+                if key not in self.__pending and len(self.__pending) >= self.__size:
+                    self.__dropped += 1
+                    continue
+                params['MessageType'] = kind
+                params['MessageTS'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+                self.__pending[key] = params
+            self.__cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait for all pending messages to be sent, at most `timeout`
+        seconds.
+        """
+        end = time.time() + timeout if timeout is not None else None
+        with self.__cond:
+            while self.__pending or self.__busy:
+                remaining = end - time.time() if end is not None else 60
+                if remaining <= 0:
+                    logger.warning("could not send {0} dashboard messages".format(len(self.__pending)))
+                    return
+                self.__cond.wait(remaining)
+
+    def stop(self, timeout=None):
+        """Send the pending messages, waiting at most `timeout` seconds,
+        and end the background thread.  Messages not sent by then are
+        dropped.
+        """
+        self.flush(timeout)
+        with self.__cond:
+            self.__stopped = True
+            self.__pending = OrderedDict()
+            self.__cond.notify_all()
+        self.__thread.join(timeout)
+
+    def __send(self, data):
+        if not self.__dash:
+            lggr = logging.getLogger("WMCore")
+            lggr.setLevel(logging.FATAL)
+            self.__dash = DashboardAPI(logr=lggr)
+            patch_dash(self.__dash)
+        with self.__dash as dashboard:
+            for params in data:
+                dashboard.apMonSend(params)
+
+    def __run(self):
+        try:
+            while self.__step():
+                pass
+        except Exception:
+            # The thread may still run while the interpreter shuts down,
+            # with the contents of modules already cleared.
+            try:
+                logger.exception("dashboard messages can't be sent any longer")
+            except Exception:
+                pass
+
+    def __step(self):
+        """Send one batch of messages, and return whether to continue.
+        """
+        with self.__cond:
+            while not self.__pending and not self.__stopped:
+                self.__cond.wait(60)
+            if self.__stopped:
+                return False
+            batch = self.__pending
+            dropped = self.__dropped
+            self.__pending = OrderedDict()
+            self.__dropped = 0
+            self.__busy = True
+
+        if dropped > 0:
+            logger.warning("dropped {0} dashboard messages, too many pending".format(dropped))
+        for kind in self.kinds:
+            data = [params for (k, _), params in batch.items() if k == kind]
+            if len(data) == 0:
+                continue
+            try:
+                self.__send(data)
+            except Exception:
+                logger.exception("could not send {0} dashboard messages".format(len(data)))
+
+        with self.__cond:
+            self.__busy = False
+            self.__cond.notify_all()
+        return True
+
+
 class Monitor(object):
 
     def setup(self, config):
@@ -76,7 +205,13 @@ class Monitor(object):
     def update_tasks(self, queue, exclude):
         pass
 
-    def free(self):
+    def free(self, timeout=60):
+        """Release resources at the end of processing, sending pending
+        messages for at most `timeout` seconds.
+        """
+        pass
+
+    def flush(self, timeout=None):
         pass
 
 
@@ -86,6 +221,7 @@ class Dashboard(Monitor, util.Configurable):
     Dashboard support for CMS.
 
     Will send task information to the CMS dashboard for global monitoring.
+    Messages are sent in the background, see :class:`Sender`.
 
     Parameters
     ----------
@@ -110,7 +246,8 @@ class Dashboard(Monitor, util.Configurable):
 
         self.__cmssw_version = 'Unknown'
         self.__executable = 'Unknown'
-        self.__dash = None
+        self.__sender = None
+        self.__seid = None
 
         try:
             self._ce = loadSiteLocalConfig().siteName
@@ -120,8 +257,7 @@ class Dashboard(Monitor, util.Configurable):
 
     def __getstate__(self):
         state = dict(self.__dict__)
-        del state['_Dashboard__dash']
-        state['_Dashboard__dash'] = None
+        state['_Dashboard__sender'] = None
         return state
 
     def __get_distinguished_name(self):
@@ -138,28 +274,30 @@ class Dashboard(Monitor, util.Configurable):
     def send(self, kind, data):
         if isinstance(data, dict):
             data = [data]
-        if not self.__dash:
-            lggr = logging.getLogger("WMCore")
-            lggr.setLevel(logging.FATAL)
-            with util.PartiallyMutable.unlock():
-                self.__dash = DashboardAPI(logr=lggr)
-                patch_dash(self.__dash)
-        with self.__dash as dashboard:
-            for params in data:
-                params['MessageType'] = kind
-                params['MessageTS'] = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
-                dashboard.apMonSend(params)
+        # not pickled, and stopped by `free`: start a new one when needed
+        if not self.__sender:
+            self.__sender = Sender()
+        self.__sender.put(kind, data)
+
+    def flush(self, timeout=None):
+        if self.__sender:
+            self.__sender.flush(timeout)
+
+    def free(self, timeout=60):
+        if self.__sender:
+            self.__sender.stop(timeout)
+            self.__sender = None
 
     def setup(self, config):
         super(Dashboard, self).setup(config)
+        self.__seid = 'https://{}/{}'.format(self._ce, sha1(self._workflowid).hexdigest()[-16:])
         if util.checkpoint(config.workdir, "sandbox cmssw version"):
             self.__cmssw_version = str(util.checkpoint(config.workdir, "sandbox cmssw version"))
         if util.checkpoint(config.workdir, "executable"):
             self.__executable = str(util.checkpoint(config.workdir, "executable"))
 
     def generate_ids(self, taskid):
-        seid = 'https://{}/{}'.format(self._ce, sha1(self._workflowid).hexdigest()[-16:])
-        monitorid = '{0}_{1}/{0}'.format(taskid, seid)
+        monitorid = '{0}_{1}/{0}'.format(taskid, self.__seid)
         syncid = 'https://{}//{}//12345.{}'.format(self._ce, self._workflowid, taskid)
 
         return monitorid, syncid
@@ -183,7 +321,6 @@ class Dashboard(Monitor, util.Configurable):
             'resubmitter': 'user',
             'exe': self.__executable
         })
-        self.free()
 
     def register_tasks(self, ids):
         data = []
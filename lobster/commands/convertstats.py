@@ -0,0 +1,30 @@
+import glob
+import logging
+import os
+
+from lobster.core.command import Command
+from lobster.core.statslog import convert
+
+logger = logging.getLogger('lobster.convertstats')
+
+
+class ConvertStats(Command):
+
+    @property
+    def help(self):
+        return 'convert the statistics logs of a project to the binary format'
+
+    def setup(self, argparser):
+        argparser.add_argument('--remove', action='store_true', default=False,
+                               help='remove the text logs after converting them')
+
+    def run(self, args):
+        for textfile in sorted(glob.glob(os.path.join(args.config.workdir, 'lobster_stats_*.log'))):
+            filename = textfile[:-4] + '.dat'
+            if os.path.exists(filename):
+                logger.warning("{0} exists already, skipping {1}".format(filename, textfile))
+                continue
+            count = convert(textfile, filename)
+            logger.info("converted {0} samples of {1}".format(count, textfile))
+            if args.remove:
+                os.unlink(textfile)
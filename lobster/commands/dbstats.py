@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+import sqlite3
+
+from lobster.core import unit
+from lobster.core.command import Command
+
+
+logger = logging.getLogger('lobster.dbstats')
+
+
+class DBStats(Command):
+
+    ignored = ('begin', 'commit', 'create', 'pragma', 'release', 'rollback', 'savepoint')
+
+    @property
+    def help(self):
+        return 'show the slowest database statements and their query plans'
+
+    def setup(self, argparser):
+        argparser.add_argument('--top', type=int, default=10,
+                               help='number of statements to show')
+        argparser.add_argument('--sort', choices=['total', 'max', 'calls'], default='total',
+                               help='order statements by total time, maximal time, or calls')
+
+    def explain(self, db, sql):
+        """Return the query plan of `sql` against the current schema.
+
+        Placeholders are bound to `NULL`, which does not affect the choice
+        of indices.
+        """
+        try:
+            rows = db.execute('explain query plan ' + sql, (None,) * sql.count('?')).fetchall()
+        except sqlite3.Error as e:
+            return ['n/a: {0}'.format(e)]
+        return [row[-1] for row in rows]
+
+    def run(self, args):
+        store = unit.UnitStore(args.config, readonly=True)
+        if not os.path.exists(store.stats_path):
+            logger.error("no statement statistics found in {0}".format(args.config.workdir))
+            return
+        with open(store.stats_path) as f:
+            stats = json.load(f)
+
+        # Schema changes and transaction control have no query plan
+        statements = [(sql, s) for sql, s in stats.items()
+                      if sql.split()[0].lower() not in self.ignored]
+
+        column = {'calls': 0, 'total': 1, 'max': 2}[args.sort]
+        ranked = sorted(statements, key=lambda (sql, s): s[column], reverse=True)
+
+        report = []
+        for sql, (calls, total, longest, rows) in ranked[:args.top]:
+            report.append(
+                '{0:>10} calls {1:10.3f} s total {2:8.3f} ms mean {3:8.3f} ms max {4:>10} rows\n'.format(
+                    calls, total, total / calls * 1e3, longest * 1e3, rows) +
+                '    ' + sql + '\n' +
+                '\n'.join('      ' + line for line in self.explain(store.db, sql)))
+        logger.info("database statements by {0}:\n".format(args.sort) + '\n\n'.join(report))
@@ -1,4 +1,20 @@
+import datetime as dt
+import glob
+import gzip
+import json
+import logging
+import numpy as np
+import os
+
+from multiprocessing.pool import ThreadPool
+
+from lobster import util
+from lobster.core import unit
+from lobster.core.artifacts import ArtifactStore
 from lobster.core.command import Command
+from lobster.core.statslog import StatsLog, convert
+
+logger = logging.getLogger('lobster.elk')
 
 
 class ElkDownload(Command):
@@ -35,3 +51,161 @@ class ElkCleanup(Command):
 
     def run(self, args):
         args.config.elk.cleanup()
+
+
+def number(value):
+    return int(value) if value == int(value) else value
+
+
+class ElkBackfill(Command):
+
+    """
+    Index the history of a project into Elasticsearch.
+
+    Streams the task table, the statistics logs, and the task logs into
+    the Elasticsearch indices, using the bulk API.  Progress is saved
+    in `elk_backfill.json` in the working directory after every chunk has
+    been delivered, and an interrupted backfill continues where it
+    stopped.
+    """
+
+    chunk = 5000
+
+    @property
+    def help(self):
+        return 'index the tasks, statistics and task logs of a project into Elasticsearch'
+
+    def setup(self, argparser):
+        argparser.add_argument('--workers', type=int, default=4,
+                               help='number of threads reading task logs and sending documents')
+        argparser.add_argument('--no-logs', action='store_false', dest='logs', default=True,
+                               help='do not index task logs')
+        argparser.add_argument('--restart', action='store_true', default=False,
+                               help='ignore the progress of a previous backfill')
+
+    def confirm(self, elk, progress):
+        """Save `progress` once all documents shipped so far have been
+        delivered.
+        """
+        if not elk.flush(600):
+            raise IOError("can't deliver documents to Elasticsearch; rerun to continue the backfill")
+        self.save(progress)
+
+    def save(self, progress):
+        tmp = self.checkpoint + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(progress, f)
+        os.rename(tmp, self.checkpoint)
+
+    def read_log(self, arg):
+        store, id, status = arg
+        try:
+            with gzip.GzipFile(fileobj=store.open(id, 'task.log.gz', status)) as f:
+                return id, f.read()
+        except IOError:
+            return id, None
+
+    def index_tasks(self, config, elk, store, progress):
+        labels = dict(store.db.execute("select id, label from workflows"))
+        artifacts = dict((id, ArtifactStore(os.path.join(config.workdir, label), readonly=True))
+                         for id, label in labels.items())
+        known = vars(unit.TaskUpdate())
+        pool = ThreadPool(self.workers)
+
+        while True:
+            cur = store.db.execute("""
+                select * from (
+                    select * from tasks where id>? and time_retrieved>0
+                    union all
+                    select * from tasks_archive where id>? and time_retrieved>0)
+                order by id
+                limit ?""", (progress['tasks'],) * 2 + (self.chunk,))
+            fields = [xs[0] for xs in cur.description]
+            rows = [dict(zip(fields, row)) for row in cur.fetchall()]
+            if len(rows) == 0:
+                break
+
+            logs = []
+            for row in rows:
+                elk.index_task_update(unit.TaskUpdate(**dict((k, v) for k, v in row.items() if k in known)))
+                status = 'failed' if row['status'] in (unit.FAILED, unit.ABORTED) else 'successful'
+                logs.append((artifacts[row['workflow']], row['id'], status))
+
+            if self.logs:
+                for id, text in pool.imap_unordered(self.read_log, logs):
+                    if text is not None:
+                        elk.ship('index', elk.prefix + '_lobster_task_logs', 'log', id, {'text': text})
+
+            progress['tasks'] = rows[-1]['id']
+            self.confirm(elk, progress)
+            logger.info("indexed tasks up to id {0}".format(progress['tasks']))
+
+        pool.close()
+        pool.join()
+
+    def index_stats(self, config, elk, progress):
+        for textfile in glob.glob(os.path.join(config.workdir, 'lobster_stats_*.log')):
+            if not os.path.exists(textfile[:-4] + '.dat'):
+                logger.info("converting {0}".format(textfile))
+                convert(textfile, textfile[:-4] + '.dat')
+
+        for fn in sorted(glob.glob(os.path.join(config.workdir, 'lobster_stats_*.dat'))):
+            category = os.path.basename(fn)[len('lobster_stats_'):-len('.dat')]
+            last = progress['stats'].get(category)
+            # Do not unroll cumulative fields against unrelated documents
+            elk.previous_stats[category] = None
+
+            log = StatsLog(fn)
+            count = 0
+            for row in log.read(start=last):
+                stats = dict((k, number(v)) for k, v in zip(log.fields, row)
+                             if not k.startswith('total_source_') and not np.isnan(v))
+                id = stats['timestamp']
+                stats['timestamp'] = dt.datetime.utcfromtimestamp(id // 1000000)
+                stats['category'] = category
+                if last is not None and id <= last:
+                    elk.previous_stats[category] = stats
+                    continue
+
+                elk.index_stats_document(stats, category, str(id))
+                count += 1
+                if count % self.chunk == 0:
+                    progress['stats'][category] = id
+                    self.confirm(elk, progress)
+
+            if count > 0:
+                progress['stats'][category] = id
+                self.confirm(elk, progress)
+            logger.info("indexed {0} statistics entries of {1}".format(count, category))
+
+    def run(self, args):
+        config = args.config
+        elk = config.elk
+        if not elk:
+            logger.error("no ELK monitoring configured")
+            return
+
+        self.workers = args.workers
+        self.logs = args.logs
+        self.checkpoint = os.path.join(config.workdir, 'elk_backfill.json')
+
+        progress = {'tasks': 0, 'stats': {}}
+        if os.path.exists(self.checkpoint) and not args.restart:
+            with open(self.checkpoint) as f:
+                progress = json.load(f)
+            logger.info("continuing previous backfill after task {0}".format(progress['tasks']))
+
+        with util.PartiallyMutable.unlock():
+            elk.setup(config, spool='elk_backfill_spool.json', threads=args.workers, blocking=True)
+        if not elk.client.indices.exists(elk.prefix + '*'):
+            categories = dict((w.category.name, []) for w in config.workflows)
+            for w in config.workflows:
+                categories[w.category.name].append(w.label)
+            elk.create(categories)
+
+        store = unit.UnitStore(config, readonly=True)
+        self.index_tasks(config, elk, store, progress)
+        self.index_stats(config, elk, progress)
+        elk.index_summary(store.workflow_status())
+        self.confirm(elk, progress)
+        logger.info("backfill complete")
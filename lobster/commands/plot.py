@@ -3,7 +3,6 @@
 from collections import defaultdict, Counter
 from cycler import cycler
 from datetime import datetime
-import glob
 import gzip
 import itertools
 import jinja2
@@ -12,12 +11,10 @@ import multiprocessing
 import os
 import pickle
 import shutil
-import sqlite3
 import signal
 import time
 import re
 import string
-import json
 
 import matplotlib
 matplotlib.use('Agg')
@@ -30,7 +27,9 @@ from scipy.interpolate import UnivariateSpline
 
 from lobster import util
 from lobster.core import unit
+from lobster.core.artifacts import ArtifactStore
 from lobster.core.command import Command
+from lobster.core.statslog import StatsHistory
 
 from WMCore.DataStructs.LumiList import LumiList
 
@@ -88,14 +87,15 @@ def unix2matplotlib(time):
 
 
 def unpack(arg):
-    source, target = arg
+    workdir, id, name, target = arg
+    source = "{0} of task {1} in {2}".format(name, id, workdir)
     try:
         if os.path.isfile(target):
             logger.info("skipping {0}".format(source))
             return
         logger.info("unpacking {0}".format(source))
         with open(target, 'w') as output:
-            input = gzip.open(source, 'rb')
+            input = gzip.GzipFile(fileobj=ArtifactStore(workdir, readonly=True).open(id, name, 'failed'))
             output.writelines(input)
             input.close()
     except IOError:
@@ -403,7 +403,6 @@ class Plotter(object):
     def __init__(self, config, outdir=None, paper=False):
         self.config = config
         self.__paper = paper
-        self.__store = unit.UnitStore(config)
 
         util.verify(self.config.workdir)
 
@@ -440,8 +439,7 @@ class Plotter(object):
 
     def readdb(self):
         logger.debug('reading database')
-        db = sqlite3.connect(os.path.join(
-            self.config.workdir, 'lobster.db'), timeout=90)
+        db = self.__store.db
 
         self.wflow_ids = {}
         self.wflow_labels = {}
@@ -452,9 +450,10 @@ class Plotter(object):
             wflow_cores[id_] = getattr(
                 self.config.workflows, label).category.cores
 
-        cur = db.execute(
-            "select * from tasks where time_retrieved>=? and time_retrieved<=?",
-            (self.__xmin, self.__xmax))
+        cur = db.execute("""
+            select * from tasks where time_retrieved>=? and time_retrieved<=?
+            union all
+            select * from tasks_archive where time_retrieved>=? and time_retrieved<=?""", (self.__xmin, self.__xmax) * 2)
         fields = [xs[0] for xs in cur.description]
         textfields = ['host', 'published_file_block']
         formats = ['i4' if f not in textfields else 'a100' for f in fields]
@@ -477,33 +476,36 @@ class Plotter(object):
         completed_units = []
         units_processed = {}
         transfers = {}
+        # units of archived tasks are still processed
+        alltasks = """(
+            select id, time_retrieved from tasks
+            union all
+            select id, time_retrieved from tasks_archive
+        ) as tasks"""
         for (label,) in db.execute("select label from workflows"):
             total_units += db.execute(
-                "select count(*) from units_{0}".format(label)).fetchone()[0]
+                "select ifnull(sum(lumis), 0) from units_{0}".format(label)).fetchone()[0]
             start_units += db.execute("""
                 select count(*)
-                from units_{0}, tasks
+                from units_{0}, {1}
                 where units_{0}.task == tasks.id
                     and (units_{0}.status=2 or units_{0}.status=6)
-                    and time_retrieved<=?""".format(label), (self.__xmin,)).fetchone()[0]
+                    and time_retrieved<=?""".format(label, alltasks), (self.__xmin,)).fetchone()[0]
             completed_units.append(np.array(db.execute("""
                 select units_{0}.id, tasks.time_retrieved
-                from units_{0}, tasks
+                from units_{0}, {1}
                 where units_{0}.task == tasks.id
                     and (units_{0}.status=2 or units_{0}.status=6)
-                    and time_retrieved>=? and time_retrieved<=?""".format(label),
+                    and time_retrieved>=? and time_retrieved<=?""".format(label, alltasks),
                                                        (self.__xmin, self.__xmax)).fetchall(),
                                             dtype=[('id', 'i4'), ('time_retrieved', 'i4')]))
             units_processed[label] = db.execute("""
                 select units_{0}.run,
                 units_{0}.lumi
-                from units_{0}, tasks
+                from units_{0}, {1}
                 where units_{0}.task == tasks.id
-                    and (units_{0}.status in (2, 6))""".format(label)).fetchall()
-            transfers[label] = json.loads(db.execute("""
-                select transfers
-                from workflows
-                where label=?""", (label,)).fetchone()[0])
+                    and (units_{0}.status in (2, 6))""".format(label, alltasks)).fetchall()
+            transfers[label] = self.__store.transfers(label)
 
         logger.debug('finished reading database')
 
@@ -514,29 +516,48 @@ class Plotter(object):
             fn = filename
         else:
             fn = os.path.join(self.config.workdir,
-                              'lobster_stats_{}.log'.format(category))
+                              'lobster_stats_{}.dat'.format(category))
+            if not os.path.exists(fn):
+                # project not converted to binary statistics yet
+                fn = fn[:-4] + '.log'
+
+        if fn.endswith('.dat'):
+            log = StatsHistory(fn)
+            headers = dict((k, n) for n, k in enumerate(log.fields))
+            bounds = log.bounds()
+            if bounds is None:
+                logger.warning("no statistics recorded in {0} yet, skipping".format(fn))
+                return None
+            first, last = [t / 1e6 for t in bounds]
+            stats = None
+        else:
+            with open(fn) as f:
+                headers = dict(map(lambda (a, b): (b, a),
+                                   enumerate(f.readline()[1:].split())))
+            stats = np.loadtxt(fn)
+            # fix units of time
+            stats[:, 0] /= 1e6
+            first, last = stats[0, 0], stats[-1, 0]
+
+        if not filename and category == 'all':
+            self.__total_xmin = first
+            self.__total_xmax = last
 
-        with open(fn) as f:
-            headers = dict(map(lambda (a, b): (b, a),
-                               enumerate(f.readline()[1:].split())))
-        stats = np.loadtxt(fn)
+            if not self.__xmin:
+                self.__xmin = first
+            if not self.__xmax:
+                self.__xmax = last
 
-        # fix units of time
-        stats[:, 0] /= 1e6
+        if stats is None:
+            # only read the requested window
+            stats = log.read(self.__xmin * 1e6 if self.__xmin else None,
+                             self.__xmax * 1e6 if self.__xmax else None)
+            stats[:, 0] /= 1e6
 
         for label in ['joined', 'removed', 'lost', 'idled_out', 'fast_aborted', 'blacklisted', 'released']:
             field = 'workers_{}'.format(label)
             stats[:, headers[field]] = np.maximum(stats[:, headers[field]] - np.roll(stats[:, headers[field]], 1, 0), 0)
 
-        if not filename and category == 'all':
-            self.__total_xmin = stats[0, 0]
-            self.__total_xmax = stats[-1, 0]
-
-            if not self.__xmin:
-                self.__xmin = stats[0, 0]
-            if not self.__xmax:
-                self.__xmax = stats[-1, 0]
-
         return headers, stats[np.logical_and(stats[:, 0] >= self.__xmin, stats[:, 0] <= self.__xmax)]
 
     def savejsons(self, processed):
@@ -569,7 +590,7 @@ class Plotter(object):
         work = []
         codes = {}
 
-        for exit_code, tasks in zip(*split_by_column(failed_tasks[['id', 'exit_code']], 'exit_code')):
+        for exit_code, tasks in zip(*split_by_column(failed_tasks[['id', 'exit_code', 'workflow']], 'exit_code')):
             if exit_code == 0:
                 continue
 
@@ -577,18 +598,13 @@ class Plotter(object):
 
             logger.info(
                 "Copying sample logs for exit code {0}".format(exit_code))
-            for id, e in list(tasks[-samples:]):
-                try:
-                    source = glob.glob(os.path.join(
-                        self.config.workdir, '*', 'failed', util.id2dir(id)))[0]
-                except IndexError:
-                    continue
-
-                s = os.path.join(source, 'task.log.gz')
-                t = os.path.join(logdir, str(id) + '.log')
-                if os.path.exists(s):
+            for id, e, wflow in list(tasks[-samples:]):
+                id = int(id)
+                workdir = os.path.join(self.config.workdir, self.wflow_labels[wflow])
+                if ArtifactStore(workdir, readonly=True).exists(id, 'task.log.gz', 'failed'):
+                    t = os.path.join(logdir, str(id) + '.log')
                     codes[exit_code][1].append(str(id))
-                    work.append([s, t])
+                    work.append([workdir, id, 'task.log.gz', t])
 
         for label, _, _, _, _, _, _, _, _, failed, skipped, _, _, _ in list(self.__store.workflow_status())[1:-1]:
             if failed + skipped == 0:
@@ -597,18 +613,17 @@ class Plotter(object):
             failed = self.__store.failed_units(label)
             skipped = self.__store.skipped_files(label)
 
+            workdir = os.path.join(self.config.workdir, label)
+            artifacts = ArtifactStore(workdir, readonly=True)
             for id in failed:
-                source = os.path.join(
-                    self.config.workdir, label, 'failed', util.id2dir(id))
                 target = os.path.join(logdir, 'failed_' + label)
                 if not os.path.exists(target):
                     os.makedirs(target)
 
                 for l in ['task.log.gz']:
-                    s = os.path.join(source, l)
                     t = os.path.join(target, str(id) + "_" + l[:-3])
-                    if os.path.exists(s):
-                        work.append([s, t])
+                    if artifacts.exists(id, l, 'failed'):
+                        work.append([workdir, id, l, t])
 
             if len(skipped) > 0:
                 outname = os.path.join(logdir, 'skipped_{}.txt'.format(label))
@@ -682,7 +697,10 @@ class Plotter(object):
         names = []
 
         for filename in self.__foremen:
-            headers, stats = self.readlog(filename)
+            log = self.readlog(filename)
+            if log is None:
+                continue
+            headers, stats = log
 
             foreman = os.path.basename(filename)
 
@@ -1295,14 +1313,23 @@ class Plotter(object):
 
         # readlog() determines the time bounds of sql queries if not
         # specified explicitly.
-        self.__category_stats = {'all': self.readlog()}
+        log = self.readlog()
+        if log is None:
+            return
+        self.__category_stats = {'all': log}
         for category in self.config.categories:
             label = category.name
             if label == 'merge':
                 continue
-            self.__category_stats[label] = self.readlog(category=label)
+            log = self.readlog(category=label)
+            if log is not None:
+                self.__category_stats[label] = log
 
-        good_tasks, failed_tasks, summary_data, completed_units, total_units, start_units, units_processed, transfers = self.readdb()
+        # Opened here rather than in the constructor, since plotting may
+        # happen in a process forked from the master.
+        self.__store = unit.UnitStore(self.config, readonly=True)
+        with self.__store.snapshot():
+            good_tasks, failed_tasks, summary_data, completed_units, total_units, start_units, units_processed, transfers = self.readdb()
 
         success_tasks = good_tasks[good_tasks['type'] == 0] if len(
             good_tasks) > 0 else np.array([], good_tasks.dtype)
@@ -1440,13 +1467,15 @@ class Plotter(object):
                 np.in1d(success_tasks['workflow'], ids)]
             wf_merge_tasks = merge_tasks[np.in1d(merge_tasks['workflow'], ids)]
 
-            self.make_master_plots(label, wf_good_tasks, wf_success_tasks)
-            logs = self.make_workflow_plots(label, edges,
-                                            wf_good_tasks,
-                                            wf_failed_tasks,
-                                            wf_success_tasks,
-                                            wf_merge_tasks,
-                                            xmin, xmax)
+            logs = None
+            if label in self.__category_stats:
+                self.make_master_plots(label, wf_good_tasks, wf_success_tasks)
+                logs = self.make_workflow_plots(label, edges,
+                                                wf_good_tasks,
+                                                wf_failed_tasks,
+                                                wf_success_tasks,
+                                                wf_merge_tasks,
+                                                xmin, xmax)
 
             summary = add_total([xs for xs in summary_data if xs[0] in labels])
             category_summary_data.append([label] + summary[-1][1:])
@@ -7,6 +7,7 @@ import os
 import psutil
 import resource
 import signal
+import socket
 import sys
 import time
 import traceback
@@ -14,13 +15,49 @@ import traceback
 from lobster import actions, util
 from lobster.commands.status import Status
 from lobster.core.command import Command
-from lobster.core.source import TaskProvider
+from lobster.core.metrics import Metrics
+from lobster.core.pipeline import Pipeline, ReturnWindow
+from lobster.core.profiler import SamplingProfiler
+from lobster.core.source import Snapshot, TaskProvider
+from lobster.core.statslog import StatsLog, convert
 
 import work_queue as wq
 
 logger = logging.getLogger('lobster.core')
 
 
+# In the pipelined master loop: how long to wait on WorkQueue at once, so
+# that the main thread keeps submitting tasks, how often to create tasks,
+# and how often to log statistics and take recurring actions, in seconds.
+PIPELINE_WAIT = 5
+PIPELINE_CREATE = 5
+PIPELINE_CYCLE = 30
+
+
+# How long the master trusts the checkpoints in memory.  Other commands
+# running on the same host notify the master of changes with a signal.
+CHECKPOINT_INTERVAL = 60
+
+
+def signal_master(workdir, signum):
+    """Send the signal `signum` to the master of the project in `workdir`.
+
+    Returns `True` if the master is running on this host, and has been
+    signaled.
+    """
+    master = util.checkpoint(workdir, 'MASTER')
+    if not master or master['host'] != socket.getfqdn() or master['pid'] == os.getpid():
+        return False
+    try:
+        # Do not signal an unrelated process re-using the PID
+        if psutil.Process(master['pid']).create_time() != master['started']:
+            return False
+        os.kill(master['pid'], signum)
+    except (psutil.NoSuchProcess, OSError):
+        return False
+    return True
+
+
 class Terminate(Command):
 
     @property
@@ -38,15 +75,41 @@ class Terminate(Command):
         logger.debug("the following stack trace doesn't indicate a crash; it's just for debugging purposes.")
         logger.debug("stack:\n{0}".format(''.join(traceback.format_stack())))
         util.register_checkpoint(config.workdir, 'KILLED', 'PENDING')
+        signal_master(config.workdir, signal.SIGUSR2)
 
         if config.elk:
             config.elk.end()
 
 
+class Profile(Command):
+
+    @property
+    def help(self):
+        return 'sample the stacks of a running lobster instance, to draw a flame graph'
+
+    def setup(self, argparser):
+        argparser.add_argument('--duration', type=float, default=60,
+                               help='how long to sample for, in seconds')
+        argparser.add_argument('--interval', type=float, default=0.01,
+                               help='how long to wait between samples, in seconds')
+
+    def run(self, args):
+        workdir = args.config.workdir
+        util.register_checkpoint(workdir, 'PROFILE', {'duration': args.duration, 'interval': args.interval})
+        if not signal_master(workdir, signal.SIGUSR1):
+            logger.error("no running lobster instance found for {0} on this host".format(workdir))
+            return
+        pid = util.checkpoint(workdir, 'MASTER')['pid']
+        logger.info("profiling lobster instance with PID {0} for {1} seconds".format(pid, args.duration))
+        logger.info("stacks will be saved in {0}".format(os.path.join(workdir, 'profile-*.folded')))
+
+
 class Process(Command, util.Timing):
 
     def __init__(self):
         util.Timing.__init__(self, 'action', 'create', 'fetch', 'return', 'status', 'update')
+        self.profiler = None
+        self.pipeline = None
 
     @property
     def help(self):
@@ -63,42 +126,342 @@ class Process(Command, util.Timing):
         return ['configure', 'plotting']
 
     def setup_logging(self, category):
-        filename = os.path.join(self.config.workdir, "lobster_stats_{}.log".format(category))
+        filename = os.path.join(self.config.workdir, "lobster_stats_{}.dat".format(category))
         if not hasattr(self, 'log_attributes'):
             self.log_attributes = [m for (m, o) in inspect.getmembers(wq.work_queue_stats)
                                    if not inspect.isroutine(o) and not m.startswith('__')]
+            self.stats_logs = {}
+
+        textfile = filename[:-4] + '.log'
+        if os.path.exists(textfile) and not os.path.exists(filename):
+            logger.info("converting {0} to {1}".format(textfile, filename))
+            convert(textfile, filename)
 
-        with open(filename, "a") as statsfile:
-            statsfile.write(
-                " ".join(
-                    ["#timestamp", "units_left"] +
-                    ["total_{}_time".format(k) for k in sorted(self.times.keys())] +
-                    ["total_source_{}_time".format(k) for k in sorted(self.source.times.keys())] +
-                    self.log_attributes
-                ) + "\n"
-            )
+        self.stats_logs[category] = StatsLog(
+            filename,
+            ["timestamp", "units_left"] +
+            ["total_{}_time".format(k) for k in sorted(self.times.keys())] +
+            ["total_source_{}_time".format(k) for k in sorted(self.source.times.keys())] +
+            self.log_attributes
+        )
 
     def log(self, category, left):
-        filename = os.path.join(self.config.workdir, "lobster_stats_{}.log".format(category))
         if category == 'all':
             stats = self.queue.stats_hierarchy
         else:
             stats = self.queue.stats_category(category)
 
-        with open(filename, "a") as statsfile:
-            now = datetime.datetime.now()
-            statsfile.write(" ".join(map(str,
-                                         [int(int(now.strftime('%s')) * 1e6 + now.microsecond), left] +
-                                         [self.times[k] for k in sorted(self.times.keys())] +
-                                         [self.source.times[k] for k in sorted(self.source.times.keys())] +
-                                         [getattr(stats, a) for a in self.log_attributes]
-                                         )) + "\n"
-                            )
+        now = datetime.datetime.now()
+        statslog = self.stats_logs[category]
+        statslog.append(
+            [int(int(now.strftime('%s')) * 1e6 + now.microsecond), left] +
+            [self.times[k] for k in sorted(self.times.keys())] +
+            [self.source.times[k] for k in sorted(self.source.times.keys())] +
+            [getattr(stats, a) for a in self.log_attributes]
+        )
+        if time.time() - statslog.compacted > 3600:
+            statslog.compact()
 
         if self.config.elk:
             stats = self.queue.stats_hierarchy
             self.config.elk.index_stats(now, left, self.times, self.log_attributes, stats, category)
 
+    def status(self, categories):
+        """Update the queue with the number of tasks left, log statistics,
+        and return the number of units left.
+        """
+        tasks_left = self.source.tasks_left()
+        units_left = self.source.work_left()
+
+        logger.debug("expecting {0} tasks, still".format(tasks_left))
+        self.queue.specify_num_tasks_left(tasks_left)
+
+        for c in categories + ['all']:
+            self.log(c, units_left)
+        self.export(categories, tasks_left, units_left)
+        return units_left
+
+    def export(self, categories, tasks_left, units_left):
+        """Write the timing of the master and the queue statistics to
+        `metrics.prom` in the working directory, in the text format of
+        Prometheus.
+        """
+        metrics = Metrics(project=self.config.label)
+        metrics.gauge('lobster_tasks_left', 'Estimated number of tasks left to create', tasks_left)
+        metrics.gauge('lobster_units_left', 'Number of units left to process', units_left)
+        components = [('master', self), ('source', self.source)]
+        if self.pipeline:
+            components.append(('pipeline', self.pipeline))
+        for component, timing in components:
+            metrics.histogram('lobster_step_duration_seconds', 'Duration of the steps of the master loop',
+                              util.Timing.buckets, timing.histograms, 'step', component=component)
+
+        for c in categories + ['all']:
+            stats = self.queue.stats_hierarchy if c == 'all' else self.queue.stats_category(c)
+            for attr in self.log_attributes:
+                value = getattr(stats, attr)
+                if not isinstance(value, (int, long, float)):
+                    continue
+                description = 'WorkQueue statistic {0}'.format(attr)
+                if attr.startswith('total_'):
+                    metrics.counter('lobster_queue_' + attr[len('total_'):], description, value, category=c)
+                else:
+                    metrics.gauge('lobster_queue_' + attr, description, value, category=c)
+
+        metrics.write(os.path.join(self.config.workdir, 'metrics.prom'))
+
+    def report(self, units_left):
+        stats = self.queue.stats_hierarchy
+        logger.info("{0} out of {1} workers busy; {2} tasks running, {3} waiting; {4} units left".format(
+            stats.workers_busy,
+            stats.workers_busy + stats.workers_ready,
+            stats.tasks_running,
+            stats.tasks_waiting,
+            units_left))
+
+    def killed(self):
+        """Return `True` if lobster has been asked to terminate.
+        """
+        if util.checkpoint(self.config.workdir, 'KILLED') == 'PENDING':
+            util.register_checkpoint(
+                self.config.workdir, 'KILLED', str(datetime.datetime.utcnow()))
+            return True
+        return False
+
+    def terminate(self):
+        # let the task source shut down gracefully
+        logger.info("terminating task source")
+        self.source.terminate()
+        logger.info("terminating gracefully")
+
+    def demand(self, categories):
+        """Return the number of cores and the tasks in the queue per
+        category, as expected by :meth:`TaskProvider.obtain`.
+        """
+        have = {}
+        for c in categories:
+            cstats = self.queue.stats_category(c)
+            have[c] = {'running': cstats.tasks_running, 'queued': cstats.tasks_waiting}
+        return self.queue.stats_hierarchy.total_cores, have
+
+    def submit(self, tasks):
+        expiry = None
+        if self.config.advanced.proxy:
+            expiry = self.config.advanced.proxy.expires()
+            proxy_time_left = self.config.advanced.proxy.time_left()
+            if proxy_time_left >= 24 * 3600:
+                self.proxy_email_sent = False
+            if proxy_time_left < 24 * 3600 and not self.proxy_email_sent:
+                util.sendemail("Your proxy is about to expire.\n" + "Timeleft: " + str(datetime.timedelta(seconds=proxy_time_left)), self.config)
+                self.proxy_email_sent = True
+
+        for category, cmd, id, inputs, outputs, env, dir in tasks:
+            task = wq.Task(cmd)
+            task.specify_category(category)
+            task.specify_tag(id)
+            task.specify_max_retries(self.config.advanced.wq_max_retries)
+            task.specify_monitor_output(os.path.join(dir, 'resource_monitor'))
+
+            for k, v in env.items():
+                task.specify_environment_variable(k, v)
+
+            for (local, remote, cache) in inputs:
+                cache_opt = wq.WORK_QUEUE_CACHE if cache else wq.WORK_QUEUE_NOCACHE
+                if os.path.isfile(local) or os.path.isdir(local):
+                    task.specify_input_file(str(local), str(remote), cache_opt)
+                else:
+                    logger.critical("cannot send file to worker: {0}".format(local))
+                    raise NotImplementedError
+
+            for (local, remote) in outputs:
+                task.specify_output_file(str(local), str(remote))
+
+            if expiry:
+                task.specify_end_time(expiry * 10 ** 6)
+            self.queue.submit(task)
+
+    def fetched(self, task):
+        """Account for a task returned by the queue.
+        """
+        abort_threshold = self.config.advanced.abort_threshold
+        abort_multiplier = self.config.advanced.abort_multiplier
+
+        if task.return_status == 0:
+            self.successful_tasks += 1
+        elif task.return_status in self.config.advanced.bad_exit_codes:
+            logger.warning(
+                "blacklisting host {0} due to bad exit code from task {1}".format(task.hostname, task.tag))
+            self.queue.blacklist(task.hostname)
+
+        # TODO do we really need this?  We have everything based on
+        # categories by now, so this should not be needed.
+        if abort_threshold > 0 and self.successful_tasks >= abort_threshold and not self.abort_active:
+            logger.info(
+                "activating fast abort with multiplier: {0}".format(abort_multiplier))
+            self.abort_active = True
+            self.queue.activate_fast_abort(abort_multiplier)
+
+    def crashed(self, tasks):
+        tb = traceback.format_exc()
+        logger.critical("cannot recover from the following exception:\n" + tb)
+        util.sendemail("Your Lobster project has crashed from the following exception:\n" + tb, self.config)
+        for task in tasks:
+            logger.critical(
+                "tried to return task {0} from {1}".format(task.tag, task.hostname))
+
+    def serial(self, categories, action):
+        """Run the master loop, performing each step in turn.
+
+        Returns the number of units left.
+        """
+        window = ReturnWindow()
+        units_left = 0
+
+        while not self.source.done():
+            loopstart = time.time()
+            # Only the database writes are grouped into transactions: no
+            # write lock is held while talking to WQ, or while recurring
+            # actions (e.g., plotting) run.
+            with self.source.transaction():
+                with self.measure('status'):
+                    units_left = self.status(categories)
+
+                killed = self.killed()
+                if not killed:
+                    with self.measure('create'):
+                        tasks = self.source.obtain(*self.demand(categories))
+
+            if killed:
+                # nothing has been written since the status was taken
+                self.terminate()
+                break
+
+            with self.measure('create'):
+                self.submit(tasks)
+
+            with self.measure('status'):
+                self.report(units_left)
+
+            with self.measure('update'), self.source.transaction():
+                self.source.update(self.queue)
+                self.source.maintain()
+
+            # recurring actions are triggered here; plotting etc should run
+            # while we have WQ hand us back tasks w/o any database
+            # interaction
+            with self.measure('action'):
+                if action:
+                    action.take()
+
+            with self.measure('fetch'):
+                starttime = time.time()
+                task = self.queue.wait(window.maximum)
+                tasks = []
+                while task:
+                    self.fetched(task)
+                    tasks.append(Snapshot(task))
+
+                    remaining = window.remaining(len(tasks), time.time() - starttime,
+                                                 self.queue.stats.tasks_waiting)
+                    if remaining > 0:
+                        task = self.queue.wait(max(int(remaining), 1))
+                    else:
+                        task = None
+            releasestart = time.time()
+            if len(tasks) > 0:
+                try:
+                    with self.measure('return'), self.source.transaction():
+                        self.source.release(tasks)
+                except Exception:
+                    self.crashed(tasks)
+                    raise
+
+            window.update(starttime - loopstart, len(tasks), releasestart - starttime,
+                          time.time() - releasestart)
+            logger.debug("collecting tasks for at least {0:.1f}s, at most {1} at once".format(
+                window.window, window.batch))
+        return units_left
+
+    def pipelined(self, categories, action):
+        """Run the master loop with the task source in the background.
+
+        The main thread keeps waiting on the queue and submitting tasks,
+        while returned tasks are released and new tasks are created by a
+        :class:`Pipeline`.  Recurring actions and status updates are
+        performed every `PIPELINE_CYCLE` seconds.
+
+        Returns the number of units left.
+        """
+        depth = self.config.advanced.pipeline_depth
+        pipeline = self.pipeline = Pipeline(self.source, depth)
+        killed = False
+        last = 0
+        requested = 0
+
+        try:
+            while True:
+                pipeline.check()
+
+                if time.time() - last > PIPELINE_CYCLE:
+                    last = time.time()
+                    with pipeline.lock, self.source.transaction():
+                        with self.measure('status'):
+                            units_left = self.status(categories)
+                            if self.source.done():
+                                break
+                            if self.killed():
+                                killed = True
+                                break
+                            self.report(units_left)
+
+                        with self.measure('update'):
+                            self.source.update(self.queue)
+                            self.source.maintain()
+
+                        with self.measure('action'):
+                            if action:
+                                action.take()
+
+                with self.measure('create'):
+                    self.submit(pipeline.created())
+                    if time.time() - requested > PIPELINE_CREATE and pipeline.request(*self.demand(categories)):
+                        requested = time.time()
+
+                with self.measure('fetch'):
+                    task = self.queue.wait(PIPELINE_WAIT)
+                    count = 0
+                    while task:
+                        self.fetched(task)
+                        pipeline.put(Snapshot(task))
+                        count += 1
+                        task = self.queue.wait(0) if count < depth else None
+            pipeline.drain()
+        except Exception:
+            if pipeline.failed is not None:
+                self.crashed(pipeline.failed)
+            raise
+        finally:
+            pipeline.stop()
+
+        if killed:
+            self.terminate()
+        return units_left
+
+    def profile(self):
+        """Start sampling the stacks of all threads, with the settings
+        requested by :class:`Profile`.
+        """
+        if self.profiler and self.profiler.running():
+            logger.warning("profiler already running")
+            return
+        util.checkpoints(self.config.workdir).expire()
+        settings = util.checkpoint(self.config.workdir, 'PROFILE') or {}
+        filename = os.path.join(self.config.workdir, 'profile-{0}.folded'.format(
+            datetime.datetime.now().strftime('%Y%m%d-%H%M%S')))
+        logger.info("profiling for {0} seconds into {1}".format(settings.get('duration', 60), filename))
+        self.profiler = SamplingProfiler(filename, settings.get('duration', 60), settings.get('interval', 0.01))
+        self.profiler.start()
+
     def setup(self, argparser):
         argparser.add_argument('--finalize', action='store_true', default=False,
                                help='do not process any additional data; wrap project up by merging everything')
@@ -136,9 +499,20 @@ class Process(Command, util.Timing):
         def localkill(num, frame):
             Terminate().run(args)
 
+        def localprofile(num, frame):
+            self.profile()
+
+        def localcheckpoint(num, frame):
+            util.checkpoints(self.config.workdir).expire()
+
         signals = daemon.daemon.make_default_signal_map()
         signals[signal.SIGINT] = localkill
         signals[signal.SIGTERM] = localkill
+        # Python handles signals in the main thread only, once WorkQueue
+        # returns control to it.  SIGUSR1 starts profiling, and SIGUSR2
+        # notifies of changed checkpoints.
+        signals[signal.SIGUSR1] = localprofile
+        signals[signal.SIGUSR2] = localcheckpoint
 
         process = psutil.Process()
         preserved = [f.name for f in args.preserve]
@@ -180,6 +554,13 @@ class Process(Command, util.Timing):
                 pass
 
     def sprint(self):
+        util.checkpoints(self.config.workdir).interval = CHECKPOINT_INTERVAL
+        util.register_checkpoint(self.config.workdir, 'MASTER', {
+            'host': socket.getfqdn(),
+            'pid': os.getpid(),
+            'started': psutil.Process().create_time()
+        })
+
         with util.PartiallyMutable.unlock():
             self.source = TaskProvider(self.config)
         action = actions.Actions(self.config, self.source)
@@ -208,24 +589,13 @@ class Process(Command, util.Timing):
 
         logger.info("starting queue as {0}".format(self.queue.name))
 
-        abort_active = False
-        abort_threshold = self.config.advanced.abort_threshold
-        abort_multiplier = self.config.advanced.abort_multiplier
-
-        wq_max_retries = self.config.advanced.wq_max_retries
+        self.successful_tasks = 0
+        self.abort_active = False
+        self.proxy_email_sent = False
 
         if util.checkpoint(self.config.workdir, 'KILLED') == 'PENDING':
             util.register_checkpoint(self.config.workdir, 'KILLED', 'RESTART')
 
-        # time in seconds to wait for WQ to return tasks, with minimum wait
-        # time in case no more tasks are waiting
-        interval = 120
-        interval_minimum = 30
-
-        tasks_left = 0
-        units_left = 0
-        successful_tasks = 0
-
         categories = []
 
         self.setup_logging('all')
@@ -244,134 +614,20 @@ class Process(Command, util.Timing):
                 self.queue.specify_category_first_allocation_guess(category.name, constraints)
             logger.debug('Category {0}: {1}'.format(category.name, constraints))
             if 'wall_time' not in constraints:
-                self.queue.activate_fast_abort_category(category.name, abort_multiplier)
-
-        proxy_email_sent = False
-        while not self.source.done():
-            with self.measure('status'):
-                tasks_left = self.source.tasks_left()
-                units_left = self.source.work_left()
-
-                logger.debug("expecting {0} tasks, still".format(tasks_left))
-                self.queue.specify_num_tasks_left(tasks_left)
-
-                for c in categories + ['all']:
-                    self.log(c, units_left)
-
-                if util.checkpoint(self.config.workdir, 'KILLED') == 'PENDING':
-                    util.register_checkpoint(
-                        self.config.workdir, 'KILLED', str(datetime.datetime.utcnow()))
-
-                    # let the task source shut down gracefully
-                    logger.info("terminating task source")
-                    self.source.terminate()
-                    logger.info("terminating gracefully")
-                    break
-
-            with self.measure('create'):
-                have = {}
-                for c in categories:
-                    cstats = self.queue.stats_category(c)
-                    have[c] = {'running': cstats.tasks_running, 'queued': cstats.tasks_waiting}
-
-                stats = self.queue.stats_hierarchy
-                tasks = self.source.obtain(stats.total_cores, have)
-
-                expiry = None
-                if self.config.advanced.proxy:
-                    expiry = self.config.advanced.proxy.expires()
-                    proxy_time_left = self.config.advanced.proxy.time_left()
-                    if proxy_time_left >= 24 * 3600:
-                        proxy_email_sent = False
-                    if proxy_time_left < 24 * 3600 and not proxy_email_sent:
-                        util.sendemail("Your proxy is about to expire.\n" + "Timeleft: " + str(datetime.timedelta(seconds=proxy_time_left)), self.config)
-                        proxy_email_sent = True
-
-                for category, cmd, id, inputs, outputs, env, dir in tasks:
-                    task = wq.Task(cmd)
-                    task.specify_category(category)
-                    task.specify_tag(id)
-                    task.specify_max_retries(wq_max_retries)
-                    task.specify_monitor_output(os.path.join(dir, 'resource_monitor'))
-
-                    for k, v in env.items():
-                        task.specify_environment_variable(k, v)
-
-                    for (local, remote, cache) in inputs:
-                        cache_opt = wq.WORK_QUEUE_CACHE if cache else wq.WORK_QUEUE_NOCACHE
-                        if os.path.isfile(local) or os.path.isdir(local):
-                            task.specify_input_file(str(local), str(remote), cache_opt)
-                        else:
-                            logger.critical("cannot send file to worker: {0}".format(local))
-                            raise NotImplementedError
-
-                    for (local, remote) in outputs:
-                        task.specify_output_file(str(local), str(remote))
-
-                    if expiry:
-                        task.specify_end_time(expiry * 10 ** 6)
-                    self.queue.submit(task)
-
-            with self.measure('status'):
-                stats = self.queue.stats_hierarchy
-                logger.info("{0} out of {1} workers busy; {2} tasks running, {3} waiting; {4} units left".format(
-                    stats.workers_busy,
-                    stats.workers_busy + stats.workers_ready,
-                    stats.tasks_running,
-                    stats.tasks_waiting,
-                    units_left))
-
-            with self.measure('update'):
-                self.source.update(self.queue)
+                self.queue.activate_fast_abort_category(category.name, self.config.advanced.abort_multiplier)
 
-            # recurring actions are triggered here; plotting etc should run
-            # while we have WQ hand us back tasks w/o any database
-            # interaction
-            with self.measure('action'):
-                if action:
-                    action.take()
+        if self.config.advanced.pipeline_depth > 0:
+            units_left = self.pipelined(categories, action)
+        else:
+            units_left = self.serial(categories, action)
 
-            with self.measure('fetch'):
-                starttime = time.time()
-                task = self.queue.wait(interval)
-                tasks = []
-                while task:
-                    if task.return_status == 0:
-                        successful_tasks += 1
-                    elif task.return_status in self.config.advanced.bad_exit_codes:
-                        logger.warning(
-                            "blacklisting host {0} due to bad exit code from task {1}".format(task.hostname, task.tag))
-                        self.queue.blacklist(task.hostname)
-                    tasks.append(task)
-
-                    remaining = int(starttime + interval - time.time())
-                    if (interval - remaining < interval_minimum or self.queue.stats.tasks_waiting > 0) and remaining > 0:
-                        task = self.queue.wait(remaining)
-                    else:
-                        task = None
-                # TODO do we really need this?  We have everything based on
-                # categories by now, so this should not be needed.
-                if abort_threshold > 0 and successful_tasks >= abort_threshold and not abort_active:
-                    logger.info(
-                        "activating fast abort with multiplier: {0}".format(abort_multiplier))
-                    abort_active = True
-                    self.queue.activate_fast_abort(abort_multiplier)
-            if len(tasks) > 0:
-                try:
-                    with self.measure('return'):
-                        self.source.release(tasks)
-                except Exception:
-                    tb = traceback.format_exc()
-                    logger.critical("cannot recover from the following exception:\n" + tb)
-                    util.sendemail("Your Lobster project has crashed from the following exception:\n" + tb, self.config)
-                    for task in tasks:
-                        logger.critical(
-                            "tried to return task {0} from {1}".format(task.tag, task.hostname))
-                    raise
         if units_left == 0:
             logger.info("no more work left to do")
             util.sendemail("Your Lobster project is done!", self.config)
+            self.config.advanced.dashboard.flush(60)
             if self.config.elk:
                 self.config.elk.end()
             if action:
                 action.take(True)
+
+        self.config.advanced.dashboard.free()
@@ -1,7 +1,7 @@
 import logging
 import os
-from lobster import util
 from lobster.core import unit
+from lobster.core.artifacts import ArtifactStore
 from lobster.core.command import Command
 
 
@@ -17,8 +17,11 @@ class Status(Command):
     def run(self, args):
         config = args.config
         logger = logging.getLogger('lobster.status')
-        store = unit.UnitStore(config)
-        data = list(store.workflow_status())
+        store = unit.UnitStore(config, readonly=True)
+        with store.snapshot():
+            data = list(store.workflow_status())
+            failed = dict((w.label, store.failed_units(w.label)) for w in config.workflows)
+            skipped = dict((w.label, store.skipped_files(w.label)) for w in config.workflows)
         headers = [x.split() for x in data.pop(0)]
         header_rows = max([len(x) for x in headers])
         for i in range(0, header_rows):
@@ -40,15 +43,14 @@ class Status(Command):
 
         wdir = config.workdir
         for wflow in config.workflows:
-            tasks = store.failed_units(wflow.label)
-            files = store.skipped_files(wflow.label)
+            tasks = failed[wflow.label]
+            files = skipped[wflow.label]
 
             if len(tasks) > 0:
                 msg = "tasks with failed units for {0}:".format(wflow.label)
+                artifacts = ArtifactStore(os.path.join(wdir, wflow.label), readonly=True)
                 for task in tasks:
-                    tdir = os.path.normpath(os.path.join(
-                        wdir, wflow.label, 'failed', util.id2dir(task)))
-                    msg += "\n" + tdir
+                    msg += "\n" + artifacts.location(task, 'failed')
                 logger.info(msg)
 
             if len(files) > 0:
@@ -83,7 +83,7 @@ class Validate(Command):
         return delete, missing
 
     def run(self, args):
-        store = UnitStore(args.config)
+        store = UnitStore(args.config, readonly=args.dry_run)
         stats = dict((w.label, [0, 0, 0]) for w in args.config.workflows)
 
         missing = []
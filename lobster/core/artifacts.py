@@ -0,0 +1,193 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+
+from io import BytesIO
+
+from lobster import util
+
+logger = logging.getLogger('lobster.artifacts')
+
+# Start a new segment once the current one exceeds this size
+SEGMENT_SIZE = 1024 ** 3
+
+
+class ArtifactStore(object):
+    """Storage of the files of finished tasks of a workflow.
+
+    Task directories are created in `running/`, where they are populated
+    by the master and `WorkQueue`.  Once a task is returned, its files are
+    either moved to a directory in `successful/` or `failed/`, or, if
+    `packed`, appended to the segment files in `artifacts/`, with an index
+    of task, status, file name, and location.  The latter avoids creating
+    several inodes per task.
+
+    Files are read through this class for either storage, and the index is
+    consulted first, so that switching between both ways to store files
+    does not make previous tasks inaccessible.
+
+    Parameters
+    ----------
+        workdir : str
+            The working directory of the workflow.
+        packed : bool
+            Append the files of finished tasks to segment files instead of
+            keeping them in directories.
+        readonly : bool
+            Only read files, e.g., for status reports and plotting.  The
+            index is opened without creating or changing it, and archiving
+            raises an error.
+    """
+
+    # Subdirectory of a task directory to hold files extracted for the
+    # task, which are not archived with it.
+    scratch = 'inputs'
+
+    def __init__(self, workdir, packed=False, readonly=False):
+        self.workdir = workdir
+        self.packed = packed
+        self.readonly = readonly
+        self.__dir = os.path.join(workdir, 'artifacts')
+        self.__index = os.path.join(self.__dir, 'index.db')
+        self.__db = None
+        self.__segment = None
+        self.__lock = threading.Lock()
+
+    def __connect(self, create=False):
+        if self.__db is None:
+            if not create and not os.path.isfile(self.__index):
+                return None
+            if not os.path.isdir(self.__dir):
+                os.makedirs(self.__dir)
+            self.__db = sqlite3.connect(self.__index, timeout=90, check_same_thread=False)
+            self.__db.isolation_level = None
+            if self.readonly:
+                self.__db.execute("pragma query_only=on")
+                return self.__db
+            self.__db.execute("pragma journal_mode=wal")
+            self.__db.execute("pragma synchronous=normal")
+            self.__db.execute("""create table if not exists artifacts(
+                task integer,
+                status text,
+                name text,
+                segment integer,
+                offset integer,
+                size integer,
+                primary key(task, status, name))""")
+        return self.__db
+
+    def __segment_path(self, n):
+        return os.path.join(self.__dir, 'segment-{0:04d}.dat'.format(n))
+
+    def __open_segment(self):
+        """Return the number and file object of the segment to append to.
+        """
+        if self.__segment is None:
+            segments = [int(fn[8:12]) for fn in os.listdir(self.__dir)
+                        if fn.startswith('segment-') and fn.endswith('.dat')]
+            n = max(segments) if segments else 0
+            self.__segment = (n, open(self.__segment_path(n), 'ab'))
+        n, f = self.__segment
+        f.seek(0, os.SEEK_END)
+        if f.tell() >= SEGMENT_SIZE:
+            f.close()
+            n += 1
+            logger.debug("starting artifact segment {0}".format(self.__segment_path(n)))
+            self.__segment = (n, open(self.__segment_path(n), 'ab'))
+        return self.__segment
+
+    def __lookup(self, task, name, status):
+        with self.__lock:
+            db = self.__connect()
+            if db is None:
+                return None
+            return db.execute("""
+                select segment, offset, size
+                from artifacts
+                where task=? and status=? and name=?""", (task, status, name)).fetchone()
+
+    def archive(self, task, status, oldstatus='running'):
+        """Archive the files of a task under a new status.
+
+        Returns the location of the archived files, see :meth:`location`.
+        """
+        if self.readonly:
+            raise IOError("can't archive to read-only artifact store {0}".format(self.workdir))
+        if not self.packed:
+            return util.move(self.workdir, task, status, oldstatus)
+
+        source = util.taskdir(self.workdir, task, oldstatus, create=False)
+        with self.__lock:
+            db = self.__connect(create=True)
+            n, segment = self.__open_segment()
+            rows = []
+            for dirpath, dirnames, filenames in os.walk(source):
+                if dirpath == source and self.scratch in dirnames:
+                    dirnames.remove(self.scratch)
+                for fn in filenames:
+                    path = os.path.join(dirpath, fn)
+                    offset = segment.tell()
+                    with open(path, 'rb') as f:
+                        shutil.copyfileobj(f, segment)
+                    rows.append((task, status, os.path.relpath(path, source),
+                                 n, offset, segment.tell() - offset))
+            # Data has to be in the segment before the index points to it
+            segment.flush()
+            db.execute("begin")
+            db.executemany("insert or replace into artifacts values (?, ?, ?, ?, ?, ?)", rows)
+            db.execute("commit")
+
+        shutil.rmtree(source)
+        try:
+            os.removedirs(os.path.dirname(source))
+        except OSError:
+            # not empty, or removed concurrently
+            pass
+        return self.location(task, status)
+
+    def exists(self, task, name, status='successful'):
+        if self.__lookup(task, name, status):
+            return True
+        return os.path.isfile(os.path.join(util.taskdir(self.workdir, task, status, create=False), name))
+
+    def open(self, task, name, status='successful'):
+        """Return a file object to read `name` of task `task`.
+
+        Raises an `IOError` if the file cannot be found.
+        """
+        entry = self.__lookup(task, name, status)
+        if entry is None:
+            return open(os.path.join(util.taskdir(self.workdir, task, status, create=False), name), 'rb')
+        n, offset, size = entry
+        with open(self.__segment_path(n), 'rb') as f:
+            f.seek(offset)
+            return BytesIO(f.read(size))
+
+    def path(self, task, name, status, taskdir):
+        """Return a path to the file `name` of task `task`.
+
+        Packed files are extracted into the scratch space of the directory
+        `taskdir` of the task requiring them, with the same relative path
+        as in the status directories.  Returns `None` if the file cannot be
+        found.
+        """
+        entry = self.__lookup(task, name, status)
+        if entry is None:
+            path = os.path.join(util.taskdir(self.workdir, task, status, create=False), name)
+            return path if os.path.isfile(path) else None
+
+        target = os.path.join(util.taskdir(os.path.join(taskdir, self.scratch), task, ''), name)
+        with open(target, 'wb') as output:
+            shutil.copyfileobj(self.open(task, name, status), output)
+        return target
+
+    def location(self, task, status):
+        """Return a human readable description where the files of a task
+        are stored.
+        """
+        entry = self.__lookup(task, 'parameters.json', status)
+        if entry is None:
+            return util.taskdir(self.workdir, task, status, create=False)
+        return '{0} (task {1}, {2})'.format(self.__segment_path(entry[0]), task, status)
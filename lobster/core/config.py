@@ -184,10 +184,21 @@ class AdvancedOptions(Configurable):
             practically quiet.
         osg_version : str
             The version of OSG you want lobster to run on.
+        pack_artifacts : bool
+            Append the files of finished tasks to per-workflow segment
+            files instead of keeping one directory per task.  Avoids
+            millions of inodes for large projects.  Files are read through
+            :class:`~lobster.core.artifacts.ArtifactStore` either way.
         payload : int
             How many tasks to keep in the queue (minimum).  Note that the
             payload will increase with the number of cores available to
             Lobster.  This is just the minimum with no workers connected.
+        pipeline_depth : int
+            Release returned tasks and create new ones in background
+            threads, while the master keeps waiting on and submitting to
+            `WorkQueue`.  Sets how many returned tasks may be waiting to be
+            released before no more tasks are fetched.  Set to 0 to perform
+            all steps in turn.
         proxy : :class:`~lobster.cmssw.Proxy`
             An authentication mechanism to access data.  Set to `False` to
             disable.
@@ -197,6 +208,13 @@ class AdvancedOptions(Configurable):
         threshold_for_skipping : int
             How often a single file may fail to be accessed before Lobster
             will not attempt to process it any longer.
+        unit_ranges : bool
+            Store contiguous luminosity sections of a file as a single
+            database record, which is split up as units are assigned to
+            tasks.  Greatly reduces the database size and registration
+            time of workflows with many units, e.g., large
+            :class:`~lobster.core.dataset.ProductionDataset` workflows.
+            Only affects file based workflows registered afterwards.
         wq_max_retries : int
             How often `WorkQueue` will attempt to process a task before
             handing it back to Lobster.  `WorkQueue` will only reprocess
@@ -227,10 +245,13 @@ class AdvancedOptions(Configurable):
                  full_monitoring=False,
                  log_level=2,
                  osg_version=None,
+                 pack_artifacts=False,
                  payload=10,
+                 pipeline_depth=0,
                  proxy=None,
                  threshold_for_failure=30,
                  threshold_for_skipping=30,
+                 unit_ranges=False,
                  wq_max_retries=10,
                  wq_port=-1,
                  xrootd_servers=None):
@@ -256,10 +277,13 @@ class AdvancedOptions(Configurable):
         self.email = email
         self.full_monitoring = full_monitoring
         self.log_level = log_level
+        self.pack_artifacts = pack_artifacts
         self.payload = payload
+        self.pipeline_depth = pipeline_depth
         self.proxy = proxy if proxy is not None else cmssw.Proxy()
         self.threshold_for_failure = threshold_for_failure
         self.threshold_for_skipping = threshold_for_skipping
+        self.unit_ranges = unit_ranges
         self.wq_max_retries = wq_max_retries
         self.wq_port = wq_port
         self.xrootd_servers = xrootd_servers if xrootd_servers else ['cmsxrootd.fnal.gov']
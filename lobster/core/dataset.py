@@ -50,6 +50,41 @@ def flatten(files, matches=None):
     return res
 
 
+class LumiRange(object):
+
+    """
+    A lazy sequence of consecutive luminosity sections of one run.
+
+    Behaves like a list of `(run, lumi)` tuples when iterated over, without
+    storing them.  Used for generated datasets, which may consist of
+    millions of luminosity sections.
+
+    Parameters
+    ----------
+        run : int
+            The run number.
+        first : int
+            The first luminosity section.
+        last : int
+            The last luminosity section, inclusive.
+    """
+
+    def __init__(self, run, first, last):
+        self.run = run
+        self.first = first
+        self.last = last
+
+    def __len__(self):
+        return max(0, self.last - self.first + 1)
+
+    def __iter__(self):
+        for lumi in xrange(self.first, self.last + 1):
+            yield (self.run, lumi)
+
+    def __repr__(self):
+        return 'LumiRange({0}, {1}, {2})'.format(self.run, self.first, self.last)
+
+
 class FileInfo(object):
 
     def __init__(self):
@@ -188,7 +223,7 @@ class ProductionDataset(Configurable):
         dset = DatasetInfo()
         dset.file_based = True
 
-        dset.files[None].lumis = [(1, x) for x in range(1, self.total_units + 1)]
+        dset.files[None].lumis = LumiRange(1, 1, self.total_units)
         dset.total_units = self.total_units
         dset.tasksize = self.lumis_per_task
 
@@ -237,7 +272,7 @@ class MultiProductionDataset(ProductionDataset):
 
         files = flatten(self.gridpacks)
         for run, fn in enumerate(files):
-            dset.files[fn].lumis = [(run, x) for x in range(1, self.lumis_per_gridpack + 1)]
+            dset.files[fn].lumis = LumiRange(run, 1, self.lumis_per_gridpack)
 
         self.total_units = len(files) * self.lumis_per_gridpack
         dset.total_units = self.total_units
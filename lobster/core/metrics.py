@@ -0,0 +1,101 @@
+import os
+
+from collections import OrderedDict
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metrics(object):
+
+    """
+    Metrics in the text exposition format of Prometheus.
+
+    Samples are grouped into families by name, each with a type and a
+    description.  The resulting text is written to a file, e.g., to be
+    picked up by the textfile collector of the Prometheus node exporter.
+
+    Parameters
+    ----------
+        labels : dict
+            Labels to attach to every sample, e.g., the project.
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.__families = OrderedDict()
+
+    def __sample(self, kind, name, help, value, labels, suffix=''):
+        family = self.__families.setdefault(name, (kind, help, []))
+        if family[0] != kind:
+            raise ValueError("metric {0} is a {1}, not a {2}".format(name, family[0], kind))
+        all_labels = dict(self.labels)
+        all_labels.update(labels)
+        family[2].append((name + suffix, sorted(all_labels.items()), value))
+
+    def gauge(self, name, help, value, **labels):
+        self.__sample('gauge', name, help, value, labels)
+
+    def counter(self, name, help, value, **labels):
+        """Add a counter, with `_total` appended to `name` as required by
+        the naming conventions of Prometheus.
+        """
+        if not name.endswith('_total'):
+            name += '_total'
+        self.__sample('counter', name, help, value, labels)
+
+    def histogram(self, name, help, buckets, histograms, label, **labels):
+        """Add histograms as recorded by :class:`~lobster.util.Timing`.
+
+        Parameters
+        ----------
+            name : str
+                The name of the metric.
+            help : str
+                The description of the metric.
+            buckets : list
+                The upper bounds of the bins of the histograms.
+            histograms : dict
+                The number of measurements, the counts per bin, and the
+                sum of the measurements, with the value of the label
+                `label` as key.
+            label : str
+                The label to distinguish histograms by.
+        """
+        for key, (count, bins, total) in sorted(histograms.items()):
+            hlabels = dict(labels)
+            hlabels[label] = key
+            cumulative = 0
+            for bound, n in zip(list(buckets) + [float('inf')], bins):
+                cumulative += n
+                blabels = dict(hlabels)
+                blabels['le'] = number(bound)
+                self.__sample('histogram', name, help, cumulative, blabels, '_bucket')
+            self.__sample('histogram', name, help, total, hlabels, '_sum')
+            self.__sample('histogram', name, help, count, hlabels, '_count')
+
+    def text(self):
+        lines = []
+        for name, (kind, help, samples) in self.__families.items():
+            lines.append('# HELP {0} {1}'.format(name, help.replace('\\', r'\\').replace('\n', r'\n')))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for sample, labels, value in samples:
+                if labels:
+                    sample += '{' + ','.join('{0}="{1}"'.format(k, escape(v)) for k, v in labels) + '}'
+                lines.append('{0} {1}'.format(sample, number(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Replace the file `path` with the metrics, atomically.
+        """
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.text())
+        os.rename(tmp, path)
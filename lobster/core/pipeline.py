@@ -0,0 +1,260 @@
+import Queue
+import sys
+import threading
+
+from lobster import util
+
+
+class Pipeline(util.Timing):
+
+    """
+    Background stages of the master loop.
+
+    Tasks returned by `WorkQueue` are passed to a thread releasing them to
+    the task source, and new tasks are created in a second thread, while
+    the main thread keeps waiting on and submitting to `WorkQueue`, which
+    is not thread safe.  Both stages use the database connection of the
+    task source, and are serialized with `lock`, which the main thread has
+    to hold as well to use the task source.
+
+    At most `depth` returned tasks are buffered, after which :meth:`put`
+    blocks until the release stage has caught up.  Tasks are created upon
+    :meth:`request`, and collected with :meth:`created`, only after they
+    have been committed to the database.  Exceptions of either stage are
+    re-raised by :meth:`check` in the main thread.
+
+    The durations of the stages are recorded separately from the timing
+    of the main thread, which they overlap.
+
+    Parameters
+    ----------
+        source : TaskProvider
+            The task source to use.
+        depth : int
+            The maximum number of returned tasks to buffer.
+    """
+
+    def __init__(self, source, depth):
+        util.Timing.__init__(self, 'create', 'return')
+        self.source = source
+        self.lock = threading.RLock()
+        self.failed = None
+        self.__returned = Queue.Queue(depth)
+        self.__created = Queue.Queue()
+        self.__demand = Queue.Queue(1)
+        self.__requested = False
+        self.__pending = 0
+        self.__done = threading.Condition()
+        self.__error = None
+        self.__stop = threading.Event()
+        self.__threads = [
+            threading.Thread(target=self.__release, name='release'),
+            threading.Thread(target=self.__create, name='create')
+        ]
+        for thread in self.__threads:
+            thread.daemon = True
+            thread.start()
+
+    def check(self):
+        """Re-raise an exception of a background stage.
+        """
+        if self.__error is not None:
+            raise self.__error[0], self.__error[1], self.__error[2]
+
+    def put(self, task):
+        """Hand a returned task to the release stage.
+        """
+        with self.__done:
+            self.__pending += 1
+        while True:
+            self.check()
+            try:
+                self.__returned.put(task, timeout=1)
+                return
+            except Queue.Full:
+                pass
+
+    def drain(self):
+        """Wait until all returned tasks have been released.
+        """
+        with self.__done:
+            while self.__pending > 0:
+                self.check()
+                self.__done.wait(1)
+        self.check()
+
+    def request(self, total, have):
+        """Ask for new tasks to be created, see
+        :meth:`~lobster.core.source.TaskProvider.obtain` for the arguments.  Returns `False` if
+        the previous request has not been completed yet.
+        """
+        if self.__requested:
+            return False
+        self.__requested = True
+        self.__demand.put((total, have))
+        return True
+
+    def created(self):
+        """Return the tasks created so far.
+        """
+        tasks = []
+        while True:
+            try:
+                task = self.__created.get_nowait()
+            except Queue.Empty:
+                return tasks
+            if task is None:
+                # end of a request
+                self.__requested = False
+            else:
+                tasks.append(task)
+
+    def stop(self):
+        self.__stop.set()
+        for thread in self.__threads:
+            thread.join()
+
+    def __release(self):
+        while not self.__stop.is_set():
+            try:
+                tasks = [self.__returned.get(timeout=1)]
+            except Queue.Empty:
+                continue
+            while True:
+                try:
+                    tasks.append(self.__returned.get_nowait())
+                except Queue.Empty:
+                    break
+            try:
+                with self.lock, self.measure('return'), self.source.transaction():
+                    self.source.release(tasks)
+            except Exception:
+                self.failed = tasks
+                self.__error = sys.exc_info()
+                return
+            finally:
+                with self.__done:
+                    self.__pending -= len(tasks)
+                    self.__done.notify_all()
+
+    def __create(self):
+        while not self.__stop.is_set():
+            try:
+                total, have = self.__demand.get(timeout=1)
+            except Queue.Empty:
+                continue
+            try:
+                with self.lock, self.measure('create'), self.source.transaction():
+                    tasks = list(self.source.obtain(total, have))
+            except Exception:
+                self.__error = sys.exc_info()
+                self.__created.put(None)
+                return
+            # tasks are only submitted once they are committed, so that
+            # a rollback cannot leave them running unrecorded
+            for task in tasks:
+                self.__created.put(task)
+            self.__created.put(None)
+
+
+class ReturnWindow(object):
+
+    """
+    Adaptive sizing of the time the master spends collecting returned
+    tasks, and of the number of tasks to release at once.
+
+    Each iteration of the master loop has a fixed cost, the `overhead` of
+    logging statistics, creating tasks, and taking recurring actions,
+    while releasing tasks costs time per task.  Tasks are collected for at
+    least as long as it takes to keep the overhead below the fraction
+    `target` of the iteration, and after that only while the queue holds
+    enough waiting tasks to keep the workers busy during the next
+    iteration, given the observed completion rate.  At most as many tasks
+    as can be released within `budget` seconds are collected at once.
+
+    Parameters
+    ----------
+        minimum : float
+            The minimal time to collect tasks, in seconds.
+        maximum : float
+            The maximal time to collect tasks, in seconds.
+        target : float
+            The fraction of the time of an iteration the overhead should
+            take at most.
+        budget : float
+            How long releasing a batch of tasks should take, in seconds.
+        smoothing : float
+            The weight of new measurements in the running averages.
+    """
+
+    def __init__(self, minimum=1, maximum=120, target=0.2, budget=60, smoothing=0.3):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target
+        self.budget = budget
+        self.smoothing = smoothing
+
+        self.overhead = 0.
+        self.rate = None
+        self.cost = None
+
+    def __average(self, old, new):
+        if old is None:
+            return new
+        return (1 - self.smoothing) * old + self.smoothing * new
+
+    def update(self, overhead, count, elapsed, release):
+        """Record the duration of an iteration.
+
+        Parameters
+        ----------
+            overhead : float
+                The time spent outside of collecting and releasing tasks.
+            count : int
+                The number of tasks collected.
+            elapsed : float
+                The time spent collecting tasks.
+            release : float
+                The time spent releasing tasks.
+        """
+        self.overhead = self.__average(self.overhead, overhead)
+        if elapsed > 0:
+            self.rate = self.__average(self.rate, count / float(elapsed))
+        if count > 0:
+            self.cost = self.__average(self.cost, release / float(count))
+
+    @property
+    def window(self):
+        """The time to collect tasks for, even without waiting tasks.
+        """
+        return min(max(self.overhead * (1 - self.target) / self.target, self.minimum), self.maximum)
+
+    @property
+    def batch(self):
+        """The maximum number of tasks to collect.
+        """
+        if not self.cost:
+            return None
+        return max(int(self.budget / self.cost), 1)
+
+    def remaining(self, count, elapsed, waiting):
+        """Return how long to keep collecting tasks, or 0 to stop.
+
+        Parameters
+        ----------
+            count : int
+                The number of tasks collected so far.
+            elapsed : float
+                The time spent collecting tasks so far.
+            waiting : int
+                The number of tasks waiting in the queue.
+        """
+        left = self.maximum - elapsed
+        if left <= 0 or (self.batch and count >= self.batch):
+            return 0
+        # Workers have to be kept busy while the collected tasks are
+        # released and new ones created
+        busy = self.overhead + (self.cost or 0) * count
+        if waiting > 0 and waiting > (self.rate or 0) * busy:
+            return left
+        return max(self.window - elapsed, 0)
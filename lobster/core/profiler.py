@@ -0,0 +1,93 @@
+import logging
+import os
+import sys
+import threading
+import time
+
+from collections import Counter
+
+logger = logging.getLogger('lobster.profiler')
+
+
+class SamplingProfiler(object):
+
+    """
+    Statistical profiler for a running process.
+
+    A background thread records the stacks of all other threads every
+    `interval` seconds, for `duration` seconds.  Afterwards, the number of
+    times each stack has been seen is written to `path` in the collapsed
+    format used by flame graph tools, one stack per line, with the thread
+    name as the root frame.  Functions are identified by their name, file,
+    and first line, so that samples in different lines of a function are
+    merged.
+
+    The running threads are only interrupted for as long as it takes to
+    copy their stacks, which makes the profiler cheap enough to use on a
+    master in production.
+
+    Parameters
+    ----------
+        path : str
+            The file to write the collapsed stacks to.
+        duration : float
+            How long to sample for, in seconds.
+        interval : float
+            How long to wait between samples, in seconds.
+    """
+
+    def __init__(self, path, duration=60, interval=0.01):
+        self.path = path
+        self.duration = duration
+        self.interval = interval
+        self.samples = 0
+        self.__stacks = Counter()
+        self.__thread = None
+
+    @staticmethod
+    def frame(code):
+        return '{0} ({1}:{2})'.format(code.co_name, code.co_filename, code.co_firstlineno).replace(';', ',')
+
+    def sample(self):
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        me = threading.current_thread().ident
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self.frame(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, 'thread-{0}'.format(ident)).replace(';', ','))
+            self.__stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def running(self):
+        return self.__thread is not None and self.__thread.is_alive()
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.__run, name='profiler')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def join(self):
+        self.__thread.join()
+
+    def write(self):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            for stack, count in sorted(self.__stacks.items()):
+                f.write('{0} {1}\n'.format(stack, count))
+        os.rename(tmp, self.path)
+
+    def __run(self):
+        end = time.time() + self.duration
+        try:
+            while time.time() < end:
+                self.sample()
+                time.sleep(self.interval)
+            self.write()
+            logger.info("wrote {0} samples of {1} stacks to {2}".format(
+                self.samples, len(self.__stacks), self.path))
+        except Exception:
+            logger.exception("profiling failed")
@@ -1,5 +1,6 @@
 import datetime
 import glob
+import inspect
 import json
 import logging
 import os
@@ -8,21 +9,56 @@ import shutil
 import socket
 import subprocess
 import sys
+import time
 import work_queue as wq
 
-from collections import defaultdict, Counter
+from collections import defaultdict, deque, Counter
 from hashlib import sha1
+from multiprocessing.pool import ThreadPool
 
 from lobster import fs, util
 from lobster.cmssw import dash
 from lobster.core import unit
 from lobster.core import Algo
+from lobster.core.artifacts import ArtifactStore
 from lobster.core import MergeTaskHandler
 
 from WMCore.Storage.SiteLocalConfig import loadSiteLocalConfig, SiteConfigError
 
 logger = logging.getLogger('lobster.source')
 
+# Number of threads writing task directories and processing returned
+# tasks
+MATERIALIZE_THREADS = 4
+
+
+def materialize(workdir, id, config):
+    """Create the directory of a task and write its parameters.
+    """
+    jdir = util.taskdir(workdir, id)
+    with open(os.path.join(jdir, 'parameters.json'), 'w') as f:
+        json.dump(config, f, indent=2)
+        f.write('\n')
+
+
+class Snapshot(object):
+
+    """Plain copy of the data attributes of a WorkQueue object.
+
+    Returned tasks are processed in a pool of threads, while their
+    attributes are read through SWIG from the master's WorkQueue: copy them
+    on the thread fetching the task, including nested objects like the
+    measured resources.
+    """
+
+    def __init__(self, thing):
+        for name, value in inspect.getmembers(thing):
+            if name.startswith('_') or name == 'this' or inspect.isroutine(value):
+                continue
+            if hasattr(value, 'this'):
+                value = Snapshot(value)
+            setattr(self, name, value)
+
 
 class ReleaseSummary(object):
 
@@ -70,6 +106,16 @@ class ReleaseSummary(object):
     def monitor(self, taskid):
         self.__monitors.append(taskid)
 
+    def update(self, other):
+        """Add the tasks of another summary.
+        """
+        for status, ids in other.__exe.items():
+            self.__exe.setdefault(status, []).extend(ids)
+        for flag, ids in other.__wq.items():
+            self.__wq.setdefault(flag, []).extend(ids)
+        self.__taskdirs.update(other.__taskdirs)
+        self.__monitors.extend(other.__monitors)
+
     def __str__(self):
         s = "received the following task(s):\n"
         for status in sorted(self.__exe.keys()):
@@ -145,6 +191,12 @@ class TaskProvider(util.Timing):
 
         self.__taskhandlers = {}
         self.__store = unit.UnitStore(self.config)
+        self.__pool = ThreadPool(MATERIALIZE_THREADS)
+        self.__optimized = 0
+        self.__artifacts = dict(
+            (wflow.label, ArtifactStore(os.path.join(self.workdir, wflow.label), self.config.advanced.pack_artifacts))
+            for wflow in self.config.workflows
+        )
 
         self.__setup_inputs()
         self.copy_siteconf()
@@ -189,7 +241,7 @@ class TaskProvider(util.Timing):
                 util.register_checkpoint(self.workdir, wflow.label, 'REGISTERED')
             elif os.path.exists(os.path.join(wflow.workdir, 'running')):
                 for id in self.get_taskids(wflow.label):
-                    util.move(wflow.workdir, id, 'failed')
+                    self.__artifacts[wflow.label].archive(id, 'failed')
 
         for wflow in self.config.workflows:
             if wflow.parent:
@@ -205,6 +257,7 @@ class TaskProvider(util.Timing):
                 util.register_checkpoint(self.workdir, 'sandbox cmssw version', list(versions)[0])
 
         if self.config.elk:
+            self.config.elk.setup(self.config)
             if create:
                 categories = {wflow.category.name: [] for wflow in self.config.workflows}
                 for category in categories:
@@ -304,8 +357,11 @@ class TaskProvider(util.Timing):
         for d in glob.glob(os.path.join(parent, '*', '*')):
             yield int(os.path.relpath(d, parent).replace(os.path.sep, ''))
 
-    def get_report(self, label, task):
-        return os.path.join(self.workdir, label, 'successful', util.id2dir(task), 'report.json')
+    def get_report(self, label, task, taskdir):
+        """Return the path to the report of a successful task, or `None`
+        if there is none.  Packed reports are extracted into `taskdir`.
+        """
+        return self.__artifacts[label].path(task, 'report.json', 'successful', taskdir)
 
     def obtain(self, total, tasks):
         """
@@ -324,6 +380,15 @@ class TaskProvider(util.Timing):
             tasks : dict
                 Dictionary with category names as keys and the number of
                 tasks in the queue as values.
+
+        Yields
+        ------
+            task : tuple
+                The category, command, id, inputs, outputs, environment,
+                and directory of a task.  Task directories are written by
+                a pool of threads while the following tasks are prepared,
+                and tasks are yielded in order as soon as their directory
+                is complete.
         """
         remaining = dict((wflow, self.__store.work_left(wflow.label)) for wflow in self.config.workflows)
 
@@ -336,9 +401,9 @@ class TaskProvider(util.Timing):
             taskinfos += infos
 
         if not taskinfos or len(taskinfos) == 0:
-            return []
+            return
 
-        tasks = []
+        pending = deque()
         ids = []
         registration = dict(
             zip(
@@ -351,7 +416,7 @@ class TaskProvider(util.Timing):
             wflow = getattr(self.config.workflows, label)
             ids.append(id)
 
-            jdir = util.taskdir(wflow.workdir, id)
+            jdir = util.taskdir(wflow.workdir, id, create=False)
             inputs = list(self._inputs)
             inputs.append((os.path.join(jdir, 'parameters.json'), 'parameters.json', False))
             outputs = [(os.path.join(jdir, f), f) for f in ['report.json']]
@@ -395,10 +460,10 @@ class TaskProvider(util.Timing):
                 inreports = []
 
                 for task, _, _, _ in lumis:
-                    report = self.get_report(label, task)
+                    report = self.get_report(label, task, jdir)
                     _, infile = list(wflow.get_outputs(task))[0]
 
-                    if os.path.isfile(report):
+                    if report:
                         inreports.append(report)
                         infiles.append((task, infile))
                     else:
@@ -431,21 +496,55 @@ class TaskProvider(util.Timing):
             # input/output files
             handler.adjust(config, inputs, outputs, self._storage)
 
-            with open(os.path.join(jdir, 'parameters.json'), 'w') as f:
-                json.dump(config, f, indent=2)
-                f.write('\n')
+            self.__taskhandlers[id] = handler
 
-            tasks.append(('merge' if merge else wflow.category.name, cmd, id, inputs, outputs, env, jdir))
+            pending.append((
+                self.__pool.apply_async(materialize, (wflow.workdir, id, config)),
+                ('merge' if merge else wflow.category.name, cmd, id, inputs, outputs, env, jdir)
+            ))
+            while len(pending) > 0 and pending[0][0].ready():
+                result, task = pending.popleft()
+                result.get()
+                yield task
 
-            self.__taskhandlers[id] = handler
+        while len(pending) > 0:
+            result, task = pending.popleft()
+            result.get()
+            yield task
 
         logger.info("creating task(s) {0}".format(", ".join(map(str, ids))))
 
-        self.config.advanced.dashboard.free()
+    def __process(self, task):
+        """Process the output of a returned task.
 
-        return tasks
+        Runs in the thread pool, and thus only collects the information
+        needed to update the database, and files the task directory.
+        """
+        handler = self.__taskhandlers[task.tag]
+        summary = ReleaseSummary()
+        transfers = defaultdict(lambda: defaultdict(Counter))
+        failed, task_update, file_update, unit_update = handler.process(task, summary, transfers)
+
+        if self.config.elk:
+            self.config.elk.index_task(task)
+            self.config.elk.index_task_update(task_update)
+
+        artifacts = self.__artifacts[handler.dataset]
+        if failed:
+            faildir = artifacts.archive(handler.id, 'failed')
+            summary.dir(str(handler.id), faildir)
+        else:
+            artifacts.archive(handler.id, 'successful')
+
+        return failed, task_update, file_update, unit_update, summary, transfers
 
     def release(self, tasks):
+        """Process returned tasks and update the database.
+
+        Task outputs are processed concurrently in a pool of threads, and
+        the results are entered into the database at once.  The tasks have
+        to be passed as :class:`Snapshot` copies.
+        """
         fail_cleanup = []
         merge_cleanup = []
         input_cleanup = []
@@ -460,26 +559,22 @@ class TaskProvider(util.Timing):
                 (task.tag, dash.DONE) for task in tasks
             )
 
-        for task in tasks:
-            with self.measure('updates'):
-                handler = self.__taskhandlers[task.tag]
-                failed, task_update, file_update, unit_update = handler.process(task, summary, transfers)
+        with self.measure('updates'):
+            results = self.__pool.map(self.__process, tasks)
 
-                wflow = getattr(self.config.workflows, handler.dataset)
+        for task, (failed, task_update, file_update, unit_update, task_summary, task_transfers) in zip(tasks, results):
+            handler = self.__taskhandlers[task.tag]
+            wflow = getattr(self.config.workflows, handler.dataset)
 
-            with self.measure('elk'):
-                if self.config.elk:
-                    self.config.elk.index_task(task)
-                    self.config.elk.index_task_update(task_update)
+            summary.update(task_summary)
+            for label, protocols in task_transfers.items():
+                for protocol, counts in protocols.items():
+                    transfers[label][protocol].update(counts)
 
             with self.measure('handler'):
                 if failed:
-                    faildir = util.move(wflow.workdir, handler.id, 'failed')
-                    summary.dir(str(handler.id), faildir)
                     fail_cleanup.extend([lf for rf, lf in handler.outputs])
                 else:
-                    util.move(wflow.workdir, handler.id, 'successful')
-
                     merge = isinstance(handler, MergeTaskHandler)
 
                     if (wflow.merge_size <= 0 or merge) and len(handler.outputs) > 0:
@@ -537,10 +632,20 @@ class TaskProvider(util.Timing):
                 except Exception as e:
                     logger.error('ELK failed to index summary:\n{}'.format(e))
 
+    def transaction(self):
+        """Group all database writes within the context into one commit.
+        """
+        return self.__store.transaction()
+
     def terminate(self):
         self.config.advanced.dashboard.update_task_status(
             (str(id), dash.CANCELLED) for id in self.__store.running_tasks()
         )
+        self.config.advanced.dashboard.flush(60)
+        if self.config.elk:
+            self.config.elk.flush()
+        self.__pool.close()
+        self.__pool.join()
 
     def done(self):
         left = self.__store.unfinished_units()
@@ -560,6 +665,16 @@ class TaskProvider(util.Timing):
             logger.warning("could not update task states to dashboard")
             logger.exception(e)
 
+    def maintain(self):
+        """Archive finished tasks, and keep the database statistics up to
+        date.  Optimizing the database is only done once an hour.
+        """
+        with self.measure('sqlite'):
+            self.__store.archive_tasks()
+            if time.time() - self.__optimized > 3600:
+                self.__store.optimize()
+                self.__optimized = time.time()
+
     def update_stuck(self):
         """Have the unit store updated the statistics for stuck units.
         """
@@ -0,0 +1,283 @@
+import bisect
+import json
+import logging
+import os
+import re
+import time
+
+import numpy as np
+
+logger = logging.getLogger('lobster.statslog')
+
+MAGIC = 'LOBSTERSTATS1\n'
+
+
+class TimeColumn(object):
+
+    """Sequence of the timestamps of a log, to search it with `bisect`
+    without reading the whole column.
+    """
+
+    def __init__(self, data):
+        self.__data = data
+
+    def __len__(self):
+        return len(self.__data)
+
+    def __getitem__(self, index):
+        return self.__data[index, 0]
+
+
+class StatsLog(object):
+
+    """
+    Columnar binary log of the statistics of the master.
+
+    Every sample is stored as a record of 64 bit floats, one per field,
+    following a header with the field names.  Samples are appended
+    cheaply, and a time window is read by mapping the file into memory,
+    only touching the samples within the window.  The first field has to
+    be the timestamp of the sample, in microseconds.
+
+    Samples older than `age` seconds are downsampled by :meth:`compact`
+    to the last sample of each interval of `resolution` seconds, and moved
+    into an archive stored alongside the log.  As the last sample of each
+    interval is kept, differences of cumulative fields stay exact.
+
+    Parameters
+    ----------
+        path : str
+            The path of the log.
+        fields : list
+            The names of the fields, when writing to the log.  An existing
+            log with different fields is moved aside, to `path` with the
+            current time appended, see :class:`StatsHistory` to read it.
+        age : int
+            The age of samples to keep at full resolution, in seconds.
+        resolution : int
+            The resolution of older samples, in seconds.
+    """
+
+    def __init__(self, path, fields=None, age=24 * 3600, resolution=300):
+        self.path = path
+        self.archive = path + '.archive'
+        self.age = age
+        self.resolution = resolution
+        self.compacted = time.time()
+
+        if fields is None:
+            self.fields = self.header(path)[0]
+            return
+
+        self.fields = list(fields)
+        if os.path.exists(path):
+            existing, offset = self.header(path)
+            if existing != self.fields:
+                moved = '{0}.{1}'.format(path, int(time.time()))
+                logger.info("fields changed, moving {0} to {1}".format(path, moved))
+                if os.path.exists(self.archive):
+                    os.rename(self.archive, moved + '.archive')
+                os.rename(path, moved)
+            else:
+                # Drop a partially written sample
+                size = os.path.getsize(path)
+                record = 8 * len(self.fields)
+                if (size - offset) % record != 0:
+                    with open(path, 'r+b') as f:
+                        f.truncate(size - (size - offset) % record)
+        if not os.path.exists(path):
+            self.create(path, self.fields)
+
+    @staticmethod
+    def header(path):
+        """Return the fields and data offset of the log `path`.
+        """
+        with open(path, 'rb') as f:
+            if f.readline() != MAGIC:
+                raise IOError("{0} is not a statistics log".format(path))
+            fields = json.loads(f.readline())
+            return fields, f.tell()
+
+    @staticmethod
+    def create(path, fields):
+        # Pad the header so that records are aligned
+        line = json.dumps(fields)
+        line += ' ' * (-(len(MAGIC) + len(line) + 1) % 8) + '\n'
+        with open(path, 'wb') as f:
+            f.write(MAGIC + line)
+
+    def __map(self, path):
+        if not os.path.exists(path):
+            return np.zeros((0, len(self.fields)))
+        fields, offset = self.header(path)
+        rows = (os.path.getsize(path) - offset) // (8 * len(fields))
+        if rows == 0:
+            return np.zeros((0, len(fields)))
+        return np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(rows, len(fields)))
+
+    def append(self, values):
+        with open(self.path, 'ab') as f:
+            f.write(np.asarray(values, dtype='<f8').tostring())
+
+    def bounds(self):
+        """Return the timestamps of the first and last sample, or `None`
+        if there are no samples.
+        """
+        archive = self.__map(self.archive)
+        recent = self.__map(self.path)
+        if len(archive) + len(recent) == 0:
+            return None
+        first = archive[0, 0] if len(archive) > 0 else recent[0, 0]
+        last = recent[-1, 0] if len(recent) > 0 else archive[-1, 0]
+        return first, last
+
+    def read(self, start=None, end=None):
+        """Return the samples with timestamps between `start` and `end`,
+        including archived ones, as a two dimensional array.
+        """
+        # The log is mapped before the archive, which `compact` replaces
+        # first.  Samples of the log archived already are skipped, so that
+        # a concurrent compaction never shows them twice.
+        recent = self.__map(self.path)
+        archive = self.__map(self.archive)
+        if len(archive) > 0:
+            recent = recent[bisect.bisect_right(TimeColumn(recent), archive[-1, 0]):]
+
+        parts = []
+        for data in (archive, recent):
+            column = TimeColumn(data)
+            lo = bisect.bisect_left(column, start) if start is not None else 0
+            hi = bisect.bisect_right(column, end) if end is not None else len(data)
+            parts.append(np.array(data[lo:hi]))
+        return np.concatenate(parts)
+
+    def compact(self, now=None):
+        """Downsample samples older than `age`, and move them into the
+        archive.
+        """
+        self.compacted = time.time()
+        width = self.resolution * 1e6
+        cutoff = ((now or time.time()) - self.age) * 1e6
+        data = self.__map(self.path)
+        split = bisect.bisect_left(TimeColumn(data), np.floor(cutoff / width) * width)
+        if split == 0:
+            return
+
+        old = np.array(data[:split])
+        bins = np.floor(old[:, 0] / width)
+        last = np.append(np.flatnonzero(np.diff(bins)), len(old) - 1)
+
+        # Both files are replaced atomically, the archive first.  Until
+        # the log is replaced, too, samples archived already are skipped
+        # by `read`, and when compacting again.
+        archive = self.__map(self.archive)
+        rows = old[last]
+        if len(archive) > 0:
+            rows = rows[rows[:, 0] > archive[-1, 0]]
+        tmp = self.archive + '.tmp'
+        self.create(tmp, self.fields)
+        with open(tmp, 'ab') as f:
+            f.write(np.array(archive).astype('<f8').tostring())
+            f.write(rows.astype('<f8').tostring())
+        os.rename(tmp, self.archive)
+
+        tmp = self.path + '.tmp'
+        self.create(tmp, self.fields)
+        with open(tmp, 'ab') as f:
+            f.write(np.array(data[split:]).astype('<f8').tostring())
+        os.rename(tmp, self.path)
+        logger.debug("moved {0} samples of {1} into {2} archived ones".format(
+            len(old), self.path, len(last)))
+
+
+class StatsHistory(object):
+
+    """
+    Read-only view of a log, preceded by the logs moved aside from it
+    when its fields changed.
+
+    Provides the same methods to read samples as :class:`StatsLog`.
+    Samples of earlier logs are mapped to the fields of the current log by
+    name, with missing fields set to `NaN`.
+
+    Parameters
+    ----------
+        path : str
+            The path of the current log.
+    """
+
+    def __init__(self, path):
+        directory, name = os.path.split(path)
+        pattern = re.compile(re.escape(name) + r'\.(\d+)$')
+        previous = []
+        for fn in os.listdir(directory or '.'):
+            m = pattern.match(fn)
+            if m:
+                previous.append((int(m.group(1)), os.path.join(directory, fn)))
+
+        self.logs = [StatsLog(fn) for (_, fn) in sorted(previous)] + [StatsLog(path)]
+        self.fields = self.logs[-1].fields
+
+    def bounds(self):
+        """Return the timestamps of the first and last sample of all logs,
+        or `None` if there are no samples.
+        """
+        bounds = [b for b in (log.bounds() for log in self.logs) if b is not None]
+        if len(bounds) == 0:
+            return None
+        return min(first for (first, _) in bounds), max(last for (_, last) in bounds)
+
+    def read(self, start=None, end=None):
+        """Return the samples of all logs with timestamps between `start`
+        and `end`, as a two dimensional array.
+        """
+        parts = []
+        for log in self.logs:
+            data = log.read(start, end)
+            if log.fields == self.fields:
+                parts.append(data)
+                continue
+            index = dict((k, n) for n, k in enumerate(log.fields))
+            part = np.empty((len(data), len(self.fields)))
+            part.fill(np.nan)
+            for n, k in enumerate(self.fields):
+                if k in index:
+                    part[:, n] = data[:, index[k]]
+            parts.append(part)
+        return np.concatenate(parts)
+
+
+def convert(textfile, path, chunk=10000):
+    """Convert the text log `textfile` into the statistics log `path`.
+
+    Lines with a different header than the last one are converted by
+    field name, with missing fields set to `NaN`.  Returns the number of
+    samples converted.
+    """
+    with open(textfile) as f:
+        headers = [line[1:].split() for line in f if line.startswith('#')]
+    if len(headers) == 0:
+        raise IOError("{0} has no header".format(textfile))
+    fields = headers[-1]
+
+    log = StatsLog(path, fields)
+    count = 0
+    rows = []
+    with open(textfile) as f:
+        for line in f:
+            if line.startswith('#'):
+                index = dict((k, n) for n, k in enumerate(line[1:].split()))
+                columns = [index.get(k) for k in fields]
+                continue
+            values = line.split()
+            if len(values) != len(index):
+                continue
+            rows.append([float(values[n]) if n is not None else np.nan for n in columns])
+            if len(rows) >= chunk:
+                log.append(rows)
+                count += len(rows)
+                rows = []
+    if rows:
+        log.append(rows)
+        count += len(rows)
+    return count
@@ -1,10 +1,12 @@
 from collections import Counter, defaultdict
-import json
+from contextlib import contextmanager
 import logging
+import bisect
+import json
 import math
 import os
-from retrying import retry
 import sqlite3
+import time
 import uuid
 
 from lobster import util
@@ -28,6 +30,25 @@ MERGED = 8
 PROCESS = 0
 MERGE = 1
 
+# Time granularity of transfer statistics, in seconds
+TRANSFER_BUCKET = 3600
+
+# Columns added to the workflow table by later versions, with their
+# definitions.  Databases lacking them are upgraded on open, see
+# `UnitStore.__upgrade`.
+WORKFLOW_COLUMNS = [
+    ('units_registered', 'int default 0'),
+    ('units_stuck_own', 'int default 0'),
+    ('units_failed', 'int default 0'),
+    ('units_skipped', 'int default 0'),
+    ('units_merged', 'int default 0'),
+    ('units_unmerged', 'int default 0'),
+    ('events_read', 'int default 0'),
+    ('events_written', 'int default 0'),
+    ('tasks_archived', 'int default 0'),
+    ('unittime_archived', 'real default 0'),
+]
+
 TaskUpdate = util.record('TaskUpdate',
                          'bytes_bare_output',
                          'bytes_output',
@@ -77,14 +98,289 @@ TaskUpdate = util.record('TaskUpdate',
                          default=0)
 
 
+WorkflowState = util.record('WorkflowState',
+                            'id',
+                            'label',
+                            'tasksize',
+                            'stop_on_file_boundary',
+                            'merged',
+                            'units_available',
+                            'units_left',
+                            'units_running',
+                            'units_unfinished')
+
+
+def lumi_ranges(lumis):
+    """Compress luminosity sections into contiguous ranges.
+
+    Consecutive sections of the same run are merged in the order they are
+    passed in, without holding all of them in memory.
+
+    Parameters
+    ----------
+        lumis : iterable
+            An iterable of `(run, lumi)` tuples.
+
+    Yields
+    ------
+        run : int
+            The run of the range.
+        first : int
+            The first luminosity section of the range.
+        count : int
+            The number of luminosity sections in the range.
+    """
+    current = None
+    for run, lumi in lumis:
+        if current and run == current[0] and lumi == current[1] + current[2]:
+            current[2] += 1
+            continue
+        if current:
+            yield tuple(current)
+        current = [run, lumi, 1]
+    if current:
+        yield tuple(current)
+
+
+class StatementStats(object):
+
+    """Per-statement timing of an SQLite connection.
+
+    Wraps a connection and records, for every distinct statement, the
+    number of executions, the total and maximal time spent, and the
+    number of rows modified.  For queries, the time covers the execution
+    up to the first row only.  All other attributes are passed through to
+    the connection.
+
+    Parameters
+    ----------
+        db : sqlite3.Connection
+            The connection to instrument.
+    """
+
+    def __init__(self, db):
+        self.__db = db
+        self.stats = {}
+
+    def __getattr__(self, attr):
+        return getattr(self.__db, attr)
+
+    def __enter__(self):
+        return self.__db.__enter__()
+
+    def __exit__(self, *args):
+        return self.__db.__exit__(*args)
+
+    def __record(self, sql, method, args):
+        start = time.time()
+        cur = method(sql, *args)
+        duration = time.time() - start
+
+        key = ' '.join(sql.split())
+        calls, total, longest, rows = self.stats.get(key, (0, 0., 0., 0))
+        self.stats[key] = (
+            calls + 1,
+            total + duration,
+            max(longest, duration),
+            rows + max(cur.rowcount, 0)
+        )
+        return cur
+
+    def execute(self, sql, *args):
+        return self.__record(sql, self.__db.execute, args)
+
+    def executemany(self, sql, *args):
+        return self.__record(sql, self.__db.executemany, args)
+
+    def load(self, filename):
+        """Add the statistics saved in `filename`, if present.
+        """
+        if not os.path.exists(filename):
+            return
+        try:
+            with open(filename) as f:
+                saved = json.load(f)
+        except ValueError:
+            logger.warning("can't read statement statistics from {0}".format(filename))
+            return
+        for key, (calls, total, longest, rows) in saved.items():
+            c, t, l, r = self.stats.get(key, (0, 0., 0., 0))
+            self.stats[key] = (calls + c, total + t, max(longest, l), rows + r)
+
+    def save(self, filename):
+        """Write the statistics to `filename`, atomically.
+        """
+        tmpname = filename + '.tmp'
+        with open(tmpname, 'w') as f:
+            json.dump(self.stats, f)
+        os.rename(tmpname, filename)
+
+
+class Merge(object):
+
+    """A group of processing tasks to be merged into one output.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.tasks = []
+        self.units = 0
+        self.size = 0
+
+    def add(self, task, units, size):
+        self.size += size
+        self.units += units
+        self.tasks.append(task)
+
+
+class MergePlanner(object):
+
+    """Incremental bin packing of processing task outputs into merges.
+
+    Open merges are kept between calls, ordered by the space they have
+    left.  Each call only places outputs of tasks that are not part of a
+    merge yet, and each output goes to the fullest merge it still fits
+    into (best fit).
+
+    Parameters
+    ----------
+        maxsize : int
+            The target size of merged outputs, in bytes.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.__merges = {}
+        self.__open = []
+        self.__tasks = {}
+        self.__next = 0
+
+    def __insert(self, merge):
+        bisect.insort(self.__open, (self.maxsize - merge.size, merge.key))
+
+    def __remove(self, merge):
+        del self.__open[bisect.bisect_left(self.__open, (self.maxsize - merge.size, merge.key))]
+        del self.__merges[merge.key]
+        for task in merge.tasks:
+            del self.__tasks[task]
+
+    def update(self, rows):
+        """Place new outputs into merges.
+
+        Parameters
+        ----------
+            rows : list
+                All tasks that currently await merging, as tuples of task
+                id, units processed, and output size.  Merges containing
+                tasks not listed any longer are dissolved, and their
+                remaining tasks placed anew.
+        """
+        current = set(task for (task, _, _) in rows)
+        for key in set(key for (task, key) in self.__tasks.items() if task not in current):
+            self.__remove(self.__merges[key])
+
+        new = sorted(((size, units, task) for (task, units, size) in rows if task not in self.__tasks), reverse=True)
+        if len(new) == 0:
+            return
+        minsize = min(size for (_, _, size) in rows)
+
+        for size, units, task in new:
+            i = bisect.bisect_left(self.__open, (size,))
+            if i < len(self.__open):
+                merge = self.__merges[self.__open.pop(i)[1]]
+            elif size + minsize <= self.maxsize:
+                # Outputs too large to be merged with even the smallest
+                # other output are left out
+                merge = Merge(self.__next)
+                self.__next += 1
+                self.__merges[merge.key] = merge
+            else:
+                continue
+            merge.add(task, units, size)
+            self.__tasks[task] = merge.key
+            self.__insert(merge)
+
+    def pop(self, complete=False):
+        """Remove and return merges that are ready.
+
+        Parameters
+        ----------
+            complete : bool
+                Whether all outputs of the workflow are available.  If set,
+                return all merges, otherwise only ones that are close to
+                the target size.
+
+        Returns
+        -------
+            merges : list
+                A list of :class:`Merge`, ordered by decreasing size, each
+                containing at least two tasks.
+        """
+        merges = []
+        for merge in sorted(self.__merges.values(), key=lambda m: (-m.size, m.key)):
+            if len(merge.tasks) < 2:
+                continue
+            # TODO maybe this threshold should be configurable? FIXME it's
+            # a magic number, anyways
+            if complete or merge.size >= self.maxsize * 0.9:
+                self.__remove(merge)
+                merges.append(merge)
+        return merges
+
+
 class UnitStore:
 
-    def __init__(self, config):
+    """Database of workflows, tasks, and units.
+
+    Parameters
+    ----------
+        config : Config
+            The Lobster configuration.
+        readonly : bool
+            Open the database for reading only, e.g., for status reports
+            and plotting.  The database has to exist, and its schema is
+            neither created nor upgraded, see `__upgrade`.  Any attempt to
+            write raises an error.  Use `snapshot` to read from a
+            consistent state while the master keeps writing.
+    """
+
+    def __init__(self, config, readonly=False):
         self.uuid = str(uuid.uuid4()).replace('-', '')
         self.db_path = os.path.join(config.workdir, "lobster.db")
-        self.db = sqlite3.connect(self.db_path, timeout=90)
+        self.stats_path = os.path.join(config.workdir, "dbstats.json")
+        if readonly and not os.path.exists(self.db_path):
+            # connecting would create an empty database
+            raise IOError("can't find database {0}".format(self.db_path))
+        # Transactions are handled explicitly in `transaction`, so that
+        # writes of several calls can be grouped into one commit.  The
+        # pipelined master uses the connection from several threads, one
+        # at a time.
+        self.db = StatementStats(
+            sqlite3.connect(self.db_path, timeout=90, isolation_level=None, check_same_thread=False))
+        if readonly:
+            self.db.execute("pragma query_only=on")
+        self.__depth = 0
+        self.__merges = {}
+        self.__stats_saved = time.time()
+        self.__state = None
 
         self.config = config
+        self.readonly = readonly
+
+        if readonly:
+            if self.__outdated():
+                self.db.close()
+                raise IOError("can't read database {0} of an earlier version; "
+                              "run `lobster process` to upgrade it".format(self.db_path))
+            return
+
+        # Only takes effect for new databases, allowing to release space
+        # freed by archiving tasks, see `optimize`.
+        self.db.execute("pragma auto_vacuum=incremental")
+        # With a write-ahead log, readers (`lobster status`, plotting) do
+        # not block the master, and commits only sync at checkpoints.
+        self.db.execute("pragma journal_mode=wal")
+        self.db.execute("pragma synchronous=normal")
 
         self.db.execute("""create table if not exists workflows(
             cfg text,
@@ -100,6 +396,16 @@ class UnitStore:
             units_available int default 0,
             units_stuck int default 0,
             units_running int default 0,
+            units_registered int default 0,
+            units_stuck_own int default 0,
+            units_failed int default 0,
+            units_skipped int default 0,
+            units_merged int default 0,
+            units_unmerged int default 0,
+            events_read int default 0,
+            events_written int default 0,
+            tasks_archived int default 0,
+            unittime_archived real default 0,
             taskruntime int default null,
             tasksize int,
             label text,
@@ -110,7 +416,6 @@ class UnitStore:
             publish_label text,
             release text,
             uuid text,
-            transfers text default '{}',
             stop_on_file_boundary)""")
         self.db.execute("""create table if not exists tasks(
             bytes_bare_output int default 0 not null,
@@ -166,94 +471,271 @@ class UnitStore:
             workdir_num_files int default 0 not null,
             foreign key(workflow) references workflows(id))""")
 
+        # Transfer outcomes per protocol, in buckets of `TRANSFER_BUCKET`
+        # seconds, to follow transfers over time.
+        self.db.execute("""create table if not exists transfers(
+            workflow int not null,
+            protocol text not null,
+            outcome text not null,
+            bucket int not null,
+            count int default 0 not null,
+            primary key(workflow, protocol, outcome, bucket),
+            foreign key(workflow) references workflows(id))""")
+
+        # Finished tasks are moved here by `archive_tasks`, see there.
+        self.db.execute("create table if not exists tasks_archive as select * from tasks where 0")
+        self.db.execute("create index if not exists index_ta_task on tasks_archive(task)")
+
         self.db.execute("create index if not exists index_w_label on workflows(label)")
         self.db.execute("create index if not exists index_t_workflow on tasks(workflow, status)")
         self.db.execute("create index if not exists index_t_workflowplus on tasks(workflow, status, type)")
+        self.db.execute("create index if not exists index_t_task on tasks(task)")
+
+        self.__upgrade()
+
+        # Drop the cached scheduling state, see `__workflows`, whenever
+        # workflows are changed through this connection.
+        self.db.create_function('workflows_changed', 0, self.__workflows_changed)
+        for op in ('insert', 'update', 'delete'):
+            self.db.execute("""
+                create temp trigger workflows_{0} after {0} on main.workflows
+                begin select workflows_changed(); end""".format(op))
 
-        self.db.commit()
+        self.db.load(self.stats_path)
+
+    def __upgrade(self):
+        """Upgrade a database created by an earlier version.
+
+        Adds missing columns, and recounts the workflow statistics once
+        to fill them.  Only done by writable stores: read-only ones refuse
+        to open outdated databases.
+        """
+        outdated = self.__outdated()
+        if not outdated:
+            return
+        missing, unranged = outdated
+        labels = [label for (label,) in self.db.execute("select label from workflows")]
+
+        logger.info("upgrading database {0}".format(self.db_path))
+        with self.transaction():
+            for name, kind in missing:
+                self.db.execute("alter table workflows add column {0} {1}".format(name, kind))
+            self.db.execute("create table if not exists tasks_archive as select * from tasks where 0")
+            self.db.execute("create index if not exists index_ta_task on tasks_archive(task)")
+            for label in unranged:
+                self.db.execute("alter table units_{0} add column lumis integer default 1".format(label))
+            for label in labels:
+                self.recount_workflow_stats(label, check=False)
+
+    def __outdated(self):
+        """Return the missing workflow columns and the labels of unit
+        tables without ranges, if the database needs an upgrade.
+        """
+        def columns(table):
+            return set(row[1] for row in self.db.execute("pragma table_info({0})".format(table)))
+
+        existing = columns('workflows')
+        if len(existing) == 0:
+            return None
+        missing = [(name, kind) for (name, kind) in WORKFLOW_COLUMNS if name not in existing]
+        # units without ranges of luminosity sections, see `lumi_ranges`
+        unranged = []
+        for (label,) in self.db.execute("select label from workflows").fetchall():
+            units = columns('units_' + label)
+            if len(units) > 0 and 'lumis' not in units:
+                unranged.append(label)
+        if len(missing) == 0 and len(unranged) == 0:
+            return None
+        return missing, unranged
 
     def disconnect(self):
+        if not self.readonly:
+            self.db.save(self.stats_path)
         self.db.close()
 
+    @contextmanager
+    def transaction(self):
+        """Group database writes.
+
+        The outermost context opens a transaction and commits it on exit.
+        Nested contexts use savepoints, which are rolled back individually
+        on errors, while the commit is deferred to the outermost context.
+        This allows the master to group all writes of one iteration into a
+        single commit.
+        """
+        if self.__depth == 0:
+            self.db.execute("begin immediate")
+        else:
+            self.db.execute("savepoint level{0}".format(self.__depth))
+        self.__depth += 1
+        try:
+            yield self.db
+        except Exception:
+            self.__depth -= 1
+            self.__rollback(self.__depth)
+            raise
+        else:
+            level = self.__depth - 1
+            try:
+                if level == 0:
+                    self.db.execute("commit")
+                else:
+                    self.db.execute("release level{0}".format(level))
+            except Exception:
+                # e.g., the database is busy: do not leave the transaction
+                # open, or the next one could not be started
+                self.__rollback(level)
+                raise
+            finally:
+                self.__depth = level
+            if level == 0 and time.time() - self.__stats_saved > 60:
+                self.db.save(self.stats_path)
+                self.__stats_saved = time.time()
+
+    def __rollback(self, level):
+        if level == 0:
+            self.db.execute("rollback")
+        else:
+            self.db.execute("rollback to level{0}".format(level))
+            self.db.execute("release level{0}".format(level))
+        # the cached state may contain changes that have been undone
+        self.__state = None
+
+    @contextmanager
+    def snapshot(self):
+        """Read from a consistent state of the database.
+
+        All queries within the context see the database as it was at the
+        first query, regardless of concurrent commits by the master.  With
+        the write-ahead log, the master is not blocked in the meantime.
+        """
+        if self.__depth > 0:
+            yield self.db
+            return
+
+        self.db.execute("begin")
+        self.__depth += 1
+        try:
+            yield self.db
+        finally:
+            self.__depth -= 1
+            self.db.execute("commit")
+
+    def __workflows(self):
+        """Return the scheduling state of all workflows, by label.
+
+        The master is the only process writing to the database, and keeps
+        the state in memory.  It is only read again once workflows have
+        been modified through this connection, or a transaction has been
+        rolled back.  Readonly stores always read the current state.
+        """
+        if self.readonly or self.__state is None:
+            self.__state = dict((row[1], WorkflowState(*row)) for row in self.db.execute("""
+                select
+                    id,
+                    label,
+                    tasksize,
+                    stop_on_file_boundary,
+                    merged,
+                    units_available,
+                    units_left,
+                    units_running,
+                    units - units_done - units_stuck - units_masked
+                from workflows"""))
+        return self.__state
+
+    def __workflows_changed(self):
+        self.__state = None
+
     def max_taskid(self):
+        # Archived tasks are not in `tasks` any longer, but ids are never
+        # reused due to `autoincrement`.
         maxid = self.db.execute(
-            'select ifnull(max(id), 0) from tasks').fetchone()[0]
+            "select ifnull(max(seq), 0) from sqlite_sequence where name='tasks'").fetchone()[0]
         return maxid
 
     def register_dataset(self, wflow, dataset_info, taskruntime=None):
         label = wflow.label
         unique_args = wflow.unique_arguments
 
-        cur = self.db.cursor()
-        cur.execute("""insert into workflows
-                       (dataset,
-                       label,
-                       path,
-                       release,
-                       global_tag,
-                       publish_label,
-                       cfg,
-                       uuid,
-                       file_based,
-                       tasksize,
-                       taskruntime,
-                       units,
-                       units_masked,
-                       units_left,
-                       events,
-                       stop_on_file_boundary
-                       )
-                       values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
-            wflow.label,
-            label,
-            wflow.label,
-            os.path.basename(os.environ.get('LOCALRT', '')),
-            wflow.globaltag,
-            wflow.publish_label,
-            wflow.pset,
-            self.uuid,
-            dataset_info.file_based,
-            dataset_info.tasksize,
-            taskruntime,
-            dataset_info.total_units * len(unique_args),
-            dataset_info.masked_units,
-            dataset_info.total_units * len(unique_args),
-            dataset_info.total_events,
-            getattr(dataset_info, 'stop_on_file_boundary', False)))
-
-        self.db.execute("""create table if not exists files_{0}(
-            id integer primary key autoincrement,
-            filename text,
-            skipped int default 0,
-            units int,
-            units_done int default 0,
-            units_running int default 0,
-            events int,
-            events_read int default 0,
-            bytes int default 0)""".format(label))
-
-        cur.execute("""create table if not exists units_{0}(
-            id integer primary key autoincrement,
-            task integer,
-            run integer,
-            lumi integer,
-            file integer,
-            status integer default 0,
-            failed integer default 0,
-            arg text,
-            foreign key(task) references tasks(id),
-            foreign key(file) references files_{0}(id))""".format(label))
-
-        self.db.execute("create index if not exists index_f_filename_{0} on files_{0}(filename)".format(label))
-        self.db.execute("create index if not exists index_u_events_{0} on units_{0}(run, lumi)".format(label))
-        self.db.execute("create index if not exists index_u_files_{0} on units_{0}(file, status)".format(label))
-        self.db.execute("create index if not exists index_u_task_{0} on units_{0}(task)".format(label))
-        self.db.commit()
-
-        self.register_files(dataset_info.files, label, unique_args)
+        with self.transaction():
+            self.db.execute("""insert into workflows
+                           (dataset,
+                           label,
+                           path,
+                           release,
+                           global_tag,
+                           publish_label,
+                           cfg,
+                           uuid,
+                           file_based,
+                           tasksize,
+                           taskruntime,
+                           units,
+                           units_masked,
+                           units_left,
+                           events,
+                           stop_on_file_boundary
+                           )
+                           values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", (
+                wflow.label,
+                label,
+                wflow.label,
+                os.path.basename(os.environ.get('LOCALRT', '')),
+                wflow.globaltag,
+                wflow.publish_label,
+                wflow.pset,
+                self.uuid,
+                dataset_info.file_based,
+                dataset_info.tasksize,
+                taskruntime,
+                dataset_info.total_units * len(unique_args),
+                dataset_info.masked_units,
+                dataset_info.total_units * len(unique_args),
+                dataset_info.total_events,
+                getattr(dataset_info, 'stop_on_file_boundary', False)))
+
+            self.db.execute("""create table if not exists files_{0}(
+                id integer primary key autoincrement,
+                filename text,
+                skipped int default 0,
+                units int,
+                units_done int default 0,
+                units_running int default 0,
+                events int,
+                events_read int default 0,
+                bytes int default 0)""".format(label))
+
+            self.db.execute("""create table if not exists units_{0}(
+                id integer primary key autoincrement,
+                task integer,
+                run integer,
+                lumi integer,
+                lumis integer default 1,
+                file integer,
+                status integer default 0,
+                failed integer default 0,
+                arg text,
+                foreign key(task) references tasks(id),
+                foreign key(file) references files_{0}(id))""".format(label))
+
+            self.db.execute("create index if not exists index_f_filename_{0} on files_{0}(filename)".format(label))
+            self.db.execute("create index if not exists index_u_events_{0} on units_{0}(run, lumi)".format(label))
+            self.db.execute("create index if not exists index_u_files_{0} on units_{0}(file, status)".format(label))
+            self.db.execute("create index if not exists index_u_task_{0} on units_{0}(task)".format(label))
+            # Partial indices covering only files and units that can still
+            # be processed, used to create tasks
+            self.db.execute("""create index if not exists index_f_available_{0}
+                on files_{0}(skipped, id)
+                where units > units_done + units_running""".format(label))
+            self.db.execute("""create index if not exists index_u_available_{0}
+                on units_{0}(file, id)
+                where status in (0, 3, 4)""".format(label))
+
+            self.register_files(dataset_info.files, label, unique_args)
 
     def register_dependency(self, label, parent, total_units):
-        with self.db as db:
+        with self.transaction() as db:
             db.execute("""
                         update workflows
                         set
@@ -263,30 +745,84 @@ class UnitStore:
                        )
 
     def register_files(self, infos, label, unique_args=None):
-        with self.db as db:
-            cur = db.cursor()
+        """Register files and their units with a workflow.
+
+        Files and units are inserted in batches of bounded size, with file
+        ids assigned upfront, so that the memory used stays flat when
+        registering large datasets.
 
+        Parameters
+        ----------
+            infos : dict or iterable
+                A dictionary mapping filenames to
+                :class:`~lobster.core.dataset.FileInfo`, or an iterable of
+                `(filename, info)` tuples, which is consumed lazily.  The
+                `lumis` of each info have to support `len` and repeated
+                iteration, but need not be lists.
+            label : str
+                The workflow to register the files with.
+            unique_args : list
+                The arguments to create a unit for each luminosity section
+                with.
+        """
+        batchsize = 10000
+
+        with self.transaction() as db:
             if unique_args is None:
                 unique_args = [None]
 
-            update = []
-            # Sort for reproducable unit tests.
-            if len(infos) < 25:
-                items = [(fn, infos[fn]) for fn in sorted(infos.keys())]
+            if isinstance(infos, dict):
+                # Sort for reproducable unit tests.
+                if len(infos) < 25:
+                    items = [(fn, infos[fn]) for fn in sorted(infos.keys())]
+                else:
+                    items = infos.iteritems()
             else:
-                items = infos.items()
+                items = infos
+
+            # ranges are split when assigned to tasks, but not when only
+            # some of their sections are processed successfully: only use
+            # them for file based workflows, which succeed or fail as a whole
+            (file_based,) = db.execute("select file_based from workflows where label=?", (label,)).fetchone()
+            ranges = self.config.advanced.unit_ranges and file_based
+
+            files = []
+            units = []
+            registered = 0
+
+            def flush():
+                db.executemany("""
+                    insert into files_{0}(id, units, events, filename, bytes)
+                    values (?, ?, ?, ?, ?)""".format(label), files)
+                db.executemany("""
+                    insert into units_{0}(file, run, lumi, lumis, arg)
+                    values (?, ?, ?, ?, ?)""".format(label), units)
+                del files[:]
+                del units[:]
+
+            (fid,) = db.execute("select ifnull(max(id), 0) from files_{0}".format(label)).fetchone()
             for fn, info in items:
-                cur.execute(
-                    """insert into files_{0}(units, events, filename, bytes) values (?, ?, ?, ?)""".format(
-                        label),
-                    (len(info.lumis) * len(unique_args), info.events, fn, info.size))
-                fid = cur.lastrowid
+                fid += 1
+                count = len(info.lumis) * len(unique_args)
+                files.append((fid, count, info.events, fn, info.size))
+                registered += count
 
                 for arg in unique_args:
-                    update += [(fid, run, lumi, arg)
-                               for (run, lumi) in info.lumis]
-            self.db.executemany(
-                "insert into units_{0}(file, run, lumi, arg) values (?, ?, ?, ?)".format(label), update)
+                    if ranges:
+                        lumis = lumi_ranges(info.lumis)
+                    else:
+                        lumis = ((run, lumi, 1) for (run, lumi) in info.lumis)
+                    for (run, lumi, n) in lumis:
+                        units.append((fid, run, lumi, n, arg))
+                        if len(units) >= batchsize:
+                            flush()
+                if len(files) >= batchsize:
+                    flush()
+            flush()
+
+            self.db.execute(
+                "update workflows set units_registered=(units_registered + ?) where label=?",
+                (registered, label))
             self.update_workflow_stats(label)
 
     def work_left(self, label):
@@ -309,12 +845,10 @@ class UnitStore:
                 How many tasks need to be created to process all units
                 currently available.
         """
-        complete, units_left, tasks_left = self.db.execute(
-            "select (units_left = units_available), units_left, units_available * 1. / tasksize from workflows where label=?",
-            (label,)).fetchone()
-        return complete, units_left, tasks_left
+        state = self.__workflows()[label]
+        complete = state.units_left == state.units_available
+        return complete, state.units_left, state.units_available * 1. / state.tasksize
 
-    @retry(stop_max_attempt_number=10)
     def pop_units(self, workflow, num, taper=1.):
         """Create tasks from a workflow.
 
@@ -327,10 +861,10 @@ class UnitStore:
             taper : int
                 Factor to apply to the tasksize.
         """
-        with self.db:
-            workflow_id, tasksize, stop_on_file_boundary = self.db.execute(
-                "select id, tasksize, stop_on_file_boundary from workflows where label=?",
-                (workflow,)).fetchone()
+        with self.transaction():
+            state = self.__workflows()[workflow]
+            workflow_id, tasksize, stop_on_file_boundary = \
+                state.id, state.tasksize, state.stop_on_file_boundary
 
             logger.debug(("creating {0} task(s) for workflow {1}:" +
                           "\n\ttaper:    {4}" +
@@ -346,30 +880,54 @@ class UnitStore:
             )
             )
 
-            fileinfo = list(self.db.execute("""select id, filename
-                        from files_{0}
-                        where
-                            (units_done + units_running < units) and
-                            (skipped < ?)
-                        order by skipped asc""".format(workflow), (self.config.advanced.threshold_for_skipping,)))
-            files = [x for (x, y) in fileinfo]
-            fileinfo = dict(fileinfo)
-
             tasksize = int(math.ceil(tasksize * taper))
 
             logger.debug("creating tasks with adjusted size {}".format(tasksize))
 
-            rows = []
-            for i in range(0, len(files), 40):
-                chunk = files[i:i + 40]
-                rows.extend(self.db.execute("""
-                    select id, file, run, lumi, arg, failed
-                    from units_{0}
-                    where file in ({1}) and status not in (1, 2, 6, 7, 8)
-                    order by file
-                    """.format(workflow, ', '.join('?' for _ in chunk)), chunk))
-
-            logger.debug("creating tasks from {} files, {} units".format(len(files), len(rows)))
+            fileinfo = {}
+
+            def available():
+                """Yield records of units available for processing.
+
+                Files are picked in chunks of 40, preferring files that have
+                been skipped less, and units are ordered by file within a
+                chunk.  Rows are read lazily, so that only the units needed
+                for the tasks to be created are touched.  Both queries are
+                served by partial indices, see `register_dataset`.
+                """
+                files = self.db.execute("""
+                    select id, filename
+                    from files_{0}
+                    where units > units_done + units_running and skipped < ?
+                    order by skipped, id""".format(workflow), (self.config.advanced.threshold_for_skipping,))
+                while True:
+                    chunk = files.fetchmany(40)
+                    if len(chunk) == 0:
+                        break
+                    fileinfo.update(chunk)
+                    for (file, filename) in sorted(chunk):
+                        # fetch all rows of the file first, since splitting
+                        # ranges adds rows to the table
+                        rows = self.db.execute("""
+                                select id, file, run, lumi, lumis, arg, failed
+                                from units_{0}
+                                where file=? and status in (0, 3, 4) and failed <= ?
+                                order by id""".format(workflow), (file, self.config.advanced.threshold_for_failure)).fetchall()
+                        for row in rows:
+                            yield row
+
+            def take(record, count):
+                """Assign the first `count` sections of a record, and split
+                the remaining ones off into a new record, which is returned.
+                """
+                (id, file, run, lumi, lumis, arg, failed) = record
+                if count >= lumis:
+                    return None
+                self.db.execute("update units_{0} set lumis=? where id=?".format(workflow), (count, id))
+                next_id = self.db.execute("""
+                    insert into units_{0}(file, run, lumi, lumis, arg, failed)
+                    values (?, ?, ?, ?, ?, ?)""".format(workflow), (file, run, lumi + count, lumis - count, arg, failed)).lastrowid
+                return (next_id, file, run, lumi + count, lumis - count, arg, failed)
 
             # files and lumis for individual tasks
             files = set()
@@ -380,8 +938,7 @@ class UnitStore:
             current_size = 0
 
             def insert_task(files, units, arg):
-                cur = self.db.cursor()
-                cur.execute("insert into tasks(workflow, status, type) values (?, 1, 0)", (workflow_id,))
+                cur = self.db.execute("insert into tasks(workflow, status, type) values (?, 1, 0)", (workflow_id,))
                 task_id = cur.lastrowid
 
                 tasks.append((
@@ -392,49 +949,55 @@ class UnitStore:
                     arg,
                     False))
 
-            for id, file, run, lumi, arg, failed in rows:
-                if failed > self.config.advanced.threshold_for_failure:
-                    logger.debug("skipping run {}, "
-                                 "lumi {} "
-                                 "with failure count {} "
-                                 "exceeding `config.advanced.threshold_for_failure={}`".format(
-                                     run, lumi, failed, self.config.advanced.threshold_for_failure))
-                    continue
-
-                if failed == self.config.advanced.threshold_for_failure:
-                    logger.debug("creating isolation task for run {}, lumi {} with failure count {}".format(
-                        run, lumi, failed))
-                    insert_task([file], [(id, file, run, lumi)], arg)
-                    continue
-
-                if stop_on_file_boundary and (len(files) == 1) and (file not in files):
-                    insert_task(files, units, arg)
-
-                    files = set()
-                    units = []
-
-                    current_size = 0
-                    num -= 1
-
-                # We are done creating tasks here, *if* we are about to
-                # add the current unit to a new task, but have already
-                # created enough tasks.
-                if current_size == 0 and num <= 0:
-                    break
+            # Records covering a range of luminosity sections are split at
+            # most once per task: the task is assigned a contiguous slice of
+            # the range, and the remaining sections stay in one record.
+            full = False
+            for record in available():
+                while record:
+                    (id, file, run, lumi, lumis, arg, failed) = record
+
+                    if failed == self.config.advanced.threshold_for_failure:
+                        logger.debug("creating isolation task for run {}, lumi {} with failure count {}".format(
+                            run, lumi, failed))
+                        record = take(record, 1)
+                        insert_task([file], [(id, file, run, lumi)], arg)
+                        continue
+
+                    if stop_on_file_boundary and (len(files) == 1) and (file not in files):
+                        insert_task(files, units, arg)
+
+                        files = set()
+                        units = []
+
+                        current_size = 0
+                        num -= 1
+
+                    # We are done creating tasks here, *if* we are about to
+                    # add the current unit to a new task, but have already
+                    # created enough tasks.
+                    if current_size == 0 and num <= 0:
+                        full = True
+                        break
+
+                    count = min(lumis, tasksize - current_size)
+                    record = take(record, count)
 
-                units.append((id, file, run, lumi))
-                files.add(file)
+                    units += [(id, file, run, lumi + n) for n in range(count)]
+                    files.add(file)
 
-                current_size += 1
+                    current_size += count
 
-                if current_size == tasksize:
-                    insert_task(files, units, arg)
+                    if current_size == tasksize:
+                        insert_task(files, units, arg)
 
-                    files = set()
-                    units = []
+                        files = set()
+                        units = []
 
-                    current_size = 0
-                    num -= 1
+                        current_size = 0
+                        num -= 1
+                if full:
+                    break
 
             if current_size > 0:
                 insert_task(files, units, arg)
@@ -447,10 +1010,10 @@ class UnitStore:
             for (task, label, files, units, arg, merge) in tasks:
                 workflow_update += units
                 task_update[task] = len(units)
-                unit_update += [(task, id) for (id, file, run, lumi) in units]
-                for (id, filename) in files:
-                    file_update[
-                        id] += len(filter(lambda tpl: tpl[1] == id, units))
+                # sections of one record share its id
+                unit_update += [(task, id) for id in sorted(set(id for (id, file, run, lumi) in units))]
+                for (id, file, run, lumi) in units:
+                    file_update[file] += 1
 
             self.db.execute(
                 "update workflows set units_running=(units_running + ?) where id=?",
@@ -466,7 +1029,7 @@ class UnitStore:
             return tasks if len(unit_update) > 0 else []
 
     def reset_units(self):
-        with self.db as db:
+        with self.transaction() as db:
             ids = [id for (id,) in db.execute(
                 "select id from tasks where status=1")]
             db.execute("update workflows set units_running=0, merged=0")
@@ -479,14 +1042,124 @@ class UnitStore:
                     "update units_{0} set status=4 where status=1".format(label))
                 db.execute(
                     "update units_{0} set status=2 where status=7".format(label))
-                self.update_workflow_stats(label)
+                self.recount_workflow_stats(label)
         return ids
 
-    @retry(stop_max_attempt_number=10)
+    def __tally_units(self, label, tasks):
+        """Count the running, done, stuck, failed, and skipped units of
+        `tasks`, by file.
+        """
+        tally = defaultdict(lambda: [0, 0, 0, 0, 0])
+        thresholds = [self.config.advanced.threshold_for_failure,
+                      self.config.advanced.threshold_for_skipping]
+        for i in range(0, len(tasks), 990):
+            chunk = list(tasks[i:i + 990])
+            cur = self.db.execute("""
+                select
+                    file,
+                    sum(lumis * (status == 1)),
+                    sum(lumis * (status in (2, 6, 7, 8))),
+                    sum(lumis * (status in (0, 3, 4) and (failed > ? or skipped >= ?))),
+                    sum(lumis * (status in (0, 3, 4) and failed > ?)),
+                    sum(lumis * (status in (0, 3, 4) and skipped >= ?))
+                from (
+                    select
+                        file, lumis, status, failed,
+                        (select skipped from files_{0} where id == units_{0}.file) as skipped
+                    from units_{0}
+                    where task in ({1})
+                )
+                group by file""".format(label, ', '.join('?' for _ in chunk)), thresholds * 2 + chunk)
+            for row in cur:
+                for n, count in enumerate(row[1:]):
+                    tally[row[0]][n] += count
+        return tally
+
+    def __apply_tally(self, label, before, after, stuck=0, skipped=0):
+        """Update file and workflow unit counters with the difference
+        between two tallies, as returned by `__tally_units`.
+
+        Parameters
+        ----------
+            label : str
+                The workflow to update.
+            before : dict
+                The tally before units changed their status.
+            after : dict
+                The tally after units changed their status.
+            stuck : int
+                Additional units that became stuck, i.e., units of files
+                that exceeded the skipping threshold.
+            skipped : int
+                Additional units of files that exceeded the skipping
+                threshold, including ones that failed too often.
+        """
+        totals = [0, 0, stuck, 0, skipped]
+        file_update = []
+        for file in set(before.keys()) | set(after.keys()):
+            delta = [a - b for (a, b) in zip(after.get(file, [0] * 5), before.get(file, [0] * 5))]
+            totals = [t + d for (t, d) in zip(totals, delta)]
+            file_update.append((delta[0], delta[1], file))
+
+        self.db.executemany("""update files_{0} set
+            units_running=(units_running + ?),
+            units_done=(units_done + ?)
+            where id=?""".format(label), file_update)
+        self.db.execute("""update workflows set
+            units_running=(units_running + ?),
+            units_done=(units_done + ?),
+            units_stuck_own=(units_stuck_own + ?),
+            units_failed=(units_failed + ?),
+            units_skipped=(units_skipped + ?)
+            where label=?""", tuple(totals) + (label,))
+
+    def __tally_tasks(self, tasks):
+        """Sum up the events read and written, and the units processed by
+        merged and unmerged tasks, by workflow.
+
+        Covers the processing tasks in `tasks`, as well as the ones merged
+        by the merge tasks in `tasks`.
+        """
+        tally = defaultdict(lambda: [0, 0, 0, 0])
+        for i in range(0, len(tasks), 490):
+            chunk = list(tasks[i:i + 490])
+            cur = self.db.execute("""
+                select
+                    workflow,
+                    sum(events_read * (status in (2, 6, 7, 8))),
+                    sum(events_written * (status in (2, 6, 7, 8))),
+                    sum(units_processed * (status == 8)),
+                    sum(units_processed * (status == 2))
+                from tasks
+                where type == 0 and (id in ({0}) or task in ({0}))
+                group by workflow""".format(', '.join('?' for _ in chunk)), chunk * 2)
+            for row in cur:
+                for n, count in enumerate(row[1:]):
+                    tally[row[0]][n] += count
+        return tally
+
+    def __apply_task_tally(self, before, after):
+        """Update the workflow task summaries with the difference between
+        two tallies, as returned by `__tally_tasks`.
+        """
+        update = []
+        for workflow in set(before.keys()) | set(after.keys()):
+            delta = [a - b for (a, b) in zip(after.get(workflow, [0] * 4), before.get(workflow, [0] * 4))]
+            update.append(tuple(delta) + (workflow,))
+        self.db.executemany("""update workflows set
+            events_read=(events_read + ?),
+            events_written=(events_written + ?),
+            units_merged=(units_merged + ?),
+            units_unmerged=(units_unmerged + ?)
+            where id=?""", update)
+
     def update_units(self, taskinfos):
         task_updates = []
 
-        with self.db:
+        with self.transaction():
+            tasks = [task_update.id for updates in taskinfos.values() for (task_update, _, _) in updates]
+            tasks_before = self.__tally_tasks(tasks)
+
             for ((dset, unit_source), updates) in taskinfos.items():
                 file_updates = []
                 unit_updates = []
@@ -510,6 +1183,35 @@ class UnitStore:
                     unit_updates += unit_update
                     unit_generic_updates.append((unit_status, task_update.id))
 
+                # merge tasks only change the status of other tasks, and
+                # leave the unit counters untouched
+                count = unit_source != 'tasks'
+
+                if count:
+                    ids = [id for (_, id) in unit_generic_updates]
+                    before = self.__tally_units(dset, ids)
+
+                    # units of files that are skipped for the first time
+                    # become stuck, unless they are being processed
+                    skips = defaultdict(int)
+                    for (_, skipped, id) in file_updates:
+                        skips[id] += skipped
+                    stuck = 0
+                    skipped_units = 0
+                    threshold = self.config.advanced.threshold_for_skipping
+                    for id, skipped in skips.items():
+                        if skipped == 0:
+                            continue
+                        (previous,) = self.db.execute(
+                            "select skipped from files_{0} where id=?".format(dset), (id,)).fetchone()
+                        if previous < threshold <= previous + skipped:
+                            (new_stuck, new_skipped) = self.db.execute("""
+                                select ifnull(sum(lumis * (failed <= ?)), 0), ifnull(sum(lumis), 0)
+                                from units_{0}
+                                where file=? and status in (0, 3, 4)""".format(dset), (self.config.advanced.threshold_for_failure, id)).fetchone()
+                            stuck += new_stuck
+                            skipped_units += new_skipped
+
                 # update all units of the tasks
                 self.db.executemany("""update {0} set
                     status=?
@@ -532,17 +1234,20 @@ class UnitStore:
                 # update files in the workflow
                 if len(file_updates) > 0:
                     self.db.executemany("""update files_{0} set
-                        units_running=(select count(*) from units_{0} where file=files_{0}.id and status==1),
-                        units_done=(select count(*) from units_{0} where file=files_{0}.id and status==2),
                         events_read=(events_read + ?),
                         skipped=(skipped + ?)
                         where id=?""".format(dset),
                                         file_updates)
 
+                if count:
+                    self.__apply_tally(dset, before, self.__tally_units(dset, ids), stuck, skipped_units)
+
             query = "update tasks set {0} where id=?".format(
                 TaskUpdate.sql_fragment(stop=-1))
             self.db.executemany(query, task_updates)
 
+            self.__apply_task_tally(tasks_before, self.__tally_tasks(tasks))
+
             for label, _ in taskinfos.keys():
                 self.update_workflow_stats(label)
 
@@ -555,10 +1260,10 @@ class UnitStore:
         """
         if roots is None:
             roots = [w for w in self.config.workflows if not w.parent]
-        with self.db:
+        with self.transaction():
             for m in sum([list(r.family()) for r in roots], []):
                 self.db.execute("update workflows set merged=0 where label=?", (m.label,))
-                self.update_workflow_stats(m.label)
+                self.recount_workflow_stats(m.label)
 
     def update_workflow_runtime(self, updates):
         """Update workflow runtimes in the database.
@@ -566,7 +1271,7 @@ class UnitStore:
         To synchronize runtimes present in the configuration with the ones
         in the database used for task size calculations.
         """
-        with self.db:
+        with self.transaction():
             self.db.executemany(
                 "update workflows set taskruntime=? where label=?", updates)
 
@@ -577,14 +1282,20 @@ class UnitStore:
         if targettime is not None:
             # Adjust tasksize based on time spend in prologue, processing, and
             # epilogue.  Only do so when difference is > 10%
+            # Archived tasks contribute with their rollup, see
+            # `archive_tasks`.
             tasks, unittime = self.db.execute("""
                 select
-                    count(*),
-                    max(
-                        avg((time_epilogue_end - time_stage_in_end) * 1. / units),
-                        1
-                    )
-                from tasks where workflow=? and status in (2, 6, 7, 8) and type=0""", (id,)).fetchone()
+                    tasks_archived + live.tasks,
+                    max((unittime_archived + live.unittime) / (tasks_archived + live.tasks), 1)
+                from workflows, (
+                    select
+                        count(*) as tasks,
+                        ifnull(sum((time_epilogue_end - time_stage_in_end) * 1. / units), 0) as unittime
+                    from tasks
+                    where workflow=? and status in (2, 6, 7, 8) and type=0 and units > 0
+                ) as live
+                where id=?""", (id, id)).fetchone()
 
             if tasks > 10:
                 bettersize = max(1, int(math.ceil(targettime / unittime)))
@@ -608,27 +1319,14 @@ class UnitStore:
             from workflows as wf where id == ?
             """, (id,)).fetchone()[0]
 
+        # Unit counters are maintained incrementally, see `__apply_tally`
+        # and `recount_workflow_stats`.
         self.db.execute("""
             update workflows set
-                units_stuck=ifnull((
-                        select count(*)
-                        from units_{0}
-                        where
-                            (failed > ? and status in (0, 3, 4)) or
-                            (file in (select id from files_{0} where skipped >= ?) and status in (0, 3, 4))
-                    ), 0) + ?,
-                units_running=ifnull((select count(*) from units_{0} where status == 1), 0),
-                units_done=ifnull((select count(*) from units_{0} where status in (2, 6, 7, 8)), 0)
-            where label=?""".format(label), (self.config.advanced.threshold_for_failure,
-                                             self.config.advanced.threshold_for_skipping,
-                                             parent_stuck,
-                                             label))
-
-        self.db.execute("""
-            update workflows set
-                units_available=ifnull((select count(*) from units_{0}), 0) - (units_running + units_done + (units_stuck - ?)),
-                units_left=units - (units_masked + units_running + units_done + units_stuck)
-            where label=?""".format(label), (parent_stuck, label))
+                units_stuck=units_stuck_own + ?,
+                units_available=units_registered - (units_running + units_done + units_stuck_own),
+                units_left=units - (units_masked + units_running + units_done + units_stuck_own + ?)
+            where id=?""", (parent_stuck, parent_stuck, id))
 
         if self.db.execute("select units_stuck from workflows where label=?", (label,)).fetchone()[0] > 0:
             for (child,) in self.db.execute("select label from workflows where parent=?", (id,)):
@@ -656,32 +1354,101 @@ class UnitStore:
                           "units left:                {7}").format(
                               label, size, total, running, done, parent_stuck, available, left))
 
-    def merged(self):
-        unmerged = self.db.execute(
-            "select count(*) from workflows where merged <> 1").fetchone()[0]
-        return unmerged == 0
+    def recount_workflow_stats(self, label, check=True):
+        """Recount the unit statistics of a workflow from scratch.
 
-    def estimate_tasks_left(self):
-        rows = [ts for (ts,) in self.db.execute("""
-            select (units_available - units_running) * 1. / tasksize
+        Unit counters are otherwise updated incrementally.  This serves as
+        a consistency check, and to apply changed thresholds for failures
+        and skipping.
+
+        Parameters
+        ----------
+            label : str
+                The workflow to recount.
+            check : bool
+                Warn if the stored counters differ from the recount.
+        """
+        counts = self.db.execute("""
+            select
+                ifnull(sum(lumis), 0),
+                ifnull(sum(lumis * (status == 1)), 0),
+                ifnull(sum(lumis * (status in (2, 6, 7, 8))), 0),
+                ifnull(sum(lumis * (status in (0, 3, 4) and (failed > ? or skipped))), 0),
+                ifnull(sum(lumis * (status in (0, 3, 4) and failed > ?)), 0),
+                ifnull(sum(lumis * (status in (0, 3, 4) and skipped)), 0)
+            from (
+                select
+                    lumis, status, failed,
+                    file in (select id from files_{0} where skipped >= ?) as skipped
+                from units_{0}
+            )""".format(label), (self.config.advanced.threshold_for_failure,
+                                 self.config.advanced.threshold_for_failure,
+                                 self.config.advanced.threshold_for_skipping)).fetchone()
+        counts += self.db.execute("""
+            select
+                ifnull(sum(events_read * (status in (2, 6, 7, 8))), 0),
+                ifnull(sum(events_written * (status in (2, 6, 7, 8))), 0),
+                ifnull(sum(units_processed * (status == 8)), 0),
+                ifnull(sum(units_processed * (status == 2)), 0)
+            from (
+                select type, workflow, status, events_read, events_written, units_processed
+                from tasks
+                union all
+                select type, workflow, status, events_read, events_written, units_processed
+                from tasks_archive
+            )
+            where type == 0 and workflow == (select id from workflows where label=?)""", (label,)).fetchone()
+        stored = self.db.execute("""
+            select units_registered, units_running, units_done, units_stuck_own
             from workflows
-            where units_left > 0""")]
-        if len(rows) == 0:
-            return 0
+            where label=?""", (label,)).fetchone()
+
+        if check and counts[:3] != stored[:3]:
+            logger.warning(("inconsistent unit counters for {0}:\n\t" +
+                            "registered: {1} (counted {2})\n\t" +
+                            "running:    {3} (counted {4})\n\t" +
+                            "done:       {5} (counted {6})").format(
+                                label, stored[0], counts[0], stored[1], counts[1], stored[2], counts[2]))
+
+        self.db.execute("""
+            update workflows set
+                units_registered=?,
+                units_running=?,
+                units_done=?,
+                units_stuck_own=?,
+                units_failed=?,
+                units_skipped=?,
+                events_read=?,
+                events_written=?,
+                units_merged=?,
+                units_unmerged=?
+            where label=?""", tuple(counts) + (label,))
+        self.db.execute("""
+            update files_{0} set
+                units_running=(select ifnull(sum(lumis), 0) from units_{0} where file=files_{0}.id and status==1),
+                units_done=(select ifnull(sum(lumis), 0) from units_{0} where file=files_{0}.id and status in (2, 6, 7, 8))
+            """.format(label))
+
+        self.update_workflow_stats(label)
+
+    def merged(self):
+        return all(state.merged == 1 for state in self.__workflows().values())
 
-        return sum(int(math.ceil(ntasks)) for ntasks in rows)
+    def estimate_tasks_left(self):
+        return sum(
+            int(math.ceil((state.units_available - state.units_running) * 1. / state.tasksize))
+            for state in self.__workflows().values() if state.units_left > 0
+        )
 
     def unfinished_units(self, label=None):
         if label:
-            cur = self.db.execute("select units - units_done - units_stuck - units_masked from workflows where label=?", (label,))
+            states = [self.__workflows()[label]]
         else:
-            cur = self.db.execute("select sum(units - units_done - units_stuck - units_masked) from workflows")
-        res = cur.fetchone()[0]
-        return 0 if res is None else res
+            states = self.__workflows().values()
+        return sum(state.units_unfinished for state in states if state.units_unfinished is not None)
 
     def running_units(self):
-        cur = self.db.execute("select sum(units_running) from workflows")
-        return cur.fetchone()[0]
+        return sum(state.units_running for state in self.__workflows().values())
 
     def workflow_info(self, label):
         cur = self.db.execute("""
@@ -701,31 +1468,27 @@ class UnitStore:
         return cur.fetchone()
 
     def workflow_status(self):
+        # Task and unit summaries are maintained incrementally, see
+        # `__apply_tally` and `__apply_task_tally`.
         cursor = self.db.execute("""
             select
                 label,
                 events,
-                ifnull((select sum(events_read) from tasks where workflow=workflows.id and status in (2, 6, 7, 8) and type=0), 0),
-                ifnull((select sum(events_written) from tasks where workflow=workflows.id and status in (2, 6, 7, 8) and type=0), 0),
+                events_read,
+                events_written,
                 units,
                 units - units_masked,
                 units_done,
-                ifnull((
-                    select sum(units_processed)
-                    from tasks
-                    where workflow=workflows.id and ((status=8 and type=0) or (status=2 and type=0 and workflows.merged=1))
-                ), 0),
+                units_merged + units_unmerged * (merged == 1),
                 units_stuck,
+                units_failed,
+                units_skipped,
                 units_left,
                 '' || round(
                         units_done * 100.0 / (units - units_masked),
                     1) || ' %',
                 '' || ifnull(round(
-                        ifnull((
-                            select sum(units_processed)
-                            from tasks
-                            where workflow=workflows.id and ((status=8 and type=0) or (status=2 and type=0 and workflows.merged=1))
-                        ), 0) * 100.0 / (units - units_masked),
+                        (units_merged + units_unmerged * (merged == 1)) * 100.0 / (units - units_masked),
                     1), 0.0) || ' %'
             from workflows""")
 
@@ -734,32 +1497,13 @@ class UnitStore:
         total = None
         total_mergeable = 0
         for label, events, read, written, units, unmasked, units_done, merged, stuck, \
-                left, progress_percent, merged_percent in cursor:
+                failed, skipped, left, progress_percent, merged_percent in cursor:
             workflow = getattr(self.config.workflows, label)
             mergeable = workflow.merge_size > 1
             if not mergeable:
                 merged = 0
                 merged_percent = '0.0 %'
 
-            failed, skipped = self.db.execute("""
-                select
-                    ifnull((
-                            select count(*)
-                            from units_{0}
-                            where failed > ? and status in (0, 3, 4)
-                        ), 0),
-                    ifnull((
-                            select count(*)
-                            from units_{0}
-                            where file in (select id from files_{0} where skipped >= ?) and status in (0, 3, 4)
-                        ), 0)
-                from workflows
-                where label=?
-                """.format(label), (self.config.advanced.threshold_for_failure,
-                                    self.config.advanced.threshold_for_skipping,
-                                    label)
-            ).fetchone()
-
             row = [events, read, written, units, unmasked, units_done, merged, stuck, failed, skipped, left]
             if total is None:
                 total = row
@@ -776,7 +1520,6 @@ class UnitStore:
             '{} %'.format(round(total_merged * 100. / total_mergeable, 1) if total_mergeable > 0 else 0.)
         ]
 
-    @retry(stop_max_attempt_number=10)
     def pop_unmerged_tasks(self, workflow, bytes, num):
         """Method to get merge tasks.
 
@@ -790,14 +1533,14 @@ class UnitStore:
                 How many merge tasks to create.
         """
 
-        dset_id, merged = self.db.execute(
-            "select id, merged from workflows where label=?", (workflow,)).fetchone()
+        state = self.__workflows()[workflow]
+        dset_id, merged = state.id, state.merged
 
         if merged:
             return []
         elif bytes <= 0:
             logger.debug("fully merged {0}".format(workflow))
-            with self.db:
+            with self.transaction():
                 self.db.execute(
                     """update workflows set merged=1 where id=?""", (dset_id,))
             return []
@@ -821,67 +1564,20 @@ class UnitStore:
 
         logger.debug("trying to merge tasks from {0}".format(workflow))
 
-        class Merge(object):
-
-            def __init__(self, task, units, size, maxsize):
-                self.tasks = [task]
-                self.units = units
-                self.size = size
-                self.maxsize = maxsize
-
-            def __cmp__(self, other):
-                return cmp(self.size, other.size)
-
-            def add(self, task, units, size):
-                if self.size + size > self.maxsize:
-                    return False
-                self.size += size
-                self.units += units
-                self.tasks.append(task)
-                return True
-
-            def left(self):
-                return self.maxsize - self.size
-
-        with self.db:
-            # Select the finished processing tasks from the task
+        with self.transaction():
+            # Select the finished processing tasks from the workflow
             rows = self.db.execute("""
                 select id, units, bytes_bare_output
                 from tasks
-                where workflow=? and status=? and type=0
-                order by bytes_bare_output desc""", (dset_id, SUCCESSFUL)).fetchall()
-
-            # If we don't have enough rows, or the smallest two tasks can't be
-            # merge, set this up so that the loop below is not evaluted and we
-            # skip to the check if the merge for this workflow is complete for
-            # the given maximum size.
-            if len(rows) < 2 or rows[-2][1] + rows[-1][1] > bytes:
-                rows = []
-            else:
-                minsize = rows[-1][1]
-
-            candidates = []
-            for task, units, size in rows:
-                # Try to add the current task to a merge, in increasing order of
-                # size left
-                for merge in reversed(sorted(candidates)):
-                    if merge.add(task, units, size):
-                        break
-                else:
-                    # If we're too large to merge, we're skipped
-                    if size + minsize <= bytes:
-                        candidates.append(Merge(task, units, size, bytes))
-
-            merges = []
-            for merge in reversed(sorted(candidates)):
-                if len(merge.tasks) == 1:
-                    continue
-                # For one iteration only: merge if we are either close enough
-                # to the target size (TODO maybe this threshold should be
-                # configurable? FIXME it's a magic number, anyways) or we are
-                # done processing the task, when we merge everything we can.
-                if units_complete or merge.size >= bytes * 0.9:
-                    merges.append(merge)
+                where workflow=? and status=? and type=0""", (dset_id, SUCCESSFUL)).fetchall()
+
+            planner = self.__merges.get(workflow)
+            if planner is None or planner.maxsize != bytes or units_complete:
+                # Pack everything from scratch when all outputs are
+                # available, to merge as well as possible.
+                planner = self.__merges[workflow] = MergePlanner(bytes)
+            planner.update(rows)
+            merges = planner.pop(units_complete)
 
             logger.debug("created {0} merge tasks".format(len(merges)))
 
@@ -908,15 +1604,19 @@ class UnitStore:
                 merge_update += [(merge_id, id) for id in merge.tasks]
 
             if len(res) > 0:
+                merged = [id for (_, id) in merge_update]
+                before = self.__tally_tasks(merged)
                 self.db.executemany(
                     "update tasks set status=7, task=? where id=?", merge_update)
+                self.__apply_task_tally(before, self.__tally_tasks(merged))
                 self.update_workflow_stats(workflow)
 
             return res
 
     def update_published(self, label, tasks, block):
         update = [(block, t) for t in tasks]
-        with self.db:
+        with self.transaction():
+            before = self.__tally_tasks(tasks)
             self.db.executemany("""
                 update tasks
                 set status=6, published_file_block=?
@@ -925,6 +1625,7 @@ class UnitStore:
                 update units_{}
                 set status=6
                 where task=?""".format(label), [(t,) for t in tasks])
+            self.__apply_task_tally(before, self.__tally_tasks(tasks))
 
     def successful_tasks(self, label):
         dset_id = self.db.execute(
@@ -945,7 +1646,11 @@ class UnitStore:
         cur = self.db.execute("""select id, type
             from tasks
             where workflow=? and status=8
-            """, (dset_id,))
+            union all
+            select id, type
+            from tasks_archive
+            where workflow=? and status=8
+            """, (dset_id, dset_id))
 
         return cur
 
@@ -955,7 +1660,11 @@ class UnitStore:
         cur = self.db.execute("""select id, type
             from tasks
             where status in (3, 4) and workflow=?
-            """, (dset_id,))
+            union all
+            select id, type
+            from tasks_archive
+            where status in (3, 4) and workflow=?
+            """, (dset_id, dset_id))
 
         return cur
 
@@ -975,26 +1684,119 @@ class UnitStore:
         return [xs[0] for xs in files]
 
     def update_pset_hash(self, pset_hash, workflow):
-        with self.db as conn:
+        with self.transaction() as conn:
             conn.execute(
                 "update workflows set pset_hash=? where label=?", (pset_hash, workflow))
 
-    @retry(stop_max_attempt_number=10)
     def update_missing(self, tasks):
-        with self.db:
+        with self.transaction():
+            workflows = defaultdict(list)
             for task, workflow in self.db.execute("""
                     select tasks.id, workflows.label
                     from tasks, workflows
                     where tasks.id in ({0}) and tasks.workflow=workflows.id""".format(", ".join(map(str, tasks)))):
-                self.db.execute(
-                    "update units_{0} set status=3 where task=?".format(workflow), (task,))
+                workflows[workflow].append(task)
+
+            for workflow, ids in workflows.items():
+                before = self.__tally_units(workflow, ids)
+                self.db.executemany(
+                    "update units_{0} set status=3 where task=?".format(workflow), [(task,) for task in ids])
+                self.__apply_tally(workflow, before, self.__tally_units(workflow, ids))
+
+            # merged tasks need to be reset, even if already archived
+            self.__restore_tasks("task in ({0})".format(", ".join(map(str, tasks))))
 
+            before = self.__tally_tasks(tasks)
             # update tasks to be failed
             self.db.executemany("update tasks set status=3 where id=?", [
                                 (task,) for task in tasks])
             # reset merged tasks from merging
             self.db.executemany("update tasks set status=2 where task=?", [
                                 (task,) for task in tasks])
+            self.__apply_task_tally(before, self.__tally_tasks(tasks))
+
+            for workflow in workflows:
+                self.update_workflow_stats(workflow)
+
+    def __archive_rollup(self, table, where):
+        """Sum up the contribution of tasks to the task size adjustment,
+        by workflow.
+        """
+        return self.db.execute("""
+            select
+                workflow,
+                count(*),
+                ifnull(sum((time_epilogue_end - time_stage_in_end) * 1. / units), 0)
+            from {0}
+            where ({1}) and status in (2, 6, 7, 8) and type=0 and units > 0
+            group by workflow""".format(table, where)).fetchall()
+
+    def __restore_tasks(self, where):
+        """Move tasks matching `where` back from the archive.
+        """
+        rollup = self.__archive_rollup('tasks_archive', where)
+        self.db.executemany("""
+            update workflows set
+                tasks_archived=tasks_archived - ?,
+                unittime_archived=unittime_archived - ?
+            where id=?""", [(tasks, unittime, workflow) for (workflow, tasks, unittime) in rollup])
+        self.db.execute("insert into tasks select * from tasks_archive where " + where)
+        self.db.execute("delete from tasks_archive where " + where)
+
+    def archive_tasks(self, limit=10000):
+        """Move finished tasks to the archive.
+
+        Failed and aborted tasks, as well as merged or published ones, do
+        not change any longer.  Moving them to `tasks_archive`, which has
+        no indices besides the merge task, keeps the cost of the queries
+        of the master independent of the number of tasks processed.  Their
+        contribution to the task size adjustment is kept in the workflow
+        table.  Merged tasks are restored if the output of their merge
+        task goes missing.
+
+        Parameters
+        ----------
+            limit : int
+                The maximum number of tasks to move.
+
+        Returns
+        -------
+            archived : int
+                The number of tasks moved.
+        """
+        with self.transaction():
+            ids = [id_ for (id_,) in self.db.execute(
+                "select id from tasks where status in (3, 4, 6, 8) limit ?", (limit,))]
+            if len(ids) == 0:
+                return 0
+
+            where = "id in ({0})".format(", ".join(map(str, ids)))
+            rollup = self.__archive_rollup('tasks', where)
+            self.db.executemany("""
+                update workflows set
+                    tasks_archived=tasks_archived + ?,
+                    unittime_archived=unittime_archived + ?
+                where id=?""", [(tasks, unittime, workflow) for (workflow, tasks, unittime) in rollup])
+            self.db.execute("insert into tasks_archive select * from tasks where " + where)
+            self.db.execute("delete from tasks where " + where)
+
+        logger.debug("archived {0} tasks".format(len(ids)))
+        return len(ids)
+
+    def optimize(self, pages=1000):
+        """Update the statistics of the query planner and release unused
+        space.
+
+        Parameters
+        ----------
+            pages : int
+                The maximum number of free pages to release to the file
+                system.  Has no effect on databases created without
+                incremental vacuum support.
+        """
+        with self.transaction():
+            self.db.execute("analyze")
+            self.db.execute("pragma incremental_vacuum({0})".format(int(pages))).fetchall()
 
     def finished_files(self, infos):
         res = []
@@ -1012,13 +1814,47 @@ class UnitStore:
         return (x[0] for x in res)
 
     def update_transfers(self, transfers):
-        for dataset in transfers:
-            data = json.loads(self.db.execute(
-                "select transfers from workflows where dataset=?", (dataset,)).fetchone()[0])
+        """Add transfer outcomes to the statistics of the current time
+        bucket.
+
+        Parameters
+        ----------
+            transfers : dict
+                Maps workflow labels to a dictionary mapping protocols to
+                a `Counter` of outcomes, i.e., `stage-in success`.
+        """
+        bucket = int(time.time()) // TRANSFER_BUCKET * TRANSFER_BUCKET
+        update = []
+        for label, protocols in transfers.items():
+            for protocol, outcomes in protocols.items():
+                for outcome, count in outcomes.items():
+                    update.append((label, protocol, outcome, bucket, count))
+
+        with self.transaction():
+            self.db.executemany("""
+                insert or ignore into transfers(workflow, protocol, outcome, bucket)
+                select id, ?, ?, ? from workflows where label=?""",
+                                [(p, o, b, l) for (l, p, o, b, c) in update])
+            self.db.executemany("""
+                update transfers
+                set count=(count + ?)
+                where workflow=(select id from workflows where label=?) and protocol=? and outcome=? and bucket=?""",
+                                [(c, l, p, o, b) for (l, p, o, b, c) in update])
 
-            for protocol in transfers[dataset]:
-                if protocol in data:
-                    transfers[dataset][protocol] += Counter(data[protocol])
+    def transfers(self, label):
+        """Get the total transfer outcomes of a workflow.
 
-            self.db.execute("update workflows set transfers=? where dataset=?", (json.dumps(
-                transfers[dataset]), dataset))
+        Returns
+        -------
+            transfers : dict
+                A dictionary mapping protocols to a `Counter` of
+                outcomes.
+        """
+        res = defaultdict(Counter)
+        for protocol, outcome, count in self.db.execute("""
+                select protocol, outcome, sum(count)
+                from transfers
+                where workflow=(select id from workflows where label=?)
+                group by protocol, outcome""", (label,)):
+            res[protocol][outcome] = count
+        return res
@@ -0,0 +1,181 @@
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import deque
+
+from elasticsearch import helpers
+from elasticsearch.serializer import JSONSerializer
+
+logger = logging.getLogger('lobster.monitor.elk')
+
+
+class BulkShipper(object):
+
+    """
+    Send documents to Elasticsearch in the background, using the bulk API.
+
+    Actions, as accepted by :func:`elasticsearch.helpers.bulk`, are
+    buffered in memory and sent in batches by a background thread.  When
+    more than `size` actions are buffered, or a batch cannot be sent,
+    actions are spilled to the file `spool`, one JSON document per line.
+    Spilled actions are sent once the memory buffer has been emptied, also
+    after a restart.  With `blocking`, adding actions to a full buffer
+    waits instead, for bulk loads that can be throttled.
+
+    Parameters
+    ----------
+        client : callable
+            Returns the Elasticsearch client to use.
+        spool : str
+            The file to spill actions to.
+        size : int
+            The maximum number of actions to keep in memory.
+        batch : int
+            The maximum number of actions to send at once.
+        interval : int
+            How long to wait for a batch to fill up, in seconds.
+        threads : int
+            The number of threads sending batches.
+        blocking : bool
+            Wait for space in the buffer instead of spilling actions.
+    """
+
+    def __init__(self, client, spool, size=10000, batch=500, interval=5, threads=1, blocking=False):
+        self.__client = client
+        self.__spool = spool
+        self.__size = size
+        self.__batch = batch
+        self.__interval = interval
+        self.__blocking = blocking
+        self.__serializer = JSONSerializer()
+        self.__buffer = deque()
+        self.__busy = 0
+        self.__draining = False
+        self.__failures = 0
+        self.__cond = threading.Condition()
+        for n in range(threads):
+            thread = threading.Thread(target=self.__run, name='elk-{0}'.format(n))
+            thread.daemon = True
+            thread.start()
+
+    def put(self, action):
+        with self.__cond:
+            while self.__blocking and len(self.__buffer) >= self.__size:
+                self.__cond.notify_all()
+                self.__cond.wait(self.__interval)
+            if len(self.__buffer) >= self.__size:
+                self.__spill([action])
+            else:
+                self.__buffer.append(action)
+            if len(self.__buffer) >= self.__batch:
+                self.__cond.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait for all buffered and spilled actions to be sent, at most
+        `timeout` seconds.  Actions still buffered afterwards are spilled
+        to disk.  Returns `True` if all actions have been delivered.
+        """
+        end = time.time() + timeout if timeout is not None else None
+        with self.__cond:
+            self.__cond.notify_all()
+            while self.__pending():
+                remaining = end - time.time() if end is not None else 60
+                if remaining <= 0:
+                    break
+                self.__cond.wait(remaining)
+            if self.__buffer:
+                logger.warning("spilling {0} Elasticsearch documents to {1}".format(
+                    len(self.__buffer), self.__spool))
+                self.__spill(self.__buffer)
+                self.__buffer.clear()
+            return not self.__pending()
+
+    def __pending(self):
+        # Has to be called with the lock held
+        return self.__buffer or self.__busy or \
+            os.path.exists(self.__spool) or os.path.exists(self.__spool + '.sending')
+
+    def __spill(self, actions):
+        # Has to be called with the lock held
+        with open(self.__spool, 'a') as f:
+            for action in actions:
+                f.write(self.__serializer.dumps(action) + '\n')
+
+    def __send(self, actions):
+        """Send `actions`, and return `True` on success.  Actions that
+        could not be sent because of a connection problem are spilled to
+        disk.
+        """
+        try:
+            sent, errors = helpers.bulk(self.__client(), actions, raise_on_error=False)
+            self.__failures = 0
+            if len(errors) > 0:
+                logger.error("could not index {0} Elasticsearch documents, e.g.: {1}".format(
+                    len(errors), errors[0]))
+            return True
+        except Exception as e:
+            logger.error("could not send {0} Elasticsearch documents: {1}".format(len(actions), e))
+            with self.__cond:
+                self.__spill(actions)
+            self.__failures += 1
+            time.sleep(min(self.__interval * 2 ** self.__failures, 300))
+            return False
+
+    def __drain(self):
+        """Send the actions spilled to disk.
+        """
+        sending = self.__spool + '.sending'
+        with self.__cond:
+            if self.__draining:
+                return
+            if not os.path.exists(sending):
+                if not os.path.exists(self.__spool):
+                    return
+                os.rename(self.__spool, sending)
+            self.__draining = True
+        try:
+            self.__drain_file(sending)
+        finally:
+            with self.__cond:
+                self.__draining = False
+
+    def __drain_file(self, sending):
+        with open(sending) as f:
+            while True:
+                lines = list(itertools.islice(f, self.__batch))
+                if len(lines) == 0:
+                    break
+                if not self.__send([json.loads(line) for line in lines]):
+                    # Keep the remaining actions for the next attempt
+                    with self.__cond:
+                        with open(self.__spool, 'a') as out:
+                            out.writelines(f)
+                    break
+        os.unlink(sending)
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                if len(self.__buffer) < self.__batch:
+                    self.__cond.wait(self.__interval)
+                batch = [self.__buffer.popleft() for _ in range(min(self.__batch, len(self.__buffer)))]
+                self.__busy += 1
+                if len(batch) > 0:
+                    # make room for blocked callers
+                    self.__cond.notify_all()
+
+            try:
+                if len(batch) > 0:
+                    self.__send(batch)
+                else:
+                    self.__drain()
+            except Exception:
+                logger.exception("failed to ship Elasticsearch documents")
+            finally:
+                with self.__cond:
+                    self.__busy -= 1
+                    self.__cond.notify_all()
@@ -1,5 +1,6 @@
 import elasticsearch as es
 import elasticsearch_dsl as es_dsl
+import copy
 import datetime as dt
 import time
 import math
@@ -9,7 +10,9 @@ import inspect
 import logging
 import os
 import requests
+import threading
 
+from lobster.monitor.elk.bulk import BulkShipper
 from lobster.util import Configurable, PartiallyMutable
 import lobster
 
@@ -17,9 +20,20 @@ import lobster
 logger = logging.getLogger('lobster.monitor.elk')
 
 
+# Names of the data attributes per class, see `dictify`
+_attributes = {}
+
+
 def dictify(thing, skip=None):
-    thing = dict([(m, o) for (m, o) in inspect.getmembers(thing)
-                  if not inspect.isroutine(o) and not m.startswith('__')])
+    cls = type(thing)
+    if cls not in _attributes:
+        _attributes[cls] = [m for (m, o) in inspect.getmembers(cls)
+                            if not inspect.isroutine(o) and not m.startswith('__')]
+    names = set(_attributes[cls])
+    names.update(m for m in getattr(thing, '__dict__', {}) if not m.startswith('__'))
+
+    thing = dict([(m, getattr(thing, m)) for m in names])
+    thing = dict([(m, o) for (m, o) in thing.items() if not inspect.isroutine(o)])
 
     if isinstance(skip, basestring):
         try:
@@ -121,6 +135,10 @@ class ElkInterface(Configurable):
         self.start_time = None
         self.end_time = None
         self.previous_stats = {}
+        self.__intervals = {}
+        self.__visualizations = {}
+        self.__lock = threading.Lock()
+        self.__shipper = None
         self.template_dir = os.path.join(os.path.dirname(
             os.path.abspath(lobster.__file__)), 'monitor', 'elk', 'data')
         self.client = es.Elasticsearch([{'host': self.es_host,
@@ -140,6 +158,11 @@ class ElkInterface(Configurable):
     def __getstate__(self):
         state = dict(self.__dict__)
         del state['client']
+        for key in ('_ElkInterface__lock', '_ElkInterface__shipper'):
+            state.pop(key, None)
+        state['previous_stats'] = {}
+        state['_ElkInterface__intervals'] = {}
+        state['_ElkInterface__visualizations'] = {}
         return state
 
     def __setstate__(self, state):
@@ -148,6 +171,51 @@ class ElkInterface(Configurable):
         with PartiallyMutable.unlock():
             self.client = es.Elasticsearch([{'host': self.es_host,
                                              'port': self.es_port}])
+            self.__lock = threading.Lock()
+            self.__shipper = None
+            self.__dict__.setdefault('_ElkInterface__intervals', {})
+            self.__dict__.setdefault('_ElkInterface__visualizations', {})
+
+    def setup(self, config, spool='elk_spool.json', **kwargs):
+        """Start sending documents in the background.
+
+        Documents that cannot be sent are kept in the file `spool` in the
+        working directory.  Further keyword arguments are passed on to
+        :class:`~lobster.monitor.elk.bulk.BulkShipper`.
+        """
+        self.__shipper = BulkShipper(lambda: self.client,
+                                     os.path.join(config.workdir, spool), **kwargs)
+
+    def ship(self, op, index, doc_type, id, body):
+        """Index or update a document.
+
+        Sent in the background with the bulk API, if set up, and directly
+        otherwise.  For updates, `body` has to contain the partial document
+        and upsert options.
+        """
+        if not self.__shipper:
+            if op == 'update':
+                self.client.update(index=index, doc_type=doc_type, id=id, body=body)
+            else:
+                self.client.index(index=index, doc_type=doc_type, id=id, body=body)
+            return
+
+        action = {'_op_type': op, '_index': index, '_type': doc_type}
+        if id is not None:
+            action['_id'] = id
+        if op == 'update':
+            action.update(body)
+        else:
+            action['_source'] = body
+        self.__shipper.put(action)
+
+    def flush(self, timeout=60):
+        """Wait for documents to be sent, at most `timeout` seconds.
+        Returns `True` if all documents have been delivered.
+        """
+        if self.__shipper:
+            return self.__shipper.flush(timeout)
+        return True
 
     def create(self, categories):
         with PartiallyMutable.unlock():
@@ -195,6 +263,7 @@ class ElkInterface(Configurable):
         logger.info("ending ELK monitoring")
         with PartiallyMutable.unlock():
             self.end_time = dt.datetime.utcnow()
+        self.flush()
         self.update_links()
 
     def resume(self):
@@ -255,6 +324,11 @@ class ElkInterface(Configurable):
             self.client.index(index=self.prefix + '_monitor_data',
                               doc_type='fields', id='intervals',
                               body=intervals)
+
+            with self.__lock:
+                self.__intervals.clear()
+                self.__intervals.update(intervals)
+                self.__visualizations.clear()
         except Exception as e:
             logger.error(e)
 
@@ -711,9 +785,9 @@ class ElkInterface(Configurable):
 
                 if isinstance(cur_val, dt.date):
                     cur_val = int(cur_val.strftime('%s'))
-                    old_val = int(
-                        dt.datetime.strptime(old_val, '%Y-%m-%dT%H:%M:%S')
-                        .strftime('%s'))
+                    if not isinstance(old_val, dt.date):
+                        old_val = dt.datetime.strptime(old_val, '%Y-%m-%dT%H:%M:%S')
+                    old_val = int(old_val.strftime('%s'))
 
                 if old_val is not None:
                     if '.' in field:
@@ -732,96 +806,102 @@ class ElkInterface(Configurable):
     def update_histogram_bins(self, log, log_type):
         logger.debug("updating " + log_type + " histogram bins")
 
-        try:
+        with self.__lock:
+            try:
+                self.__update_histogram_bins(log, log_type)
+            except Exception as e:
+                logger.error(e)
+
+    def __update_histogram_bins(self, log, log_type):
+        # Intervals and visualizations are kept in memory, and only sent
+        # to Elasticsearch when changed.
+        intervals = self.__intervals
+        if len(intervals) == 0:
             search = es_dsl.Search(
                 using=self.client, index=self.prefix + '_monitor_data') \
                 .filter('match', _type='fields') \
                 .filter('match', _id='intervals') \
                 .extra(size=1)
+            intervals.update(search.execute()[0].to_dict())
 
-            intervals = search.execute()[0].to_dict()
-
-            fields = ['.'.join(path.split('.')[:-1])
-                      for path in nested_paths(intervals[log_type])
-                      if path.endswith('interval')]
-
-            for field in fields:
-                cur_val = nested_get(log, field)
-                if cur_val is None:
-                    break
+        fields = ['.'.join(path.split('.')[:-1])
+                  for path in nested_paths(intervals[log_type])
+                  if path.endswith('interval')]
 
-                field_path = log_type + '.' + field
-                intervals_field = nested_get(intervals, field_path)
-
-                changed = False
-                if intervals_field['interval'] is None:
+        updated = False
+        for field in fields:
+            cur_val = nested_get(log, field)
+            if cur_val is None:
+                break
+
+            field_path = log_type + '.' + field
+            intervals_field = nested_get(intervals, field_path)
+
+            changed = False
+            if intervals_field['interval'] is None:
+                intervals_field['min'] = cur_val
+                intervals_field['max'] = cur_val
+                changed = True
+            else:
+                if cur_val < intervals_field['min']:
                     intervals_field['min'] = cur_val
+                    changed = True
+                elif cur_val > intervals_field['max']:
                     intervals_field['max'] = cur_val
                     changed = True
-                else:
-                    if cur_val < intervals_field['min']:
-                        intervals_field['min'] = cur_val
-                        changed = True
-                    elif cur_val > intervals_field['max']:
-                        intervals_field['max'] = cur_val
-                        changed = True
-
-                if changed:
-                    if intervals_field['min'] == intervals_field['max']:
-                        intervals_field['interval'] = 1
-                    else:
-                        intervals_field['interval'] = \
-                            math.ceil((intervals_field['max'] -
-                                       intervals_field['min']) / 20.0)
 
-                    for vis_id in intervals_field['vis_ids']:
-                        search_vis = es_dsl.Search(
-                            using=self.client, index='.kibana') \
-                            .filter('match', _id=vis_id) \
-                            .filter('match', _type='visualization') \
-                            .extra(size=1)
+            if changed:
+                updated = True
+                if intervals_field['min'] == intervals_field['max']:
+                    intervals_field['interval'] = 1
+                else:
+                    intervals_field['interval'] = \
+                        math.ceil((intervals_field['max'] -
+                                   intervals_field['min']) / 20.0)
+
+                for vis_id in intervals_field['vis_ids']:
+                    vis = self.__visualizations.get(vis_id)
+                    if vis is None:
+                        vis = self.client.get(index='.kibana',
+                                              doc_type='visualization',
+                                              id=vis_id)['_source']
+                        self.__visualizations[vis_id] = vis
 
-                        vis = search_vis.execute()[0]
-                        vis_state = json.loads(vis.visState)
+                    vis_state = json.loads(vis['visState'])
 
-                        for agg in vis_state['aggs']:
-                            if agg['type'] == 'histogram' and \
-                                    agg['params']['field'] == field_path:
-                                agg['params']['interval'] = \
-                                    intervals_field['interval']
+                    for agg in vis_state['aggs']:
+                        if agg['type'] == 'histogram' and \
+                                agg['params']['field'] == field_path:
+                            agg['params']['interval'] = \
+                                intervals_field['interval']
 
-                        vis.visState = json.dumps(vis_state, sort_keys=True)
+                    vis['visState'] = json.dumps(vis_state, sort_keys=True)
 
-                        vis_source = json.loads(
-                            vis.kibanaSavedObjectMeta.searchSourceJSON)
+                    vis_source = json.loads(
+                        vis['kibanaSavedObjectMeta']['searchSourceJSON'])
 
-                        filter_words = vis_source['query']['query_string']['query'].split(' ')
+                    filter_words = vis_source['query']['query_string']['query'].split(' ')
 
-                        for i, word in enumerate(filter_words):
-                            if word.startswith(field_path + ':>='):
-                                filter_words[i] = field_path + ':>=' + \
-                                    str(intervals_field['min'])
-                            elif word.startswith(field_path + ':<='):
-                                filter_words[i] = field_path + ':<=' + \
-                                    str(intervals_field['max'])
+                    for i, word in enumerate(filter_words):
+                        if word.startswith(field_path + ':>='):
+                            filter_words[i] = field_path + ':>=' + \
+                                str(intervals_field['min'])
+                        elif word.startswith(field_path + ':<='):
+                            filter_words[i] = field_path + ':<=' + \
+                                str(intervals_field['max'])
 
-                        vis_source['query']['query_string']['query'] =\
-                            ' '.join(filter_words)
+                    vis_source['query']['query_string']['query'] =\
+                        ' '.join(filter_words)
 
-                        vis.kibanaSavedObjectMeta.searchSourceJSON = \
-                            json.dumps(vis_source, sort_keys=True)
+                    vis['kibanaSavedObjectMeta']['searchSourceJSON'] = \
+                        json.dumps(vis_source, sort_keys=True)
 
-                        self.client.index(index='.kibana',
-                                          doc_type='visualization',
-                                          id=vis_id, body=vis.to_dict())
+                    self.ship('index', '.kibana', 'visualization', vis_id,
+                              copy.deepcopy(vis))
 
-                nested_set(intervals, log_type + '.' + field, intervals_field)
-
-            self.client.index(index=self.prefix + '_monitor_data',
-                              doc_type='fields', id='intervals',
-                              body=intervals)
-        except Exception as e:
-            logger.error(e)
+        if updated:
+            self.ship('index', self.prefix + '_monitor_data', 'fields',
+                      'intervals', copy.deepcopy(intervals))
 
     def index_task(self, task):
         logger.debug("parsing Task object")
@@ -890,14 +970,12 @@ class ElkInterface(Configurable):
         try:
             task_doc = {'doc': {'Task': task},
                         'doc_as_upsert': True}
-            self.client.update(index=self.prefix + '_lobster_tasks',
-                               doc_type='task', id=task['id'],
-                               body=task_doc)
+            self.ship('update', self.prefix + '_lobster_tasks', 'task',
+                      task['id'], task_doc)
 
             log_doc = {'text': task_log}
-            self.client.index(index=self.prefix + '_lobster_task_logs',
-                              doc_type='log', id=task['id'],
-                              body=log_doc)
+            self.ship('index', self.prefix + '_lobster_task_logs', 'log',
+                      task['id'], log_doc)
         except Exception as e:
             logger.error(e)
 
@@ -1033,9 +1111,8 @@ class ElkInterface(Configurable):
             doc = {'doc': {'TaskUpdate': task_update,
                            'timestamp': task_update['time_retrieved']},
                    'doc_as_upsert': True}
-            self.client.update(index=self.prefix + '_lobster_tasks',
-                               doc_type='task', id=task_update['id'],
-                               body=doc)
+            self.ship('update', self.prefix + '_lobster_tasks', 'task',
+                      task_update['id'], doc)
         except Exception as e:
             logger.error(e)
 
@@ -1052,7 +1129,20 @@ class ElkInterface(Configurable):
                 [getattr(stats, a) for a in log_attributes] + [category]
 
             stats = dict(zip(keys, values))
+        except Exception as e:
+            logger.error(e)
+            return
 
+        self.index_stats_document(
+            stats, category, str(int(int(now.strftime('%s')) * 1e6 + now.microsecond)))
+
+    def index_stats_document(self, stats, category, id):
+        """Index the statistics `stats` of a master iteration.
+
+        Cumulative fields are unrolled with respect to the previous
+        document of the same category.
+        """
+        try:
             stats['committed_memory_GB'] = stats['committed_memory'] / 1024.0
             stats['total_memory_GB'] = stats['total_memory'] / 1024.0
 
@@ -1068,15 +1158,21 @@ class ElkInterface(Configurable):
             return
 
         try:
-            search_previous = es_dsl.Search(
-                using=self.client, index=self.prefix + '_lobster_stats') \
-                .filter('match', category=category) \
-                .sort('-timestamp').extra(size=1)
-            response_previous = search_previous.execute()
-
-            if len(response_previous) > 0:
-                previous = response_previous[0].to_dict()
-
+            # The previous document is only looked up once per run, and
+            # kept in memory afterwards
+            if category not in self.previous_stats:
+                search_previous = es_dsl.Search(
+                    using=self.client, index=self.prefix + '_lobster_stats') \
+                    .filter('match', category=category) \
+                    .sort('-timestamp').extra(size=1)
+                response_previous = search_previous.execute()
+                if len(response_previous) > 0:
+                    self.previous_stats[category] = response_previous[0].to_dict()
+
+            previous = self.previous_stats.get(category)
+            self.previous_stats[category] = stats
+
+            if previous is not None:
                 fields = ['timestamp', 'workers_lost', 'workers_able',
                           'workers_connected', 'workers_idled_out',
                           'workers_busy', 'workers_fast_aborted',
@@ -1113,10 +1209,7 @@ class ElkInterface(Configurable):
 
         logger.debug("sending lobster stats document to Elasticsearch")
         try:
-            self.client.index(index=self.prefix + '_lobster_stats',
-                              doc_type='log', body=stats,
-                              id=str(int(int(now.strftime('%s')) * 1e6 +
-                                         now.microsecond)))
+            self.ship('index', self.prefix + '_lobster_stats', 'log', id, stats)
         except Exception as e:
             logger.error(e)
 
@@ -1145,15 +1238,11 @@ class ElkInterface(Configurable):
                             'doc_as_upsert': True}
 
             if workflow_summary['label'] == 'Total':
-                self.client.update(
-                    index=self.prefix + '_lobster_summaries',
-                    doc_type='total', body=workflow_doc,
-                    id=workflow_summary['label'])
+                self.ship('update', self.prefix + '_lobster_summaries',
+                          'total', workflow_summary['label'], workflow_doc)
             else:
-                self.client.update(
-                    index=self.prefix + '_lobster_summaries',
-                    doc_type='workflow', body=workflow_doc,
-                    id=workflow_summary['label'])
+                self.ship('update', self.prefix + '_lobster_summaries',
+                          'workflow', workflow_summary['label'], workflow_doc)
 
         for category in self.categories:
             category_summary = {key: 0 for key in keys[1:-2]}
@@ -1175,7 +1264,5 @@ class ElkInterface(Configurable):
             category_doc = {'doc': category_summary,
                             'doc_as_upsert': True}
 
-            self.client.update(
-                index=self.prefix + '_lobster_summaries',
-                doc_type='category', body=category_doc,
-                id=category)
+            self.ship('update', self.prefix + '_lobster_summaries',
+                      'category', category, category_doc)
@@ -8,6 +8,7 @@
 # If optional packages are needed, they should be included in the function
 # scope.
 
+import bisect
 import collections
 import inspect
 import json
@@ -17,6 +18,7 @@ import shlex
 import shutil
 import smtplib
 import subprocess
+import threading
 import time
 
 from contextlib import contextmanager
@@ -295,20 +297,47 @@ class Timing(object):
 
     """
     Baseclass to simplify keeping track of the timing of things.
+
+    Besides the total time spent per key, the number of measurements and
+    a histogram of their durations are recorded, with the upper bounds of
+    the bins, in seconds, given by `buckets`.  Measurements may be taken
+    from several threads.
     """
 
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300)
+
     def __init__(self, *keys):
         self._times = {k: 0 for k in keys}
+        self._counts = {k: 0 for k in keys}
+        self._histograms = {k: [0] * (len(self.buckets) + 1) for k in keys}
+        self._timing_lock = threading.Lock()
 
     @property
     def times(self):
-        return dict(self._times)
+        with self._timing_lock:
+            return dict(self._times)
+
+    @property
+    def histograms(self):
+        """Return a dictionary with the number of measurements, the number
+        of measurements per bin, including a last bin for durations longer
+        than the last bound, and the total time in seconds per key.
+        """
+        with self._timing_lock:
+            return dict(
+                (k, (self._counts[k], list(self._histograms[k]), self._times[k] / 1e6))
+                for k in self._times
+            )
 
     @contextmanager
     def measure(self, what):
         t = time.time()
         yield
-        self._times[what] += int((time.time() - t) * 1e6)
+        elapsed = time.time() - t
+        with self._timing_lock:
+            self._times[what] += int(elapsed * 1e6)
+            self._counts[what] += 1
+            self._histograms[what][bisect.bisect_left(self.buckets, elapsed)] += 1
 
 
 def id2dir(id):
@@ -363,27 +392,105 @@ def verify(workdir):
             my_version, stored_version))
 
 
+class Checkpoints(object):
+
+    """
+    The checkpoints of a project, kept in memory.
+
+    Checkpoints are persisted in `status.json` in the working directory,
+    which is replaced atomically on every change, so that a crash cannot
+    leave a truncated file behind.  Changes by other processes are picked
+    up when the file is replaced, which is checked at most every
+    `interval` seconds, or after :meth:`expire` has been called.
+
+    Parameters
+    ----------
+        workdir : str
+            The working directory of the project.
+        interval : float
+            How long to trust the checkpoints in memory, in seconds.
+    """
+
+    def __init__(self, workdir, interval=0):
+        self.path = os.path.join(workdir, 'status.json')
+        self.interval = interval
+        self.__state = None
+        self.__stamp = None
+        self.__checked = 0
+        self.__lock = threading.RLock()
+
+    def __stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        # Replacing the file changes the inode, even when the
+        # modification time does not
+        return st.st_ino, st.st_mtime, st.st_size
+
+    def __reload(self, force=False):
+        if not force and time.time() - self.__checked < self.interval:
+            return
+        self.__checked = time.time()
+        stamp = self.__stat()
+        if stamp is not None and stamp == self.__stamp:
+            return
+        if stamp is None:
+            self.__state = None
+        else:
+            with open(self.path) as f:
+                self.__state = json.load(f)
+        self.__stamp = stamp
+
+    def expire(self):
+        """Re-read the checkpoints on the next access.  Safe to call from
+        a signal handler.
+        """
+        self.__checked = 0
+
+    def get(self, key):
+        with self.__lock:
+            self.__reload()
+            if self.__state is not None:
+                return self.__state.get(key)
+
+    def set(self, key, value):
+        with self.__lock:
+            self.__reload(force=True)
+            state = dict(self.__state or {})
+            state[key] = value
+
+            tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+            with open(tmp, 'w') as f:
+                json.dump(state, f, sort_keys=True, indent=4)
+                f.write('\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(tmp, self.path)
+
+            self.__state = state
+            self.__stamp = self.__stat()
+
+
+_checkpoints = {}
+
+
+def checkpoints(workdir):
+    """Return the :class:`Checkpoints` of the project in `workdir`, shared
+    by all callers within a process.
+    """
+    path = os.path.join(workdir, 'status.json')
+    if path not in _checkpoints:
+        _checkpoints[path] = Checkpoints(workdir)
+    return _checkpoints[path]
+
+
 def checkpoint(workdir, key):
-    statusfile = os.path.join(workdir, 'status.json')
-    if os.path.exists(statusfile):
-        with open(statusfile, 'r') as f:
-            s = json.load(f)
-            return s.get(key)
+    return checkpoints(workdir).get(key)
 
 
 def register_checkpoint(workdir, key, value):
-    statusfile = os.path.join(workdir, 'status.json')
-    if not os.path.exists(statusfile):
-        with open(statusfile, 'w') as f:
-            json.dump({key: value}, f)
-            f.write('\n')
-    else:
-        with open(statusfile, 'r') as f:
-            s = json.load(f)
-            s[key] = value
-        with open(statusfile, 'w') as f:
-            json.dump(s, f, sort_keys=True, indent=4)
-            f.write('\n')
+    checkpoints(workdir).set(key, value)
 
 
 def sendemail(emailmsg, config):
@@ -480,10 +587,15 @@ def get_lock(workdir, force=False):
     return pidfile
 
 
-def taskdir(workdir, taskid, status='running'):
+def taskdir(workdir, taskid, status='running', create=True):
     tdir = os.path.normpath(os.path.join(workdir, status, id2dir(taskid)))
-    if not os.path.isdir(tdir):
-        os.makedirs(tdir)
+    if create and not os.path.isdir(tdir):
+        try:
+            os.makedirs(tdir)
+        except OSError:
+            # may have been created concurrently
+            if not os.path.isdir(tdir):
+                raise
     return tdir
 
 
@@ -499,8 +611,17 @@ def move(workdir, taskid, status, oldstatus='running'):
     new = os.path.normpath(os.path.join(workdir, status, id2dir(taskid)))
     parent = os.path.dirname(new)
     if not os.path.isdir(parent):
-        os.makedirs(parent)
+        try:
+            os.makedirs(parent)
+        except OSError:
+            # may have been created concurrently
+            if not os.path.isdir(parent):
+                raise
     shutil.move(old, parent)
-    if len(os.listdir(os.path.dirname(old))) == 0:
-        os.removedirs(os.path.dirname(old))
+    try:
+        if len(os.listdir(os.path.dirname(old))) == 0:
+            os.removedirs(os.path.dirname(old))
+    except OSError:
+        # removed concurrently, or not empty any longer
+        pass
     return new
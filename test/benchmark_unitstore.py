@@ -0,0 +1,207 @@
+#!/usr/bin/env python
+"""Benchmark the unit store with synthetic workflows.
+
+Registers workflows of configurable size, and drives them through the
+cycle of the master until all units are processed: creating processing
+and merge tasks, returning them with a configurable failure rate, and
+registering the outputs with dependent workflows.  Reports latency
+percentiles per operation, the database size, and the peak memory used.
+
+Run as, e.g.::
+
+    python test/benchmark_unitstore.py --files 1000 --lumis 1000 --children 1
+"""
+
+import argparse
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lobster import se
+from lobster.core import unit
+from lobster.core.config import Config, AdvancedOptions
+from lobster.core.dataset import DatasetInfo, FileInfo
+from lobster.core.unit import TaskUpdate, UnitStore
+from lobster.core.workflow import Workflow
+
+parser = argparse.ArgumentParser(description='benchmark the unit store with synthetic workflows')
+parser.add_argument('--files', type=int, default=100,
+                    help='number of files of the input workflow')
+parser.add_argument('--lumis', type=int, default=100,
+                    help='number of luminosity sections per file')
+parser.add_argument('--arguments', type=int, default=1,
+                    help='number of unique arguments per workflow')
+parser.add_argument('--children', type=int, default=0,
+                    help='length of the chain of workflows processing the output of the first one')
+parser.add_argument('--tasksize', type=int, default=25,
+                    help='number of units per task')
+parser.add_argument('--tasks', type=int, default=500,
+                    help='number of tasks to create per workflow and cycle')
+parser.add_argument('--merge-size', type=int, default=-1, dest='merge_size',
+                    help='merge size in bytes, with each unit producing 1 kB of output')
+parser.add_argument('--failures', type=float, default=0.05,
+                    help='fraction of tasks to fail')
+parser.add_argument('--ranges', action='store_true',
+                    help='store contiguous luminosity sections as ranges')
+parser.add_argument('--cycles', type=int, default=10000,
+                    help='maximum number of cycles to run')
+parser.add_argument('--seed', type=int, default=42,
+                    help='seed for the random number generator')
+parser.add_argument('--workdir', help='directory to create the database in, kept after the run')
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+# no sandbox is needed, as nothing is run
+os.environ.setdefault('LOCALRT', '')
+
+timings = defaultdict(list)
+
+
+@contextmanager
+def measure(what):
+    t = time.time()
+    yield
+    timings[what].append(time.time() - t)
+
+
+def dataset_info():
+    info = DatasetInfo()
+    info.tasksize = args.tasksize
+    info.total_units = args.files * args.lumis
+    info.total_events = info.total_units * 100
+    for n in range(args.files):
+        finfo = info.files['/store/benchmark/{0}.root'.format(n)]
+        finfo.lumis = [(1, n * args.lumis + lumi) for lumi in range(1, args.lumis + 1)]
+        finfo.events = args.lumis * 100
+        finfo.size = args.lumis * 1000
+    return info
+
+
+workdir = args.workdir or tempfile.mkdtemp()
+config = Config(
+    label='benchmark',
+    workdir=workdir,
+    storage=se.StorageConfiguration(output=['file://' + workdir]),
+    workflows=[],
+    advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version='3.3', unit_ranges=args.ranges)
+)
+unique_args = [str(n) for n in range(args.arguments)] if args.arguments > 1 else None
+
+store = UnitStore(config)
+labels = ['benchmark_{0}'.format(n) for n in range(args.children + 1)]
+for n, label in enumerate(labels):
+    wflow = Workflow(label, None, command='foo', merge_size=args.merge_size, unique_arguments=unique_args)
+    info = dataset_info()
+    if n > 0:
+        info.files.clear()
+    with measure('register_dataset'):
+        store.register_dataset(wflow, info)
+    if n > 0:
+        with measure('register_dependency'):
+            store.register_dependency(label, labels[n - 1], args.files * args.lumis * args.arguments ** (n + 1))
+
+# the luminosity sections processed by a task, to register outputs
+# with dependent workflows
+outputs = {}
+
+
+def finish(label, tasks):
+    """Return tasks, and propagate outputs to the next workflow.
+    """
+    child = labels[labels.index(label) + 1] if label != labels[-1] else None
+    updates = defaultdict(list)
+    propagate = []
+    for (id, _, files, units, arg, merge) in tasks:
+        failed = random.random() < args.failures
+        update = TaskUpdate(
+            id=id,
+            host='localhost',
+            status=unit.FAILED if failed else unit.SUCCESSFUL,
+            time_stage_in_end=0,
+            time_epilogue_end=len(units) * 60
+        )
+        if merge:
+            updates[(label, 'tasks')].append((update, [], []))
+            if not failed and child:
+                outputs[id] = sum((outputs.pop(str(task)) for (task, _, _, _) in units), [])
+        else:
+            if not failed:
+                update.events_read = update.events_written = len(units) * 100
+                update.units_processed = len(units)
+                update.bytes_bare_output = update.bytes_output = len(units) * 1000
+                if child:
+                    outputs[id] = [(run, lumi) for (_, _, run, lumi) in units]
+            updates[(label, 'units_' + label)].append(
+                (update, [(update.events_read, 0, file) for (file, _) in files], []))
+        if not failed and child and (args.merge_size <= 0 or merge):
+            info = FileInfo()
+            info.lumis = outputs.pop(id)
+            info.events = len(info.lumis) * 100
+            info.size = len(info.lumis) * 1000
+            propagate.append(('/store/benchmark/{0}/{1}.root'.format(label, id), info))
+
+    with store.transaction():
+        with measure('update_units'):
+            store.update_units(dict(updates))
+        if propagate:
+            with measure('register_files'):
+                store.register_files(propagate, child, unique_args)
+
+
+start = time.time()
+cycles = 0
+while cycles < args.cycles:
+    with measure('done'):
+        if store.merged() and store.unfinished_units() == 0:
+            break
+    cycles += 1
+
+    created = []
+    with store.transaction():
+        for label in labels:
+            with measure('work_left'):
+                complete, units_left, tasks_left = store.work_left(label)
+            with measure('pop_unmerged_tasks'):
+                created.append((label, store.pop_unmerged_tasks(label, args.merge_size, 10)))
+            if tasks_left > 0:
+                with measure('pop_units'):
+                    created.append((label, store.pop_units(label, args.tasks)))
+        with measure('archive_tasks'):
+            store.archive_tasks()
+
+    for label, tasks in created:
+        if tasks:
+            finish(label, tasks)
+elapsed = time.time() - start
+
+with measure('optimize'):
+    store.optimize()
+store.disconnect()
+
+print 'ran {0} cycles in {1:.1f} s, {2} units in total'.format(
+    cycles, elapsed, args.files * args.lumis * sum(args.arguments ** (n + 1) for n in range(len(labels))))
+print '{0:<20} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}'.format(
+    'operation', 'calls', 'total/s', 'p50/ms', 'p90/ms', 'p99/ms', 'max/ms')
+for what, times in sorted(timings.items()):
+    p50, p90, p99, pmax = np.percentile(times, [50, 90, 99, 100]) * 1e3
+    print '{0:<20} {1:>8} {2:>10.2f} {3:>10.2f} {4:>10.2f} {5:>10.2f} {6:>10.2f}'.format(
+        what, len(times), sum(times), p50, p90, p99, pmax)
+
+size = sum(os.path.getsize(os.path.join(workdir, fn))
+           for fn in os.listdir(workdir) if fn.startswith('lobster.db'))
+print 'database size: {0:.1f} MB'.format(size / 1024. ** 2)
+print 'peak memory: {0:.1f} MB'.format(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+
+if not args.workdir:
+    shutil.rmtree(workdir)
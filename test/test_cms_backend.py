@@ -1,14 +1,29 @@
 # vim: foldmethod=marker
 import os
 import shutil
+import sqlite3
 import tempfile
 
+from collections import Counter
+
 from lobster import cmssw, se
 from lobster.cmssw.dataset import DatasetInfo
-from lobster.core.task import TaskHandler
-from lobster.core.unit import TaskUpdate, UnitStore
+from lobster.core.task import ProductionTaskHandler, TaskHandler
+from lobster.core.unit import StatementStats, TaskUpdate, UnitStore, WORKFLOW_COLUMNS
 from lobster.core.config import Config, AdvancedOptions
+from lobster.core.dataset import ProductionDataset
 from lobster.core.workflow import Workflow
+from lobster.util import PartiallyMutable
+
+
+def create_config(workdir):
+    return Config(
+        label='test',
+        workdir=workdir,
+        storage=se.StorageConfiguration(output=['file://' + workdir]),
+        workflows=[],
+        advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version="3.3")
+    )
 
 
 class DummyInterface(object):
@@ -36,15 +51,7 @@ class TestSQLBackend(object):
     def setup_class(cls):
         os.environ['LOCALRT'] = ''
         cls.workdir = tempfile.mkdtemp()
-        cls.interface = UnitStore(
-            Config(
-                label='test',
-                workdir=cls.workdir,
-                storage=se.StorageConfiguration(output=['file://' + cls.workdir]),
-                workflows=[],
-                advanced=AdvancedOptions(proxy=False, dashboard=False, osg_version="3.3")
-            )
-        )
+        cls.interface = UnitStore(create_config(cls.workdir))
 
     @classmethod
     def teardown_class(cls):
@@ -128,6 +135,170 @@ class TestSQLBackend(object):
         assert total == 1100
         # }}}
 
+    def test_readonly(self):
+        # {{{
+        reader = UnitStore(self.interface.config, readonly=True)
+
+        def labels():
+            return [l for (l,) in reader.db.execute("select label from workflows order by label")]
+
+        with reader.snapshot():
+            assert labels() == []
+            with self.interface.transaction():
+                self.interface.db.execute("insert into workflows(label) values ('test_snapshot')")
+            # the master is not blocked, but the snapshot is unchanged
+            assert labels() == []
+
+        assert labels() == ['test_snapshot']
+
+        try:
+            reader.db.execute("delete from workflows")
+            assert False
+        except sqlite3.OperationalError:
+            pass
+        reader.disconnect()
+
+        workdir = tempfile.mkdtemp()
+        try:
+            config = create_config(workdir)
+            try:
+                UnitStore(config, readonly=True)
+                assert False
+            except IOError:
+                pass
+            assert os.listdir(workdir) == []
+        finally:
+            shutil.rmtree(workdir)
+        # }}}
+
+    def test_upgrade(self):
+        # {{{
+        workdir = tempfile.mkdtemp()
+        try:
+            config = create_config(workdir)
+            store = UnitStore(config)
+            store.register_dataset(
+                *self.create_dbs_dataset('test_upgrade', lumis=10, filesize=3, tasksize=5))
+            (task, _, _, _, _, _) = store.pop_units('test_upgrade', 1)[0]
+            with store.transaction() as db:
+                db.execute("""
+                    update tasks set
+                        status=2, events_read=500, events_written=100, units_processed=5
+                    where id=?""", (task,))
+                store.recount_workflow_stats('test_upgrade')
+
+            def counters(store):
+                return store.db.execute("""
+                    select units_registered, units_running, units_done, units_stuck_own,
+                        units_unmerged, events_read, events_written
+                    from workflows where label='test_upgrade'""").fetchone()
+
+            stored = counters(store)
+            assert stored[4:] == (5, 500, 100)
+
+            def strip(db, table, removed):
+                columns = [row[1] for row in db.execute("pragma table_info({0})".format(table))
+                           if row[1] not in removed]
+                db.execute("create table old as select {0} from {1}".format(', '.join(columns), table))
+                db.execute("drop table {0}".format(table))
+                db.execute("alter table old rename to {0}".format(table))
+
+            # pretend that the database was created by an earlier version
+            with store.transaction() as db:
+                strip(db, 'workflows', dict(WORKFLOW_COLUMNS))
+                strip(db, 'units_test_upgrade', ['lumis'])
+                db.execute("drop table tasks_archive")
+            store.disconnect()
+
+            # readers do not write, and refuse outdated databases
+            try:
+                UnitStore(config, readonly=True)
+                assert False
+            except IOError:
+                pass
+
+            store = UnitStore(config)
+            assert counters(store) == stored
+            assert store.db.execute("select count(*) from tasks_archive").fetchone() == (0,)
+            store.disconnect()
+
+            reader = UnitStore(config, readonly=True)
+            assert counters(reader) == stored
+            reader.disconnect()
+
+            store = UnitStore(config)
+            assert len(store.pop_units('test_upgrade', 1)) == 1
+            assert counters(store)[:2] == (10, 10)
+            store.disconnect()
+        finally:
+            shutil.rmtree(workdir)
+        # }}}
+
+    def test_transaction(self):
+        # {{{
+        reader = sqlite3.connect(self.interface.db_path)
+
+        def labels():
+            return [l for (l,) in reader.execute("select label from workflows order by label")]
+
+        with self.interface.transaction():
+            self.interface.db.execute("insert into workflows(label) values ('test_outer')")
+            try:
+                with self.interface.transaction():
+                    self.interface.db.execute("insert into workflows(label) values ('test_inner')")
+                    raise ValueError
+            except ValueError:
+                pass
+            with self.interface.transaction():
+                self.interface.db.execute("insert into workflows(label) values ('test_nested')")
+
+            # nothing is committed before the outermost context exits, and
+            # readers are not blocked in the meantime
+            assert labels() == []
+
+        assert labels() == ['test_nested', 'test_outer']
+        # }}}
+
+    def test_transaction_commit_failure(self):
+        # {{{
+        db = self.interface.db
+        execute = db.execute
+
+        def busy(sql, *args):
+            if sql == 'commit':
+                raise sqlite3.OperationalError('database is locked')
+            return execute(sql, *args)
+
+        db.execute = busy
+        try:
+            with self.interface.transaction():
+                self.interface.db.execute("insert into workflows(label) values ('test_failed')")
+            assert False
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            del db.execute
+
+        # the failed transaction is rolled back, and new ones can start
+        with self.interface.transaction():
+            self.interface.db.execute("insert into workflows(label) values ('test_after')")
+        assert [l for (l,) in db.execute("select label from workflows")] == ['test_after']
+        # }}}
+
+    def test_statement_stats(self):
+        # {{{
+        sql = "insert into workflows(label) values (?)"
+        calls, _, _, rows = self.interface.db.stats.get(sql, (0, 0, 0, 0))
+        self.interface.db.executemany(sql, [('test_stats_1',), ('test_stats_2',)])
+        assert self.interface.db.stats[sql][0] == calls + 1
+        assert self.interface.db.stats[sql][3] == rows + 2
+
+        self.interface.db.save(self.interface.db_path + '.stats')
+        stats = StatementStats(sqlite3.connect(':memory:'))
+        stats.load(self.interface.db_path + '.stats')
+        assert stats.stats[sql][0] == calls + 1
+        # }}}
+
     def test_handler(self):
         # {{{
         self.interface.register_dataset(
@@ -507,6 +678,309 @@ class TestSQLBackend(object):
         assert ew == 200
         # }}}
 
+    def test_counters(self):
+        # {{{
+        advanced = self.interface.config.advanced
+        advanced.threshold_for_skipping = 1
+        try:
+            self.interface.register_dataset(
+                *self.create_dbs_dataset(
+                    'test_counters', lumis=15, filesize=3, tasksize=8))
+            (id, label, files, lumis, arg, _) = self.interface.pop_units('test_counters', 1)[0]
+            self.interface.pop_units('test_counters', 1)
+
+            task_update = TaskUpdate(host='hostname', id=id)
+            handler = TaskHandler(id, label, files, lumis, None, True)
+            file_update, unit_update = handler.get_unit_info(
+                False,
+                task_update,
+                {
+                    '/test/0.root': (300, [(1, 1), (1, 2), (1, 3)]),
+                    '/test/1.root': (300, [(1, 4), (1, 5)]),
+                },
+                ['/test/2.root'],
+                100
+            )
+
+            self.interface.update_units({(label, "units_" + label): [(task_update, file_update, unit_update)]})
+
+            def counters():
+                return self.interface.db.execute("""
+                    select
+                        units_running, units_done, units_stuck, units_available, units_left,
+                        units_failed, units_skipped, units_unmerged, events_read, events_written
+                    from workflows where label=?""", (label,)).fetchone()
+
+            (jr, jd, js, ja, jl, jf, jsk, ju, er, ew) = counters()
+
+            assert jr == 7
+            assert jd == 5
+            assert js == 2
+            assert ja == 1
+            assert jl == 1
+            assert jf == 0
+            assert jsk == 2
+            assert ju == 5
+            assert er == 600
+            assert ew == 100
+
+            # the full recount should not change anything
+            with self.interface.transaction():
+                self.interface.recount_workflow_stats(label)
+
+            assert counters() == (jr, jd, js, ja, jl, jf, jsk, ju, er, ew)
+        finally:
+            advanced.threshold_for_skipping = 30
+        # }}}
+
+    def test_workflow_state(self):
+        # {{{
+        self.interface.register_dataset(
+            *self.create_dbs_dataset('test_workflow_state', lumis=10, filesize=3, tasksize=5))
+
+        def queries():
+            return sum(calls for (sql, (calls, _, _, _)) in self.interface.db.stats.items()
+                       if sql.startswith('select id, label, tasksize'))
+
+        before = queries()
+        assert self.interface.work_left('test_workflow_state') == (True, 10, 2.)
+        assert self.interface.unfinished_units() == 10
+        assert not self.interface.merged()
+        assert queries() == before + 1
+
+        self.interface.pop_units('test_workflow_state', 1)
+        assert self.interface.running_units() == 5
+        assert self.interface.estimate_tasks_left() == 1
+        assert queries() == before + 2
+
+        # only writes to workflows drop the state
+        with self.interface.transaction() as db:
+            db.execute("update tasks set host='hostname'")
+        assert self.interface.running_units() == 5
+        assert queries() == before + 2
+
+        # as do rollbacks, since the state may contain undone changes
+        try:
+            with self.interface.transaction():
+                self.interface.pop_units('test_workflow_state', 1)
+                assert self.interface.running_units() == 10
+                raise ValueError
+        except ValueError:
+            pass
+        assert self.interface.running_units() == 5
+        # }}}
+
+    def test_archive(self):
+        # {{{
+        # tasks left behind by other tests
+        self.interface.archive_tasks()
+
+        self.interface.register_dataset(
+            *self.create_dbs_dataset('test_archive', lumis=10, filesize=3, tasksize=5))
+        (merged, _, _, _, _, _) = self.interface.pop_units('test_archive', 1)[0]
+        (merge, _, _, _, _, _) = self.interface.pop_units('test_archive', 1)[0]
+        maxid = self.interface.max_taskid()
+
+        # pretend that the second task merged the first one
+        with self.interface.transaction() as db:
+            db.execute("""
+                update tasks set
+                    status=8, task=?, time_stage_in_end=10, time_epilogue_end=110
+                where id=?""", (merge, merged))
+            db.execute("update tasks set status=2, type=1 where id=?", (merge,))
+
+        def tasks(table):
+            return sorted(self.interface.db.execute(
+                "select id, status from {0} where id in (?, ?)".format(table), (merged, merge)))
+
+        def counters():
+            return self.interface.db.execute("""
+                select tasks_archived, unittime_archived, units_done, units_merged, units_unmerged
+                from workflows where label=?""", ('test_archive',)).fetchone()
+
+        assert self.interface.archive_tasks() == 1
+        assert tasks('tasks') == [(int(merge), 2)]
+        assert tasks('tasks_archive') == [(int(merged), 8)]
+        assert counters()[:2] == (1, 20.)
+        assert self.interface.max_taskid() == maxid
+        assert [int(merged)] == [id for (id, _) in self.interface.merged_tasks('test_archive')]
+
+        # a missing merge output resets the merged task from the archive
+        self.interface.update_missing([int(merge)])
+        assert tasks('tasks') == [(int(merged), 2), (int(merge), 3)]
+        assert tasks('tasks_archive') == []
+        assert counters()[:2] == (0, 0.)
+
+        assert self.interface.archive_tasks() == 1
+        assert tasks('tasks_archive') == [(int(merge), 3)]
+        assert [int(merge)] == [id for (id, _) in self.interface.failed_tasks('test_archive')]
+
+        stored = counters()
+        with self.interface.transaction():
+            self.interface.recount_workflow_stats('test_archive')
+        assert counters() == stored
+
+        self.interface.optimize()
+        # }}}
+
+    def test_transfers(self):
+        # {{{
+        self.interface.register_dataset(
+            *self.create_dbs_dataset('test_transfers', lumis=5, filesize=2.2, tasksize=3))
+
+        for i in range(2):
+            self.interface.update_transfers({
+                'test_transfers': {
+                    'root': Counter({'stage-in success': 3, 'stageout failure': 1}),
+                    'srm': Counter({'stageout success': 2})
+                }
+            })
+
+        assert self.interface.transfers('test_transfers') == {
+            'root': {'stage-in success': 6, 'stageout failure': 2},
+            'srm': {'stageout success': 4}
+        }
+        # }}}
+
+    def test_merge(self):
+        # {{{
+        self.interface.register_dataset(
+            *self.create_dbs_dataset('test_merge', lumis=20, filesize=2.2, tasksize=3))
+        (workflow,) = self.interface.db.execute(
+            "select id from workflows where label='test_merge'").fetchone()
+
+        def finish(*sizes):
+            with self.interface.transaction() as db:
+                for size in sizes:
+                    db.execute("""
+                        insert into tasks(workflow, status, type, units, bytes_bare_output)
+                        values (?, 2, 0, 1, ?)""", (workflow, size))
+
+        def merges():
+            return [
+                sorted(self.interface.db.execute(
+                    "select bytes_bare_output from tasks where task=?", (int(id),)).fetchall())
+                for (id, _, _, _, _, _) in self.interface.pop_unmerged_tasks('test_merge', 100, 10)
+            ]
+
+        finish(20, 60, 50, 40, 30)
+        assert merges() == [[(40,), (60,)], [(20,), (30,), (50,)]]
+
+        # open merges are kept until they are close enough to the target
+        finish(45, 44)
+        assert merges() == []
+        finish(10, 5)
+        assert merges() == [[(10,), (44,), (45,)]]
+        # }}}
+
+    def test_unit_ranges(self):
+        # {{{
+        advanced = self.interface.config.advanced
+        with PartiallyMutable.unlock():
+            advanced.unit_ranges = True
+        try:
+            info = DatasetInfo()
+            info.file_based = True
+            info.tasksize = 4
+            info.files[None].lumis = [(1, x) for x in range(1, 11)] + [(2, x) for x in range(1, 6)]
+            info.total_units = 15
+
+            self.interface.register_dataset(Workflow('test_ranges', None, command="foo"), info)
+
+            def rows():
+                return self.interface.db.execute(
+                    "select run, lumi, lumis, status from units_test_ranges order by run, lumi").fetchall()
+
+            assert rows() == [(1, 1, 10, 0), (2, 1, 5, 0)]
+
+            tasks = self.interface.pop_units('test_ranges', 2)
+            assert [[(run, lumi) for (_, _, run, lumi) in units] for (_, _, _, units, _, _) in tasks] == [
+                [(1, 1), (1, 2), (1, 3), (1, 4)],
+                [(1, 5), (1, 6), (1, 7), (1, 8)]
+            ]
+            # each task is assigned one slice of the range
+            assert rows() == [(1, 1, 4, 1), (1, 5, 4, 1), (1, 9, 2, 0), (2, 1, 5, 0)]
+
+            (id, label, files, lumis, arg, _) = tasks[0]
+            task_update = TaskUpdate(host='hostname', id=id)
+            handler = TaskHandler(id, label, files, lumis, None, True)
+            file_update, unit_update = handler.get_unit_info(
+                False,
+                task_update,
+                {None: (400, [(1, x) for x in range(1, 5)])},
+                [],
+                100
+            )
+            self.interface.update_units({(label, "units_" + label): [(task_update, file_update, unit_update)]})
+
+            def counters():
+                return self.interface.db.execute("""
+                    select units_registered, units_running, units_done, units_available, units_left
+                    from workflows where label=?""", (label,)).fetchone()
+
+            assert counters() == (15, 4, 4, 7, 7)
+
+            # the full recount should not change anything
+            with self.interface.transaction():
+                self.interface.recount_workflow_stats(label)
+
+            assert counters() == (15, 4, 4, 7, 7)
+        finally:
+            with PartiallyMutable.unlock():
+                advanced.unit_ranges = False
+        # }}}
+
+    def test_unit_ranges_cycle(self):
+        # {{{
+        advanced = self.interface.config.advanced
+        with PartiallyMutable.unlock():
+            advanced.unit_ranges = True
+        try:
+            info = ProductionDataset(total_events=1000, events_per_lumi=10, lumis_per_task=7).get_info()
+            self.interface.register_dataset(Workflow('test_ranges_cycle', None, command="foo"), info)
+
+            tasks = self.interface.pop_units('test_ranges_cycle', 20)
+            assert [len(units) for (_, _, _, units, _, _) in tasks] == [7] * 14 + [2]
+
+            updates = []
+            for (id, label, files, lumis, arg, _) in tasks:
+                task_update = TaskUpdate(host='hostname', id=id)
+                handler = ProductionTaskHandler(id, label, lumis, None, True)
+                file_update, unit_update = handler.get_unit_info(False, task_update, {}, [], 10 * len(lumis))
+                updates.append((task_update, file_update, unit_update))
+            self.interface.update_units({(label, "units_" + label): updates})
+
+            # one record per task, rather than one per luminosity section
+            (rows, lumis) = self.interface.db.execute(
+                "select count(*), sum(lumis) from units_test_ranges_cycle").fetchone()
+            assert (rows, lumis) == (15, 100)
+
+            (done, left) = self.interface.db.execute(
+                "select units_done, units_left from workflows where label=?", (label,)).fetchone()
+            assert (done, left) == (100, 0)
+        finally:
+            with PartiallyMutable.unlock():
+                advanced.unit_ranges = False
+        # }}}
+
+    def test_register_production(self):
+        # {{{
+        info = ProductionDataset(total_events=25000, events_per_lumi=1, lumis_per_task=100).get_info()
+        self.interface.register_dataset(Workflow('test_production', None, command="foo"), info)
+
+        (units, registered, available) = self.interface.db.execute(
+            "select units, units_registered, units_available from workflows where label=?",
+            ('test_production',)).fetchone()
+        (files, file_units) = self.interface.db.execute(
+            "select count(*), sum(units) from files_test_production").fetchone()
+        (rows, first, last) = self.interface.db.execute(
+            "select count(*), min(lumi), max(lumi) from units_test_production").fetchone()
+
+        assert units == registered == available == 25000
+        assert (files, file_units) == (1, 25000)
+        assert (rows, first, last) == (25000, 1, 25000)
+        # }}}
+
     def test_file_obtain(self):
         # {{{
         self.interface.register_dataset(
@@ -0,0 +1,51 @@
+import threading
+import unittest
+
+from lobster.cmssw.dash import Sender
+
+
+class RecordingSender(Sender):
+
+    def __init__(self, size):
+        self.sent = []
+        self.blocked = threading.Event()
+        Sender.__init__(self, size)
+
+    def _Sender__send(self, data):
+        self.blocked.wait()
+        self.sent.append([(p['MessageType'], p['jobId'], p.get('StatusValue')) for p in data])
+
+
+class TestSender(unittest.TestCase):
+
+    def test_coalescing(self):
+        sender = RecordingSender(10)
+        sender.put('JobStatus', [{'jobId': 'a', 'StatusValue': 'Pending'}])
+        sender.put('JobMeta', [{'jobId': 'b'}])
+        sender.put('JobStatus', [
+            {'jobId': 'b', 'StatusValue': 'Pending'},
+            {'jobId': 'b', 'StatusValue': 'Done'},
+            {'jobId': 'c', 'StatusValue': 'Pending'}
+        ])
+        sender.blocked.set()
+        sender.flush(10)
+        sender.stop(10)
+
+        sent = sum(sender.sent, [])
+        assert len(sent) == 4
+        # a newer status replaces a pending one
+        assert ('JobStatus', 'b', 'Done') in sent
+        assert ('JobStatus', 'b', 'Pending') not in sent
+        # registrations are sent before status updates
+        assert sent.index(('JobMeta', 'b', None)) < sent.index(('JobStatus', 'b', 'Done'))
+
+    def test_stop(self):
+        sender = RecordingSender(10)
+        sender.put('JobStatus', [{'jobId': 'a', 'StatusValue': 'Pending'}])
+        sender.blocked.set()
+        sender.stop(10)
+
+        assert sender.sent == [[('JobStatus', 'a', 'Pending')]]
+        assert not sender._Sender__thread.is_alive()
+        # stopping again does no harm
+        sender.stop(10)
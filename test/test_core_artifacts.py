@@ -0,0 +1,83 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from lobster import util
+from lobster.core.artifacts import ArtifactStore
+
+
+class TestArtifactStore(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def populate(self, task):
+        tdir = util.taskdir(self.workdir, task)
+        with open(os.path.join(tdir, 'report.json'), 'w') as f:
+            f.write('{{"task": {0}}}'.format(task))
+        with open(os.path.join(tdir, 'parameters.json'), 'w') as f:
+            f.write('{}')
+        f = gzip.open(os.path.join(tdir, 'task.log.gz'), 'wb')
+        f.write('log of task {0}\n'.format(task))
+        f.close()
+        return tdir
+
+    def test_packed(self):
+        store = ArtifactStore(self.workdir, packed=True)
+        for task in (1, 10001, 10002):
+            tdir = self.populate(task)
+            store.archive(task, 'successful' if task % 2 == 0 else 'failed')
+            assert not os.path.exists(tdir)
+        assert not os.path.exists(os.path.join(self.workdir, 'running'))
+        assert not os.path.exists(os.path.join(self.workdir, 'successful'))
+
+        # new instance, as used by the commands
+        store = ArtifactStore(self.workdir)
+        assert store.open(10002, 'report.json').read() == '{"task": 10002}'
+        assert store.exists(10001, 'task.log.gz', 'failed')
+        assert not store.exists(10001, 'task.log.gz', 'successful')
+        log = gzip.GzipFile(fileobj=store.open(1, 'task.log.gz', 'failed'))
+        assert log.read() == 'log of task 1\n'
+        self.assertRaises(IOError, store.open, 3, 'report.json')
+
+        target = store.path(10002, 'report.json', 'successful', os.path.join(self.workdir, 'merge'))
+        assert target.endswith(os.path.join('0001', '0002', 'report.json'))
+        with open(target) as f:
+            assert f.read() == '{"task": 10002}'
+
+    def test_unpacked(self):
+        store = ArtifactStore(self.workdir, packed=True)
+        self.populate(1)
+        store.archive(1, 'successful')
+
+        # switching storage keeps previous tasks accessible
+        store = ArtifactStore(self.workdir)
+        self.populate(2)
+        assert store.archive(2, 'successful') == util.taskdir(self.workdir, 2, 'successful', create=False)
+        for task in (1, 2):
+            assert store.open(task, 'report.json').read() == '{{"task": {0}}}'.format(task)
+        assert store.path(2, 'report.json', 'successful', None) == \
+            os.path.join(util.taskdir(self.workdir, 2, 'successful', create=False), 'report.json')
+        assert store.path(3, 'report.json', 'successful', None) is None
+
+    def test_readonly(self):
+        store = ArtifactStore(self.workdir, readonly=True)
+        assert not store.exists(1, 'report.json')
+        # nothing is created for readers
+        assert os.listdir(self.workdir) == []
+
+        writer = ArtifactStore(self.workdir, packed=True)
+        self.populate(1)
+        writer.archive(1, 'successful')
+
+        store = ArtifactStore(self.workdir, packed=True, readonly=True)
+        assert store.open(1, 'report.json').read() == '{"task": 1}'
+        self.assertRaises(sqlite3.OperationalError, store._ArtifactStore__db.execute, "delete from artifacts")
+        self.populate(2)
+        self.assertRaises(IOError, store.archive, 2, 'successful')
@@ -0,0 +1,62 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lobster import util
+from lobster.core.metrics import Metrics
+
+
+class Timed(util.Timing):
+
+    def __init__(self):
+        util.Timing.__init__(self, 'create', 'fetch')
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_timing(self):
+        timing = Timed()
+        for _ in range(3):
+            with timing.measure('create'):
+                pass
+        count, bins, total = timing.histograms['create']
+        assert count == 3
+        assert bins[0] == 3 and sum(bins) == 3
+        assert len(bins) == len(util.Timing.buckets) + 1
+        assert timing.histograms['fetch'] == (0, [0] * len(bins), 0)
+
+    def test_exposition(self):
+        metrics = Metrics(project='test')
+        metrics.gauge('lobster_units_left', 'Units left', 5)
+        metrics.counter('lobster_queue_tasks_complete', 'Tasks', 3, category='all')
+        metrics.counter('lobster_queue_bytes_sent_total', 'Bytes', 7, category='all')
+        metrics.histogram('lobster_step_duration_seconds', 'Steps', (0.1, 1),
+                          {'fetch': (3, [1, 2, 0], 1.5)}, 'step', component='master')
+        lines = metrics.text().splitlines()
+
+        assert '# TYPE lobster_units_left gauge' in lines
+        assert 'lobster_units_left{project="test"} 5' in lines
+        assert '# TYPE lobster_queue_tasks_complete_total counter' in lines
+        assert 'lobster_queue_tasks_complete_total{category="all",project="test"} 3' in lines
+        assert 'lobster_queue_bytes_sent_total{category="all",project="test"} 7' in lines
+        assert '# TYPE lobster_step_duration_seconds histogram' in lines
+        prefix = 'lobster_step_duration_seconds_bucket{component="master",'
+        assert prefix + 'le="0.1",project="test",step="fetch"} 1' in lines
+        assert prefix + 'le="1",project="test",step="fetch"} 3' in lines
+        assert prefix + 'le="+Inf",project="test",step="fetch"} 3' in lines
+        assert 'lobster_step_duration_seconds_sum{component="master",project="test",step="fetch"} 1.5' in lines
+        assert 'lobster_step_duration_seconds_count{component="master",project="test",step="fetch"} 3' in lines
+
+    def test_write(self):
+        workdir = tempfile.mkdtemp()
+        try:
+            fn = os.path.join(workdir, 'metrics.prom')
+            metrics = Metrics()
+            metrics.gauge('lobster_units_left', 'Units left', 5)
+            metrics.write(fn)
+            assert os.listdir(workdir) == ['metrics.prom']
+            with open(fn) as f:
+                assert f.read().endswith('lobster_units_left 5\n')
+        finally:
+            shutil.rmtree(workdir)
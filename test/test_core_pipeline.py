@@ -0,0 +1,106 @@
+import time
+import unittest
+
+from contextlib import contextmanager
+
+from lobster.core.pipeline import Pipeline, ReturnWindow
+
+
+class FakeSource(object):
+
+    def __init__(self):
+        self.released = []
+        self.created = 0
+        self.depth = 0
+
+    @contextmanager
+    def transaction(self):
+        self.depth += 1
+        assert self.depth == 1
+        yield
+        self.depth -= 1
+
+    def release(self, tasks):
+        if 'bad' in tasks:
+            raise ValueError(tasks)
+        time.sleep(0.01)
+        self.released.extend(tasks)
+
+    def obtain(self, total, have):
+        for _ in range(total):
+            self.created += 1
+            yield self.created
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.source = FakeSource()
+        self.pipeline = Pipeline(self.source, 3)
+
+    def tearDown(self):
+        self.pipeline.stop()
+
+    def test_release(self):
+        for n in range(20):
+            self.pipeline.put(n)
+        self.pipeline.drain()
+        assert self.source.released == range(20)
+        (count, _, _) = self.pipeline.histograms['return']
+        assert count > 0
+
+    def test_create(self):
+        assert self.pipeline.request(4, {})
+        # only one request at a time
+        assert not self.pipeline.request(4, {})
+        tasks = []
+        end = time.time() + 10
+        while len(tasks) < 4 and time.time() < end:
+            tasks += self.pipeline.created()
+        assert tasks == [1, 2, 3, 4]
+        assert self.pipeline.histograms['create'][0] == 1
+
+    def test_create_failure(self):
+        def obtain(total, have):
+            yield 1
+            raise ValueError
+        self.source.obtain = obtain
+        assert self.pipeline.request(4, {})
+        # tasks of a failed transaction are never handed out
+        end = time.time() + 10
+        while time.time() < end:
+            assert self.pipeline.created() == []
+            try:
+                self.pipeline.check()
+            except ValueError:
+                break
+        self.assertRaises(ValueError, self.pipeline.check)
+
+    def test_failure(self):
+        self.pipeline.put('bad')
+        self.assertRaises(ValueError, self.pipeline.drain)
+        assert self.pipeline.failed == ['bad']
+
+
+class TestReturnWindow(unittest.TestCase):
+
+    def test_initial(self):
+        window = ReturnWindow(minimum=1, maximum=120)
+        assert window.batch is None
+        # keep collecting while tasks are waiting
+        assert window.remaining(1, 10, 5) == 110
+        assert window.remaining(1, 0.5, 0) == 0.5
+        assert window.remaining(1, 10, 0) == 0
+
+    def test_overhead(self):
+        window = ReturnWindow(minimum=1, maximum=120, target=0.2, smoothing=1)
+        window.update(5, 100, 10, 20)
+        # amortize the overhead of an iteration
+        assert window.window == 20
+        assert window.remaining(10, 5, 0) == 15
+        # the next iteration takes 45s, during which 450 tasks return
+        assert window.remaining(200, 25, 300) == 0
+        assert window.remaining(200, 25, 500) == 95
+        # releasing a batch should take at most a minute
+        assert window.batch == 300
+        assert window.remaining(300, 25, 10000) == 0
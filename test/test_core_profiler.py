@@ -0,0 +1,47 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from lobster.core.profiler import SamplingProfiler
+
+
+def spin(stop):
+    while not stop.is_set():
+        sum(range(100))
+
+
+class TestSamplingProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_collapsed(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=spin, args=(stop,), name='worker')
+        worker.start()
+        try:
+            fn = os.path.join(self.workdir, 'profile.folded')
+            profiler = SamplingProfiler(fn, duration=0.2, interval=0.01)
+            profiler.start()
+            assert profiler.running()
+            profiler.join()
+        finally:
+            stop.set()
+            worker.join()
+
+        assert profiler.samples > 0
+        assert os.listdir(self.workdir) == ['profile.folded']
+        with open(fn) as f:
+            lines = f.readlines()
+        stacks = dict(line.rsplit(' ', 1) for line in lines)
+        spinning = [s for s in stacks if s.startswith('worker;') and s.endswith(';spin ({0}:{1})'.format(
+            spin.__code__.co_filename, spin.__code__.co_firstlineno))]
+        assert len(spinning) == 1
+        assert sum(int(c) for s, c in stacks.items() if s.startswith('worker;')) == profiler.samples
+        # the profiler does not sample itself
+        assert not any(s.startswith('profiler;') for s in stacks)
@@ -0,0 +1,43 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from lobster import util
+
+
+class TestCheckpoints(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_persistence(self):
+        assert util.checkpoint(self.workdir, 'KILLED') is None
+        util.register_checkpoint(self.workdir, 'KILLED', 'PENDING')
+        util.register_checkpoint(self.workdir, 'version', '1.6')
+        assert util.checkpoint(self.workdir, 'KILLED') == 'PENDING'
+
+        assert os.listdir(self.workdir) == ['status.json']
+        with open(os.path.join(self.workdir, 'status.json')) as f:
+            assert json.load(f) == {'KILLED': 'PENDING', 'version': '1.6'}
+
+    def test_other_process(self):
+        master = util.Checkpoints(self.workdir, interval=3600)
+        other = util.Checkpoints(self.workdir)
+        other.set('KILLED', 'RESTART')
+        assert master.get('KILLED') == 'RESTART'
+
+        other.set('KILLED', 'PENDING')
+        # still trusting the checkpoints in memory
+        assert master.get('KILLED') == 'RESTART'
+        master.expire()
+        assert master.get('KILLED') == 'PENDING'
+
+        # changes are merged with the ones on disk
+        master.set('version', '1.6')
+        assert other.get('KILLED') == 'PENDING'
+        assert other.get('version') == '1.6'